@@ -0,0 +1,10 @@
+"""
+Benchmarks of provisioning throughput against local fakes.
+
+A local http server stands in for the digital ocean v1 and v2 apis, with
+configurable boot latency, rate limit, and error injection. Juju's api,
+the juju cli, and ssh to the droplets are faked too, so commands run end
+to end without touching a cloud. Run with::
+
+  $ python -m juju_docean.bench.run -n 1,10,100
+"""
@@ -0,0 +1,607 @@
+"""
+Local stand in for the digital ocean v1 and v2 apis.
+
+Droplets boot after a configurable latency, requests are counted against
+a rolling hour budget reported in rate limit headers, and a fraction of
+requests can be failed with server errors, or creates rejected as a
+region would when it's out of capacity. Droplets are given loopback
+addresses, so a fake ssh endpoint listening on all interfaces answers
+for every one of them.
+"""
+import BaseHTTPServer
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+
+# slug, memory (mb), vcpus, disk (gb), transfer (tb), price (/mth)
+SIZES = (
+    ('512mb', 512, 1, 20, 1, 5.0),
+    ('1gb', 1024, 1, 30, 2, 10.0),
+    ('2gb', 2048, 2, 40, 3, 20.0),
+    ('4gb', 4096, 2, 60, 4, 40.0),
+    ('8gb', 8192, 4, 80, 5, 80.0),
+    ('16gb', 16384, 8, 160, 6, 160.0))
+
+REGIONS = (
+    ('nyc3', 'New York 3'),
+    ('sfo1', 'San Francisco 1'),
+    ('ams2', 'Amsterdam 2'),
+    ('lon1', 'London 1'))
+
+IMAGES = (
+    (1001, 'ubuntu-14-04-x64', '14.04 x64'),
+    (1002, 'ubuntu-12-04-x64', '12.04 x64'))
+
+SSH_KEYS = ({'id': 1, 'name': 'bench'},)
+
+
+def timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+class APIError(Exception):
+
+    def __init__(self, status, id, message):
+        self.status = status
+        self.id = id
+        self.message = message
+
+
+class FakeCloud(object):
+    """Droplet, tag and action state behind the fake api.
+    """
+
+    def __init__(self, boot_latency=2.0, rate_limit=5000, error_rate=0.0,
+                 reject_rate=0.0, window=3600.0):
+        self.boot_latency = boot_latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.window = window
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.droplets = {}
+        self.tags = {}
+        self.actions = {}
+        self.snapshots = {}
+        self.counts = collections.Counter()
+        self.statuses = collections.Counter()
+        self.tokens = float(rate_limit)
+        self.refilled = time.time()
+
+    # Request accounting
+
+    def count(self, method, route, status):
+        with self.lock:
+            self.counts["%s %s" % (method, route)] += 1
+            self.statuses[status] += 1
+
+    def take_token(self):
+        """Spend one request of the budget, returning whether any was left
+        along with the rate limit headers to report.
+        """
+        with self.lock:
+            now = time.time()
+            rate = self.rate_limit / self.window
+            self.tokens = min(
+                self.rate_limit, self.tokens + (now - self.refilled) * rate)
+            self.refilled = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            headers = {
+                'RateLimit-Limit': str(self.rate_limit),
+                'RateLimit-Remaining': str(int(self.tokens)),
+                'RateLimit-Reset': str(int(
+                    now + (self.rate_limit - self.tokens) / rate))}
+        return allowed, headers
+
+    def inject_error(self, create=False):
+        if self.error_rate and random.random() < self.error_rate:
+            raise APIError(500, 'server_error', "Injected server error")
+        if create and self.reject_rate and \
+                random.random() < self.reject_rate:
+            raise APIError(
+                422, 'unprocessable_entity',
+                "Injected rejection, region is out of capacity")
+
+    # Droplets
+
+    def create(self, name, size, region, image, tags=(), active=False):
+        now = time.time()
+        with self.lock:
+            droplet_id = next(self.ids)
+            created = active and now - self.boot_latency or now
+            droplet = {
+                'id': droplet_id, 'name': name, 'size': size,
+                'region': region, 'image': image, 'created': created}
+            self.droplets[droplet_id] = droplet
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(droplet_id)
+            action = self._action('create', droplet_id, self.boot_latency,
+                                  started=created)
+        droplet['action_id'] = action['id']
+        return droplet, action
+
+    def seed(self, names, size, region, image, tags=()):
+        """Create droplets that have already booted.
+        """
+        return [self.create(name, size, region, image, tags, active=True)[0]
+                for name in names]
+
+    def get(self, droplet_id):
+        with self.lock:
+            droplet = self.droplets.get(droplet_id)
+        if droplet is None:
+            raise APIError(
+                404, 'not_found',
+                "The resource you were accessing could not be found.")
+        return droplet
+
+    def list(self, tag_name=None):
+        with self.lock:
+            if tag_name is not None:
+                ids = self.tags.get(tag_name, ())
+                droplets = [self.droplets[i] for i in ids
+                            if i in self.droplets]
+            else:
+                droplets = self.droplets.values()
+        return sorted(droplets, key=lambda d: d['id'])
+
+    def destroy(self, droplet_id):
+        droplet = self.get(droplet_id)
+        if self.action_status(self.actions[droplet['action_id']]) != \
+                'completed':
+            raise APIError(
+                422, 'unprocessable_entity',
+                "Droplet already has a pending event.")
+        with self.lock:
+            self.droplets.pop(droplet_id, None)
+            for ids in self.tags.values():
+                ids.discard(droplet_id)
+            return self._action('destroy', droplet_id, 0)
+
+    def status(self, droplet):
+        if time.time() - droplet['created'] < self.boot_latency:
+            return 'new'
+        return 'active'
+
+    def address(self, droplet):
+        # Loopback addresses are all routed locally.
+        i = droplet['id']
+        return "127.%d.%d.%d" % ((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+    def tag(self, name, droplet_ids, remove=False):
+        with self.lock:
+            tagged = self.tags.setdefault(name, set())
+            for i in droplet_ids:
+                if remove:
+                    tagged.discard(int(i))
+                elif int(i) in self.droplets:
+                    tagged.add(int(i))
+
+    # Actions
+
+    def _action(self, type, droplet_id, duration, started=None):
+        action = {
+            'id': next(self.ids), 'type': type, 'resource_id': droplet_id,
+            'started': started or time.time(), 'duration': duration}
+        self.actions[action['id']] = action
+        return action
+
+    def action(self, type, droplet_id, **params):
+        droplet = self.get(droplet_id)
+        if type == 'rename':
+            droplet['name'] = params['name']
+        elif type == 'snapshot':
+            with self.lock:
+                self.snapshots.setdefault(droplet_id, []).append({
+                    'id': next(self.ids), 'name': params.get('name'),
+                    'slug': None, 'distribution': 'Ubuntu',
+                    'public': False, 'regions': [droplet['region']]})
+        with self.lock:
+            return self._action(type, droplet_id, 0)
+
+    def get_action(self, action_id):
+        with self.lock:
+            action = self.actions.get(action_id)
+        if action is None:
+            raise APIError(404, 'not_found', "Action not found")
+        return action
+
+    def action_status(self, action):
+        if time.time() - action['started'] < action['duration']:
+            return 'in-progress'
+        return 'completed'
+
+
+class V2(object):
+    """Routes and json of the v2 api.
+    """
+
+    version = 'v2'
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.routes = [
+            ('GET', r'/account/keys$', 'keys'),
+            ('GET', r'/sizes$', 'sizes'),
+            ('GET', r'/regions$', 'regions'),
+            ('GET', r'/images$', 'images'),
+            ('GET', r'/droplets$', 'list_droplets'),
+            ('POST', r'/droplets$', 'create_droplets'),
+            ('GET', r'/droplets/(\d+)$', 'get_droplet'),
+            ('DELETE', r'/droplets/(\d+)$', 'destroy_droplet'),
+            ('POST', r'/droplets/(\d+)/actions$', 'droplet_action'),
+            ('GET', r'/droplets/(\d+)/snapshots$', 'snapshots'),
+            ('GET', r'/actions/(\d+)$', 'get_action'),
+            ('POST', r'/tags$', 'create_tag'),
+            ('GET', r'/tags/([^/]+)$', 'get_tag'),
+            ('DELETE', r'/tags/([^/]+)$', 'delete_tag'),
+            ('POST', r'/tags/([^/]+)/resources$', 'tag_resources'),
+            ('DELETE', r'/tags/([^/]+)/resources$', 'untag_resources')]
+
+    def error(self, e):
+        return {'id': e.id, 'message': e.message}
+
+    def keys(self, req):
+        return 200, {'ssh_keys': list(SSH_KEYS)}
+
+    def sizes(self, req):
+        return 200, {'sizes': [
+            {'slug': slug, 'memory': memory, 'vcpus': cpus, 'disk': disk,
+             'transfer': transfer, 'price_monthly': price,
+             'price_hourly': round(price / 672, 5), 'available': True,
+             'regions': [r for r, _ in REGIONS]}
+            for slug, memory, cpus, disk, transfer, price in SIZES]}
+
+    def regions(self, req):
+        return 200, {'regions': [
+            {'slug': slug, 'name': name, 'available': True,
+             'sizes': [s[0] for s in SIZES],
+             'features': ['private_networking', 'backups', 'metadata']}
+            for slug, name in REGIONS]}
+
+    def images(self, req):
+        images = [
+            {'id': id, 'slug': slug, 'name': name, 'distribution': 'Ubuntu',
+             'public': True, 'regions': [r for r, _ in REGIONS]}
+            for id, slug, name in IMAGES]
+        for snapshots in self.cloud.snapshots.values():
+            images.extend(snapshots)
+        return 200, req.page('images', images)
+
+    def droplet(self, d):
+        cloud = self.cloud
+        size = [s for s in SIZES if s[0] == d['size']][0]
+        status = cloud.status(d)
+        networks = []
+        if status == 'active':
+            networks.append({'ip_address': cloud.address(d),
+                             'type': 'public'})
+        return {
+            'id': d['id'], 'name': d['name'], 'status': status,
+            'memory': size[1], 'vcpus': size[2], 'disk': size[3],
+            'locked': False, 'created_at': timestamp(d['created']),
+            'size_slug': d['size'],
+            'region': {'slug': d['region'], 'name': d['region']},
+            'image': {'id': d['image']}, 'networks': {'v4': networks},
+            'tags': sorted(
+                t for t, ids in cloud.tags.items() if d['id'] in ids)}
+
+    def action(self, a):
+        return {
+            'id': a['id'], 'type': a['type'],
+            'status': self.cloud.action_status(a),
+            'resource_id': a['resource_id'], 'resource_type': 'droplet',
+            'started_at': timestamp(a['started'])}
+
+    def list_droplets(self, req):
+        droplets = self.cloud.list(req.params.get('tag_name'))
+        return 200, req.page('droplets', map(self.droplet, droplets))
+
+    def create_droplets(self, req):
+        self.cloud.inject_error(create=True)
+        body = req.body
+        names = 'names' in body and body['names'] or [body['name']]
+        created = [self.cloud.create(
+            name, body['size'], body['region'], body['image'],
+            body.get('tags', ())) for name in names]
+        links = {'actions': [
+            {'id': a['id'], 'rel': 'create',
+             'href': req.url('/v2/actions/%d' % a['id'])}
+            for _, a in created]}
+        if 'names' in body:
+            return 202, {'droplets': [self.droplet(d) for d, _ in created],
+                         'links': links}
+        return 202, {'droplet': self.droplet(created[0][0]), 'links': links}
+
+    def get_droplet(self, req, droplet_id):
+        return 200, {'droplet': self.droplet(
+            self.cloud.get(int(droplet_id)))}
+
+    def destroy_droplet(self, req, droplet_id):
+        self.cloud.destroy(int(droplet_id))
+        return 204, None
+
+    def droplet_action(self, req, droplet_id):
+        params = dict(req.body)
+        action = self.cloud.action(params.pop('type'), int(droplet_id),
+                                   **params)
+        return 201, {'action': self.action(action)}
+
+    def snapshots(self, req, droplet_id):
+        self.cloud.get(int(droplet_id))
+        return 200, {'snapshots': self.cloud.snapshots.get(
+            int(droplet_id), [])}
+
+    def get_action(self, req, action_id):
+        return 200, {'action': self.action(
+            self.cloud.get_action(int(action_id)))}
+
+    def tag(self, name):
+        ids = self.cloud.tags[name]
+        return {'name': name,
+                'resources': {'droplets': {'count': len(ids)}}}
+
+    def create_tag(self, req):
+        name = req.body['name']
+        self.cloud.tag(name, ())
+        return 201, {'tag': self.tag(name)}
+
+    def get_tag(self, req, name):
+        if name not in self.cloud.tags:
+            raise APIError(
+                404, 'not_found',
+                "The resource you were accessing could not be found.")
+        return 200, {'tag': self.tag(name)}
+
+    def delete_tag(self, req, name):
+        self.get_tag(req, name)
+        with self.cloud.lock:
+            del self.cloud.tags[name]
+        return 204, None
+
+    def tag_resources(self, req, name, remove=False):
+        self.cloud.tag(
+            name, [r['resource_id'] for r in req.body['resources']], remove)
+        return 204, None
+
+    def untag_resources(self, req, name):
+        return self.tag_resources(req, name, remove=True)
+
+
+class V1(object):
+    """Routes and json of the v1 api, where sizes, regions and images are
+    identified by number.
+    """
+
+    version = 'v1'
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.size_ids = dict((s[0], 60 + i) for i, s in enumerate(SIZES))
+        self.region_ids = dict((r[0], 1 + i) for i, r in enumerate(REGIONS))
+        self.routes = [
+            ('GET', r'/ssh_keys$', 'keys'),
+            ('GET', r'/sizes$', 'sizes'),
+            ('GET', r'/regions$', 'regions'),
+            ('GET', r'/images$', 'images'),
+            ('GET', r'/droplets$', 'list_droplets'),
+            ('GET', r'/droplets/new$', 'create_droplet'),
+            ('GET', r'/droplets/(\d+)$', 'get_droplet'),
+            ('GET', r'/droplets/(\d+)/destroy$', 'destroy_droplet'),
+            ('GET', r'/events/(\d+)$', 'get_event')]
+
+    def slug(self, ids, id):
+        return [s for s, i in ids.items() if str(i) == str(id)][0]
+
+    def error(self, e):
+        return {'status': 'ERROR', 'error_message': e.message}
+
+    def ok(self, **data):
+        data['status'] = 'OK'
+        return 200, data
+
+    def keys(self, req):
+        return self.ok(ssh_keys=list(SSH_KEYS))
+
+    def sizes(self, req):
+        return self.ok(sizes=[
+            {'id': self.size_ids[slug], 'name': slug.upper(), 'slug': slug,
+             'memory': memory, 'cpu': cpus, 'disk': disk,
+             'cost_per_month': "%0.2f" % price}
+            for slug, memory, cpus, disk, transfer, price in SIZES])
+
+    def regions(self, req):
+        return self.ok(regions=[
+            {'id': self.region_ids[slug], 'slug': slug, 'name': name}
+            for slug, name in REGIONS])
+
+    def images(self, req):
+        return self.ok(images=[
+            {'id': id, 'slug': slug, 'name': name, 'distribution': 'Ubuntu',
+             'public': True, 'region_slugs': [r for r, _ in REGIONS]}
+            for id, slug, name in IMAGES])
+
+    def droplet(self, d):
+        cloud = self.cloud
+        status = cloud.status(d)
+        return {
+            'id': d['id'], 'name': d['name'], 'status': status,
+            'image_id': d['image'], 'size_id': self.size_ids[d['size']],
+            'region_id': self.region_ids[d['region']],
+            'backups_active': False, 'locked': False,
+            'created_at': timestamp(d['created']),
+            'ip_address': status == 'active' and cloud.address(d) or None}
+
+    def list_droplets(self, req):
+        return self.ok(droplets=map(self.droplet, self.cloud.list()))
+
+    def create_droplet(self, req):
+        self.cloud.inject_error(create=True)
+        p = req.params
+        droplet, action = self.cloud.create(
+            p['name'], self.slug(self.size_ids, p['size_id']),
+            self.slug(self.region_ids, p['region_id']), int(p['image_id']))
+        return self.ok(droplet={
+            'id': droplet['id'], 'name': droplet['name'],
+            'image_id': droplet['image'], 'size_id': int(p['size_id']),
+            'event_id': action['id']})
+
+    def get_droplet(self, req, droplet_id):
+        return self.ok(droplet=self.droplet(self.cloud.get(int(droplet_id))))
+
+    def destroy_droplet(self, req, droplet_id):
+        action = self.cloud.destroy(int(droplet_id))
+        return self.ok(event_id=action['id'])
+
+    def get_event(self, req, event_id):
+        action = self.cloud.get_action(int(event_id))
+        done = self.cloud.action_status(action) == 'completed'
+        return self.ok(event={
+            'id': action['id'], 'droplet_id': action['resource_id'],
+            'event_type_id': action['type'] == 'create' and 1 or 3,
+            'action_status': done and 'done' or None,
+            'percentage': done and "100" or "50"})
+
+
+class Request(object):
+
+    def __init__(self, handler, path, params, body):
+        self.handler = handler
+        self.path = path
+        self.params = params
+        self.body = body
+
+    def url(self, path, **params):
+        url = "http://%s%s" % (self.handler.headers.get('Host'), path)
+        if params:
+            url += "?" + "&".join(
+                "%s=%s" % (k, v) for k, v in sorted(params.items()))
+        return url
+
+    def page(self, key, items):
+        """Return one page of a collection, linking to the next.
+        """
+        page = int(self.params.get('page', 1))
+        per_page = int(self.params.get('per_page', 20))
+        start = (page - 1) * per_page
+        data = {key: items[start:start + per_page],
+                'meta': {'total': len(items)}, 'links': {}}
+        if start + per_page < len(items):
+            params = dict(self.params, page=page + 1, per_page=per_page)
+            data['links']['pages'] = {'next': self.url(self.path, **params)}
+        return data
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep-alive, as the client pools its connections, without waiting on
+    # delayed acks between writing headers and body.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method):
+        cloud = self.server.cloud
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = length and json.loads(self.rfile.read(length)) or {}
+
+        version, _, path = url.path.lstrip('/').partition('/')
+        api = self.server.apis.get(version)
+        route, status, data = 'unknown', 404, None
+        allowed, headers = cloud.take_token()
+        try:
+            if api is None:
+                raise APIError(404, 'not_found', "No such api version")
+            handler, args = self.route(api, method, '/' + path)
+            route = handler.__name__
+            if not allowed:
+                raise APIError(
+                    429, 'too_many_requests', "API Rate limit exceeded.")
+            cloud.inject_error()
+            status, data = handler(
+                Request(self, url.path, params, body), *args)
+        except APIError, e:
+            status = e.status
+            data = api is not None and api.error(e) or {'id': e.id}
+        except Exception, e:
+            status = 500
+            data = api.error(APIError(500, 'server_error', str(e)))
+        cloud.count(method, "%s.%s" % (version, route), status)
+
+        if status == 200 and route in ('sizes', 'regions', 'images'):
+            etag = '"%s"' % hashlib.md5(
+                json.dumps(data, sort_keys=True)).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                status, data = 304, None
+        self.reply(status, data, headers)
+
+    def route(self, api, method, path):
+        for route_method, pattern, name in api.routes:
+            if route_method != method:
+                continue
+            match = re.match(pattern, path)
+            if match:
+                return getattr(api, name), match.groups()
+        raise APIError(404, 'not_found', "No route for %s %s" % (
+            method, path))
+
+    def reply(self, status, data, headers):
+        payload = data is not None and json.dumps(data) or ""
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeAPIServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """The fake api, listening on a free local port.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, cloud, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), Handler)
+        self.cloud = cloud
+        self.apis = {'v1': V1(cloud), 'v2': V2(cloud)}
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
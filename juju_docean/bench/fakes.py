@@ -0,0 +1,204 @@
+"""
+Fakes of juju and ssh for benchmarking against the fake api.
+
+Juju's api is answered in process by :class:`FakeJuju`, which registers
+machines and reports their agents started once their droplets have been
+active for the agent latency. The juju and ssh clis are replaced by
+scripts on PATH that log their invocation and succeed, and droplet ssh
+readiness probes are answered by :class:`SSHEndpoint`.
+"""
+import collections
+import itertools
+import os
+import SocketServer
+import stat
+import threading
+import time
+
+from juju_docean.env import Environment
+from juju_docean.runner import resource
+
+LOG_VAR = "JUJU_DOCEAN_BENCH_LOG"
+
+SSH_SCRIPT = """#!/bin/sh
+echo ssh >> "$%(log)s"
+# Drain provisioning scripts piped to bash -s.
+case " $* " in
+    *" -s "*) cat > /dev/null ;;
+esac
+exit 0
+""" % {'log': LOG_VAR}
+
+JUJU_SCRIPT = """#!/bin/sh
+echo juju >> "$%(log)s"
+case "$1" in
+    status) echo "machines: {}" ;;
+esac
+exit 0
+""" % {'log': LOG_VAR}
+
+
+def write_scripts(path):
+    """Write the fake ssh and juju clis into path, to be put on PATH.
+    """
+    for name, script in (('ssh', SSH_SCRIPT), ('juju', JUJU_SCRIPT)):
+        script_path = os.path.join(path, name)
+        with open(script_path, 'w') as fh:
+            fh.write(script)
+        os.chmod(script_path, stat.S_IRWXU)
+
+
+class FakeJuju(object):
+    """Machine state of a juju environment on the fake cloud.
+    """
+
+    def __init__(self, cloud, agent_latency=1.0, call_latency=0.0):
+        self.cloud = cloud
+        self.agent_latency = agent_latency
+        self.call_latency = call_latency
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        # The state server, on a host outside the fake cloud.
+        self.machines = {'0': {
+            'name': 'state-server', 'series': 'trusty', 'registered': 0,
+            'dns_name': '10.0.0.1'}}
+        self.calls = collections.Counter()
+
+    def client(self):
+        return FakeJujuClient(self)
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def register(self, name, series, registered=None):
+        with self.lock:
+            machine_id = str(next(self.ids))
+            self.machines[machine_id] = {
+                'name': name, 'series': series,
+                'registered': registered or time.time()}
+        return machine_id
+
+    def seed(self, droplets, series='trusty'):
+        """Register droplets whose agents have already started.
+        """
+        return [self.register(d['name'], series, d['created'])
+                for d in droplets]
+
+    def agent_state(self, machine, droplet, now):
+        if droplet is None or self.cloud.status(droplet) != 'active':
+            return 'pending'
+        active = droplet['created'] + self.cloud.boot_latency
+        if now - max(active, machine['registered']) < self.agent_latency:
+            return 'pending'
+        return 'started'
+
+    def status(self):
+        now = time.time()
+        droplets = dict((d['name'], d) for d in self.cloud.list())
+        with self.lock:
+            machines = self.machines.items()
+        status = {}
+        for machine_id, m in machines:
+            if machine_id == '0':
+                status[machine_id] = {
+                    'DNSName': m['dns_name'], 'InstanceId': 'manual:',
+                    'AgentState': 'started', 'Series': m['series']}
+                continue
+            droplet = droplets.get(m['name'])
+            active = droplet is not None and \
+                self.cloud.status(droplet) == 'active'
+            status[machine_id] = {
+                'DNSName': active and self.cloud.address(droplet) or '',
+                'InstanceId': m['name'],
+                'AgentState': self.agent_state(m, droplet, now),
+                'Series': m['series']}
+        return {'Machines': status}
+
+    def destroy(self, machine_ids):
+        with self.lock:
+            for machine_id in machine_ids:
+                self.machines.pop(machine_id, None)
+
+
+class FakeJujuClient(object):
+    """The parts of a juju api connection used by the plugin.
+    """
+
+    def __init__(self, juju):
+        self.juju = juju
+
+    def info(self):
+        self.juju.call('info')
+        return {}
+
+    def status(self):
+        self.juju.call('status')
+        return self.juju.status()
+
+    def register_machines(self, params):
+        self.juju.call('register_machines')
+        return {'Machines': [
+            {'Machine': self.juju.register(p['InstanceId'], p['Series']),
+             'Error': None} for p in params]}
+
+    def provisioning_script(self, machine_id, nonce):
+        self.juju.call('provisioning_script')
+        return {'Script': "#!/bin/bash\necho provisioning machine %s\n" % (
+            machine_id)}
+
+    def destroy_machines(self, machine_ids, force=False):
+        self.juju.call('destroy_machines')
+        self.juju.destroy(machine_ids)
+        return {}
+
+    def close(self):
+        pass
+
+
+class BenchEnvironment(Environment):
+    """An environment whose api connections go to a fake juju.
+    """
+
+    def __init__(self, config, juju):
+        super(BenchEnvironment, self).__init__(config)
+        self.juju = juju
+
+    def connect(self):
+        with resource('juju'):
+            return self.juju.client()
+
+
+class BannerHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        self.request.sendall("SSH-2.0-OpenSSH_6.6.1 FakeSSH\r\n")
+
+
+class SSHEndpoint(SocketServer.ThreadingTCPServer):
+    """Answers ssh readiness probes to any droplet's loopback address.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(
+            self, ('0.0.0.0', 0), BannerHandler)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,308 @@
+"""
+Run plugin commands against the fakes, at a range of machine counts.
+
+For each api version, command and count, a fresh fake cloud is started,
+seeded with that many machines for commands that act on existing ones,
+and the command is run as the cli would. Reports wall clock time, api
+calls and failed calls, and the peak threads and child processes used.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import yaml
+
+from juju_docean.bench.fakeapi import (
+    FakeAPIServer, FakeCloud, IMAGES)
+from juju_docean.bench.fakes import (
+    BenchEnvironment, FakeJuju, LOG_VAR, SSHEndpoint, write_scripts)
+from juju_docean import cli, ssh
+from juju_docean.config import Config
+from juju_docean.provider import env_tag
+from juju_docean.watcher import ActionWatcher, AgentWatcher
+
+log = logging.getLogger("juju.docean")
+
+ENV_NAME = "bench"
+
+COMMANDS = (
+    'add-machine', 'list-machines', 'terminate-machine',
+    'destroy-environment')
+
+# Credentials selecting each api version, the rest are removed.
+CREDENTIALS = {
+    '1': {'DO_CLIENT_ID': 'bench', 'DO_API_KEY': 'bench'},
+    '2': {'DO_OAUTH_TOKEN': 'bench'}}
+
+
+def child_processes(pid):
+    """Return the number of live child processes of pid, or None where
+    that can't be read from /proc.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    count = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as fh:
+                # The command may contain spaces, ppid follows its parens.
+                fields = fh.read().rsplit(")", 1)[1].split()
+        except (IOError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            count += 1
+    return count
+
+
+class Sampler(threading.Thread):
+    """Track the peak threads and child processes while a command runs.
+    """
+
+    def __init__(self, interval=0.05):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_processes = 0
+        self.done = threading.Event()
+
+    def run(self):
+        pid = os.getpid()
+        while not self.done.is_set():
+            # Excluding this thread.
+            self.peak_threads = max(
+                self.peak_threads, threading.active_count() - 1)
+            processes = child_processes(pid)
+            if processes is None:
+                self.peak_processes = None
+            elif self.peak_processes is not None:
+                self.peak_processes = max(self.peak_processes, processes)
+            self.done.wait(self.interval)
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+class Bench(object):
+
+    def __init__(self, options):
+        self.options = options
+
+    def run(self, version, command, count):
+        """Run a command against a fresh fake cloud, returning its metrics.
+        """
+        options = self.options
+        cloud = FakeCloud(
+            boot_latency=options.boot_latency, rate_limit=options.rate_limit,
+            error_rate=options.error_rate, reject_rate=options.reject_rate)
+        juju = FakeJuju(cloud, options.agent_latency, options.juju_latency)
+        server = FakeAPIServer(cloud)
+        endpoint = SSHEndpoint()
+        root = tempfile.mkdtemp(prefix="juju-docean-bench-")
+        environ = dict(os.environ)
+        ssh_settings = ssh.SSH_CMD, ssh.SSH_PORT
+        try:
+            server.start()
+            endpoint.start()
+            self.setup_environ(version, server.url, root)
+            # Ssh is run by absolute path, and probed on a fixed port.
+            ssh.SSH_CMD = (os.path.join(root, "bin", "ssh"),) + \
+                ssh.SSH_CMD[1:]
+            ssh.SSH_PORT = endpoint.port
+            if command != 'add-machine':
+                self.seed(cloud, juju, count)
+            return self.measure(version, command, count, cloud, juju, root)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            ssh.SSH_CMD, ssh.SSH_PORT = ssh_settings
+            server.stop()
+            endpoint.stop()
+            shutil.rmtree(root)
+
+    def setup_environ(self, version, url, root):
+        juju_home = os.path.join(root, "juju")
+        bin_path = os.path.join(root, "bin")
+        os.makedirs(os.path.join(juju_home, "environments"))
+        os.makedirs(bin_path)
+        write_scripts(bin_path)
+        with open(os.path.join(juju_home, "environments.yaml"), 'w') as fh:
+            fh.write(yaml.safe_dump({'environments': {ENV_NAME: {
+                'type': 'manual', 'bootstrap-host': None}}}))
+        jenv = os.path.join(juju_home, "environments", "%s.jenv" % ENV_NAME)
+        with open(jenv, 'w') as fh:
+            fh.write(yaml.safe_dump({'bootstrap-config': {
+                'type': 'manual', 'bootstrap-host': '10.0.0.1'}}))
+
+        for creds in CREDENTIALS.values():
+            for k in creds:
+                os.environ.pop(k, None)
+        os.environ.update(CREDENTIALS[version])
+        os.environ.update({
+            'DO_API_URL': url,
+            'JUJU_HOME': juju_home,
+            'PATH': "%s:%s" % (bin_path, os.environ.get('PATH', '')),
+            LOG_VAR: os.path.join(root, "exec.log")})
+
+    def seed(self, cloud, juju, count):
+        names = ["%s-%s" % (ENV_NAME, uuid.uuid4().hex) for i in range(count)]
+        droplets = cloud.seed(
+            names, '512mb', 'nyc3', IMAGES[0][0], [env_tag(ENV_NAME)])
+        juju.seed(droplets)
+
+    def argv(self, command, count, juju):
+        argv = [command, "-e", ENV_NAME]
+        if command == 'add-machine':
+            argv.extend(["-n", str(count)])
+            # Rejected creates only fail over when spread.
+            if self.options.reject_rate:
+                argv.append("--spread")
+        elif command == 'terminate-machine':
+            argv.extend(sorted(m for m in juju.machines if m != '0'))
+        elif command == 'destroy-environment':
+            argv.append("--force")
+        return argv
+
+    def measure(self, version, command, count, cloud, juju, root):
+        options = cli.setup_parser().parse_args(
+            self.argv(command, count, juju))
+        config = Config(options)
+        result = {'api': int(version), 'command': command, 'n': count}
+
+        sampler = Sampler()
+        sampler.start()
+        stdout = sys.stdout
+        started = time.time()
+        cmd = None
+        try:
+            # Listings are printed, which isn't what we're measuring.
+            if command == 'list-machines':
+                sys.stdout = open(os.devnull, 'w')
+            cmd = options.command(
+                config, config.connect_provider(),
+                BenchEnvironment(config, juju))
+            cmd.run()
+        except Exception, e:
+            log.exception("%s failed", command)
+            result['error'] = "%s: %s" % (e.__class__.__name__, e)
+        finally:
+            if sys.stdout is not stdout:
+                sys.stdout.close()
+                sys.stdout = stdout
+            if cmd is not None:
+                cmd.env.close()
+                cmd.provider.client.close()
+        result['seconds'] = round(time.time() - started, 3)
+        sampler.stop()
+
+        result.update({
+            'api_calls': sum(cloud.counts.values()),
+            'api_errors': sum(
+                n for status, n in cloud.statuses.items() if status >= 400),
+            'api_routes': dict(cloud.counts),
+            'juju_calls': sum(juju.calls.values()),
+            'peak_threads': sampler.peak_threads,
+            'peak_processes': sampler.peak_processes,
+            'processes': self.count_processes(root),
+            'droplets': len(cloud.droplets),
+            'machines': len(juju.machines) - 1})
+        return result
+
+    def count_processes(self, root):
+        """Return the number of fake ssh and juju cli invocations.
+        """
+        path = os.path.join(root, "exec.log")
+        if not os.path.exists(path):
+            return 0
+        with open(path) as fh:
+            return len(fh.readlines())
+
+
+HEADER = ("api command                  n      time   calls errors   juju "
+          "threads  procs  execs status")
+
+
+def report(result):
+    print("v%(api)d %(command)-20s %(n)5d %(seconds)9.2fs "
+          "%(api_calls)7d %(api_errors)6d %(juju_calls)6d "
+          "%(peak_threads)7d %(peak)6s %(processes)6d %(status)s" % dict(
+              result, status=result.get('error', 'ok'),
+              peak=result['peak_processes'] is None and "-" or
+              result['peak_processes']))
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "-n", "--counts", default="1,10,100,1000",
+        help="Comma separated machine counts to run each command at")
+    parser.add_argument(
+        "--api", default="1,2", help="Comma separated api versions")
+    parser.add_argument(
+        "--commands", default=",".join(COMMANDS),
+        help="Comma separated commands to run")
+    parser.add_argument(
+        "--boot-latency", type=float, default=2.0,
+        help="Seconds for a droplet to become active")
+    parser.add_argument(
+        "--agent-latency", type=float, default=1.0,
+        help="Seconds from a droplet being active to its agent starting")
+    parser.add_argument(
+        "--juju-latency", type=float, default=0.01,
+        help="Seconds taken by each juju api call")
+    parser.add_argument(
+        "--poll-interval", type=float, default=0.5,
+        help="Seconds between polls for droplets and agents")
+    parser.add_argument(
+        "--rate-limit", type=int, default=5000,
+        help="Api requests allowed per rolling hour")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="Fraction of api requests failed with a server error")
+    parser.add_argument(
+        "--reject-rate", type=float, default=0.0,
+        help="Fraction of creates rejected as a region out of capacity")
+    parser.add_argument(
+        "--json", metavar="FILE",
+        help="Append results to FILE, one json object per line")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose output")
+    return parser
+
+
+def main():
+    options = setup_parser().parse_args()
+    logging.basicConfig(
+        level=options.verbose and logging.DEBUG or logging.WARNING,
+        format="%(asctime)s:%(levelname)s %(message)s")
+    logging.getLogger('requests').setLevel(level=logging.WARNING)
+
+    # Poll at the pace of the fake cloud rather than the real one.
+    ActionWatcher.initial_estimate = options.boot_latency
+    ActionWatcher.min_interval = options.poll_interval
+    AgentWatcher.interval = options.poll_interval
+
+    bench = Bench(options)
+    print(HEADER)
+    for version in options.api.split(","):
+        for command in options.commands.split(","):
+            for count in map(int, options.counts.split(",")):
+                result = bench.run(version, command, count)
+                report(result)
+                if options.json:
+                    with open(options.json, 'a') as fh:
+                        fh.write(json.dumps(result) + "\n")
+
+
+if __name__ == '__main__':
+    main()
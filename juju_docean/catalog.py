@@ -0,0 +1,93 @@
+"""
+Persistent cache of the digital ocean size, region, and image catalog.
+
+Catalog lookups otherwise cost several api round trips on every cli
+invocation. Entries are kept under JUJU_HOME with a per resource ttl, and
+stale entries are revalidated with their etag where the api supports it.
+"""
+import logging
+import time
+
+from juju_docean.client import Image, Region, Size
+from juju_docean.constraints import size_map
+from juju_docean import jsonfile
+
+log = logging.getLogger("juju.docean")
+
+CATALOG_FILE = "docean-catalog.json"
+
+# Seconds before a cached resource is revalidated.
+DEFAULT_TTLS = {
+    'sizes': 24 * 60 * 60,
+    'regions': 24 * 60 * 60,
+    'images': 60 * 60}
+
+ENTITIES = {
+    'sizes': Size,
+    'regions': Region,
+    'images': Image}
+
+
+class Catalog(object):
+
+    def __init__(self, client, path, ttls=None, refresh=False):
+        self.client = client
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.refresh = refresh
+        self.data = self.load()
+
+    def load(self):
+        data = jsonfile.load(self.path, {})
+        # Cached entities are only valid for the same api version.
+        if data.get('version') != self.client.version:
+            return {}
+        return data.get('resources', {})
+
+    def save(self):
+        jsonfile.save(
+            self.path,
+            {'version': self.client.version, 'resources': self.data})
+
+    def is_fresh(self, resource):
+        entry = self.data.get(resource)
+        if entry is None or self.refresh:
+            return False
+        return time.time() - entry['fetched'] < self.ttls[resource]
+
+    def get(self, resource):
+        """Return the entities for a catalog resource.
+        """
+        if not self.is_fresh(resource):
+            self.revalidate(resource)
+        factory = ENTITIES[resource].from_dict
+        return map(factory, self.data[resource]['items'])
+
+    def invalidate(self, resource):
+        """Drop a cached resource, so it's refetched on next use.
+        """
+        if self.data.pop(resource, None) is not None:
+            self.save()
+
+    def revalidate(self, resource):
+        entry = self.data.get(resource)
+        etag = entry and not self.refresh and entry.get('etag') or None
+        entities, etag = self.client.get_catalog(resource, etag)
+        if entities is None:
+            log.debug("Catalog %s unchanged", resource)
+            entry['fetched'] = time.time()
+        else:
+            log.debug("Catalog %s updated", resource)
+            self.data[resource] = {
+                'etag': etag,
+                'fetched': time.time(),
+                'items': [e.to_json() for e in entities]}
+        self.save()
+
+    def constraint_data(self):
+        """Return sizes and regions in the form used by constraints.init.
+        """
+        return {'sizes': size_map(self.get('sizes')),
+                'regions': self.get('regions')}
@@ -6,7 +6,9 @@ from juju_docean.config import Config
 from juju_docean.constraints import SERIES_MAP
 from juju_docean.exceptions import (
     ConfigError, PrecheckError, ProviderAPIError)
-from juju_docean import commands
+from juju_docean import commands, tracing
+
+log = logging.getLogger("juju.docean")
 
 
 def _default_opts(parser):
@@ -14,6 +16,15 @@ def _default_opts(parser):
         "-e", "--environment", help="Juju environment to operate on")
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Verbose output")
+    parser.add_argument(
+        "--refresh-catalog", action="store_true", default=False,
+        help="Refetch cached sizes, regions, images and region latencies")
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="Write timings of each machine's phases and api calls to FILE")
+    parser.add_argument(
+        "--trace-format", choices=("chrome", "jsonl"), default="chrome",
+        help="Chrome trace event format, or one json span per line")
 
 
 def _machine_opts(parser):
@@ -57,6 +68,13 @@ def setup_parser():
     add_machine.add_argument(
         "-k", "--ssh-key", default="",
         help="Use specified key when adding machines")
+    add_machine.add_argument(
+        "--spread", action="store_true", default=False,
+        help="Spread machines across regions matching the constraints, "
+        "failing over to the next best region if one is out of capacity")
+    add_machine.add_argument(
+        "--no-wait", action="store_true", default=False,
+        help="Return once machines launch, without waiting for their agents")
     add_machine.set_defaults(command=commands.AddMachine)
 
     list_machines = subparsers.add_parser(
@@ -75,6 +93,38 @@ def setup_parser():
     _default_opts(terminate_machine)
     terminate_machine.set_defaults(command=commands.TerminateMachine)
 
+    pool = subparsers.add_parser(
+        'pool',
+        help="Keep ready machines for add-machine to claim")
+    pool.add_argument(
+        "-n", "--num-machines", type=int, default=1,
+        help="Number of ready machines to keep, 0 removes the pool")
+    _default_opts(pool)
+    _machine_opts(pool)
+    pool.add_argument(
+        "--max-age", type=float, default=24,
+        help="Hours a machine may stay idle in the pool")
+    pool.add_argument(
+        "--refill", action="store_true", default=False,
+        help="Only refill the existing pools")
+    pool.add_argument(
+        "--watch", type=int, default=0,
+        help="Keep refilling the pools every WATCH seconds")
+    pool.set_defaults(command=commands.Pool)
+
+    build_image = subparsers.add_parser(
+        'build-image',
+        help="Build a machine image with juju dependencies preinstalled")
+    _default_opts(build_image)
+    _machine_opts(build_image)
+    build_image.set_defaults(command=commands.BuildImage)
+
+    tag_environment = subparsers.add_parser(
+        'tag-environment',
+        help="Tag an environment's existing machines for faster listing")
+    _default_opts(tag_environment)
+    tag_environment.set_defaults(command=commands.TagEnvironment)
+
     destroy_environment = subparsers.add_parser(
         'destroy-environment',
         help="Destroy all machines in juju environment")
@@ -87,6 +137,21 @@ def setup_parser():
     return parser
 
 
+def log_connection_stats(client):
+    """Log how many api requests reused a pooled connection.
+
+    Only informational, so a failure to read the stats is never raised.
+    """
+    try:
+        stats = client.connection_stats()
+    except Exception, e:
+        log.debug("Could not read api connection stats: %s", e)
+        return
+    log.debug(
+        "Provider api requests:%(requests)d connections:%(connections)d"
+        " reused:%(reused)d", stats)
+
+
 def main():
     parser = setup_parser()
     options = parser.parse_args()
@@ -108,12 +173,17 @@ def main():
         print("Configuration error: %s" % str(e))
         sys.exit(1)
 
+    if options.trace:
+        tracing.enable()
+
     cmd = options.command(
         config,
         config.connect_provider(),
         config.connect_environment())
     try:
-        cmd.run()
+        with tracing.span(options.command.__name__):
+            cmd.run()
+        log_connection_stats(cmd.provider.client)
     except ProviderAPIError, e:
         print("Provider interaction error: %s" % str(e))
     except ConfigError, e:
@@ -122,6 +192,10 @@ def main():
     except PrecheckError, e:
         print("Precheck error: %s" % str(e))
         sys.exit(1)
+    finally:
+        cmd.env.close()
+        if tracing.TRACER is not None:
+            tracing.TRACER.export(options.trace, options.trace_format)
 
 if __name__ == '__main__':
     main()
@@ -1,21 +1,74 @@
 import os
+import threading
 
 from juju_docean.exceptions import ProviderAPIError
+from juju_docean.ratelimit import RateLimiter
+from juju_docean.retry import RetryPolicy, UNSENT
+from juju_docean.runner import RESOURCE_LIMITS
+from juju_docean import tracing
 
 import requests
+from requests.adapters import HTTPAdapter
+
+# Api calls from op threads are bounded by the 'api' resource, so one
+# connection per slot is enough.
+DEFAULT_POOL_SIZE = RESOURCE_LIMITS['api']
+
+API_URL = "https://api.digitalocean.com"
 
 
 class Entity(object):
+    """An api object, read lazily from its json.
+
+    Instances hold a reference to the decoded response along with the
+    paths its attributes are read from, and only extract an attribute on
+    first access. Attributes are kept in slots, so large listings don't
+    pay for a dict per object.
+    """
+    __slots__ = ('_data', '_paths')
+
+    # Attributes read from json, and included in to_json.
+    fields = ()
 
     @classmethod
-    def from_dict(cls, data):
+    def from_dict(cls, data, paths=None):
+        """Wrap json data, reading attributes by name unless a path for
+        the attribute is given.
+
+        A path is a key, a tuple of nested keys, or a function of the data.
+        """
         i = cls()
-        i.__dict__.update(data)
-        i.json_keys = data.keys()
+        i._data = data
+        i._paths = paths or {}
         return i
 
+    def __getattr__(self, name):
+        # Only called for attributes whose slot hasn't been filled yet.
+        if name.startswith('_') or name not in self.fields:
+            raise AttributeError(name)
+        path = self._paths.get(name, name)
+        try:
+            if callable(path):
+                value = path(self._data)
+            elif isinstance(path, tuple):
+                value = self._data
+                for key in path:
+                    value = value[key]
+            else:
+                value = self._data[path]
+        except (KeyError, TypeError):
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
     def to_json(self):
-        return dict([(k, getattr(self, k)) for k in self.json_keys])
+        data = {}
+        for name in self.fields:
+            try:
+                data[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return data
 
 
 class SSHKey(Entity):
@@ -23,20 +76,27 @@ class SSHKey(Entity):
 
     Attributes: id, name
     """
+    fields = ('id', 'name')
+    __slots__ = fields
 
 
 class Droplet(Entity):
     """Instance on digital ocean.
 
     Attributes: id, name, ip_address, created_at, status, size_id, region_id,
-                image_id, event_id
+                image_id, event_id, machine_id (once registered with juju)
     """
+    fields = ('id', 'name', 'ip_address', 'created_at', 'status', 'size_id',
+              'region_id', 'image_id', 'event_id')
+    __slots__ = fields + ('machine_id',)
 
 
 class Image(Entity):
     """
     Attributes: id, slug, name, distribution, public, regions
     """
+    fields = ('id', 'slug', 'name', 'distribution', 'public', 'regions')
+    __slots__ = fields
 
 
 class Size(Entity):
@@ -44,53 +104,197 @@ class Size(Entity):
     Attributes: id, name, slug, memory (mb), cpus, disk (gb), transfer (tb),
                 price (/mth), regions (v2 only)
     """
+    fields = ('id', 'name', 'slug', 'memory', 'cpus', 'disk', 'transfer',
+              'price', 'regions')
+    __slots__ = fields
 
 
 class Region(Entity):
     """
     Attributes: id, slug, name, sizes (v2 only), features (v2 only)
     """
+    fields = ('id', 'slug', 'name', 'sizes', 'features')
+    __slots__ = fields
+
+
+def public_address(info):
+    for network in info['networks']['v4']:
+        if network['type'] == 'public':
+            return network['ip_address']
+    raise KeyError('ip_address')
+
+
+class PageFetch(threading.Thread):
+    """Fetch a page of a collection in the background.
+    """
+
+    def __init__(self, client, url):
+        super(PageFetch, self).__init__()
+        self.daemon = True
+        self.client = client
+        self.url = url
+        self.data = None
+        self.error = None
+        # Page fetches are traced under the span of the listing.
+        self.parent = tracing.current()
+        if client is not None:
+            self.start()
+
+    @classmethod
+    def done(cls, data):
+        page = cls(None, None)
+        page.data = data
+        return page
+
+    def run(self):
+        try:
+            with tracing.attached(self.parent):
+                self.data = self.client.request(self.url)
+        except Exception, e:
+            self.error = e
+
+    def result(self):
+        if self.client is not None:
+            self.join()
+        if self.error is not None:
+            raise self.error
+        return self.data
 
 
 class Client(object):
 
+    # Max droplets created per api call.
+    max_batch = 1
+    # Whether droplets can be tagged, and listed by tag.
+    supports_tags = False
+    # Transient failures are retried, but requests that may have taken
+    # effect, ie. creates, only if they weren't processed.
+    retry = RetryPolicy()
+    retry_unsent = RetryPolicy(retry_on=UNSENT)
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self.limiter = RateLimiter()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Keep-alive http session shared by all threads using this client.
+
+        The adapter's connection pool is sized to the number of concurrent
+        callers, and blocks rather than opening throwaway connections.
+        """
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = 'juju/client'
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def connection_stats(self):
+        """Return counts of requests sent and connections opened/reused.
+        """
+        stats = {'requests': 0, 'connections': 0}
+        pools = []
+        with self._session_lock:
+            if self._session is not None:
+                for adapter in set(self._session.adapters.values()):
+                    # The pool container refuses iteration, but its keys
+                    # are read under its lock.
+                    container = adapter.poolmanager.pools
+                    for key in container.keys():
+                        pool = container.get(key)
+                        if pool is not None:
+                            pools.append(pool)
+        for pool in pools:
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+        stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+        return stats
+
     def get_url(self, target):
         if target.startswith('/'):
             return "%s%s" % (self.api_url_base, target)
-        assert target.startswith('https://')
+        assert target.startswith(('https://', 'http://'))
         return target
 
     def get_sizes(self):
-        data = self.request("/sizes")
-        return filter(None, map(self.make_size, data.get('sizes', [])))
+        return list(self.iter_sizes())
 
     def get_regions(self):
-        data = self.request("/regions")
-        return filter(None, map(self.make_region, data.get("regions", [])))
+        return list(self.iter_regions())
 
     def get_images(self):
-        data = self.request("/images")
-        return filter(None, map(self.make_image, data.get("images", [])))
+        return list(self.iter_images())
 
     def get_droplets(self):
-        data = self.request("/droplets")
-        return map(self.make_droplet, data.get('droplets', []))
+        return list(self.iter_droplets())
+
+    def iter_sizes(self):
+        return self._iter_entities("/sizes", "sizes", self.make_size)
+
+    def iter_regions(self):
+        return self._iter_entities("/regions", "regions", self.make_region)
+
+    def iter_images(self):
+        return self._iter_entities("/images", "images", self.make_image)
+
+    def iter_droplets(self, tag_name=None):
+        params = tag_name and {'tag_name': tag_name} or None
+        return self._iter_entities(
+            "/droplets", "droplets", self.make_droplet, params)
+
+    def _iter_entities(self, target, key, factory, params=None):
+        for info in self.iter_collection(target, key, params):
+            entity = factory(info)
+            if entity is not None:
+                yield entity
+
+    def iter_collection(self, target, key, params=None):
+        data = self.request(target, params=params)
+        for info in data.get(key, []):
+            yield info
+
+    def get_catalog(self, resource, etag=None):
+        """Fetch a catalog collection (sizes, regions or images).
+
+        Returns a tuple of (entities, etag).
+        """
+        return getattr(self, 'get_%s' % resource)(), None
+
+    def create_droplets(self, names, **params):
+        return [self.create_droplet(name, **params) for name in names]
 
     def get_droplet(self, droplet_id):
         data = self.request("/droplets/%s" % droplet_id)
         return self.make_droplet(data.get('droplet', {}))
 
     @classmethod
-    def connect(cls, config=os.environ):
+    def connect(cls, config=os.environ, pool_size=DEFAULT_POOL_SIZE):
+        # An alternate api endpoint, ie. for testing against a fake.
+        api_url = config.get('DO_API_URL', API_URL).rstrip('/')
         oauth_token = config.get('DO_OAUTH_TOKEN')
         if oauth_token:
-            return Client_v2(oauth_token)
+            return Client_v2(oauth_token, pool_size, api_url)
         client_id = config.get('DO_CLIENT_ID')
         key = config.get('DO_API_KEY')
         if client_id or key:
             if not client_id or not key:
                 raise KeyError("Missing api credentials")
-            return Client_v1(client_id, key)
+            return Client_v1(client_id, key, pool_size, api_url)
         else:
             raise KeyError("Missing api credentials")
 
@@ -103,41 +307,35 @@ class Client_v1(Client):
         '512mb': 1, '1gb': 2, '2gb': 3, '4gb': 4, '8gb': 5,
         '16gb': 6, '32gb': 7, '48gb': 8, '64gb': 9}
 
-    def __init__(self, client_id, api_key):
+    def __init__(self, client_id, api_key, pool_size=DEFAULT_POOL_SIZE,
+                 api_url=API_URL):
+        super(Client_v1, self).__init__(pool_size)
         self.client_id = client_id
         self.api_key = api_key
-        self.api_url_base = 'https://api.digitalocean.com/v1'
+        self.api_url_base = api_url + '/v1'
 
     def get_ssh_keys(self):
         data = self.request("/ssh_keys")
         return map(SSHKey.from_dict, data.get('ssh_keys', []))
 
+    # Where v1 json differs from entity attributes.
+    image_paths = {'regions': 'region_slugs'}
+    size_paths = {
+        'cpus': 'cpu',
+        'transfer': lambda info: Client_v1.Transfers_for_sizes[info['slug']],
+        'price': lambda info: float(info['cost_per_month'])}
+
     def make_image(self, info):
-        return Image.from_dict(
-            dict(id=info['id'], slug=info['slug'], name=info['name'],
-                 distribution=info['distribution'], public=info['public'],
-                 regions=info['region_slugs']))
+        return Image.from_dict(info, self.image_paths)
 
     def make_region(self, info):
-        return Region.from_dict(
-            dict(id=info['id'], name=info['name'], slug=info['slug']))
+        return Region.from_dict(info)
 
     def make_size(self, info):
-        return Size.from_dict(
-            dict(id=info['id'], name=info['name'], slug=info['slug'],
-                 memory=info['memory'],
-                 cpus=info['cpu'], disk=info['disk'],
-                 transfer=self.Transfers_for_sizes[info['slug']],
-                 price=float(info['cost_per_month'])))
+        return Size.from_dict(info, self.size_paths)
 
     def make_droplet(self, info):
-        attributes = dict(id=info['id'], name=info['name'],
-                          image_id=info['image_id'], size_id=info['size_id'])
-        for name in ('event_id', 'ip_address', 'created_at', 'status',
-                     'region_id', 'event_id'):
-            if name in info:
-                attributes[name] = info[name]
-        return Droplet.from_dict(attributes)
+        return Droplet.from_dict(info)
 
     def create_droplet(self, name, size_id, image_id, region_id,
                        ssh_key_ids=None, private_networking=False,
@@ -151,37 +349,49 @@ class Client_v1(Client):
 
         if ssh_key_ids:
             params['ssh_key_ids'] = ','.join(ssh_key_ids)
-        data = self.request('/droplets/new', params=params)
+        data = self.request(
+            '/droplets/new', params=params, idempotent=False)
         return self.make_droplet(data.get('droplet', {}))
 
-    def create_done(self, event_id, name):
-        data = self.request('/events/%s' % event_id)
-        event = data.get('event', {})
-        if event.get('event_type_id', 1) != 1:
-            raise ValueError("Waiting on invalid event type: %d for %s" %
-                             (event['event_type_id'], name))
-        return event.get('action_status') == 'done', data
-
     def destroy_droplet(self, droplet_id, scrub=True):
         data = self.request(
             "/droplets/%s/destroy" % droplet_id,
             params=dict(scrub_data=int(bool(scrub))))
         return data.get('event_id')
 
-    def request(self, target, method='GET', params=None):
+    def request(self, target, method='GET', params=None, idempotent=True):
+        # All v1 calls are gets, so whether they're safe to repeat is
+        # up to the caller.
+        policy = idempotent and self.retry or self.retry_unsent
+        return policy.call(self._request, target, method, params)
+
+    def _request(self, target, method, params):
         p = params and dict(params) or {}
         p['client_id'] = self.client_id
         p['api_key'] = self.api_key
 
-        headers = {'User-Agent': 'juju/client'}
+        headers = {}
         url = self.get_url(target)
 
-        if method == 'POST':
-            headers['Content-Type'] = "application/json"
-            response = requests.post(url, headers=headers, params=p)
-        else:
-            response = requests.get(url, headers=headers, params=p)
-
+        with tracing.span("api", method=method, target=target) as span:
+            self.limiter.acquire(mutation=method != 'GET')
+            response = None
+            try:
+                if method == 'POST':
+                    headers['Content-Type'] = "application/json"
+                    response = self.session.post(
+                        url, headers=headers, params=p)
+                else:
+                    response = self.session.get(
+                        url, headers=headers, params=p)
+            finally:
+                self.limiter.release(
+                    response is not None and response.headers or None)
+            if span is not None:
+                span.attrs['status'] = response.status_code
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ProviderAPIError(response, response.reason)
         data = response.json()
         if not data:
             raise ProviderAPIError(response, 'No json result found')
@@ -196,61 +406,91 @@ class Client_v1(Client):
 class Client_v2(Client):
 
     version = 2.0
+    page_size = 200
+    max_batch = 10
+    supports_tags = True
 
-    def __init__(self, oauth_token):
+    def __init__(self, oauth_token, pool_size=DEFAULT_POOL_SIZE,
+                 api_url=API_URL):
+        super(Client_v2, self).__init__(pool_size)
         self.oauth_token = oauth_token
-        self.api_url_base = 'https://api.digitalocean.com/v2'
+        self.api_url_base = api_url + '/v2'
 
     def get_ssh_keys(self):
         data = self.request("/account/keys")
         return map(self.make_ssh_key, data.get('ssh_keys', []))
 
+    # Where v2 json differs from entity attributes.
+    region_paths = {'id': 'slug'}
+    size_paths = {
+        'id': 'slug', 'name': 'slug', 'cpus': 'vcpus',
+        'price': 'price_monthly'}
+    droplet_paths = {
+        'size_id': 'size_slug',
+        'ip_address': public_address,
+        'region_id': ('region', 'slug'),
+        'image_id': ('image', 'id')}
+
     def make_ssh_key(self, info):
-        return SSHKey.from_dict(
-            dict(id=info['id'], name=info['name']))
+        return SSHKey.from_dict(info)
 
     def make_image(self, info):
-        return Image.from_dict(
-            dict(id=info['id'], slug=info['slug'], name=info['name'],
-                 distribution=info['distribution'], public=info['public'],
-                 regions=info['regions']))
+        return Image.from_dict(info)
 
     def make_region(self, info):
         if info['available']:
-            return Region.from_dict(
-                dict(id=info['slug'], name=info['name'], slug=info['slug'],
-                     sizes=info['sizes'], features=info['features']))
+            return Region.from_dict(info, self.region_paths)
 
     def make_size(self, info):
         if info['available']:
-            return Size.from_dict(
-                dict(id=info['slug'], name=info['slug'], slug=info['slug'],
-                     memory=info['memory'],
-                     cpus=info['vcpus'], disk=info['disk'],
-                     transfer=info['transfer'],
-                     price=info['price_monthly'],
-                     regions=info['regions']))
+            return Size.from_dict(info, self.size_paths)
 
     def make_droplet(self, info):
-        attributes = dict(id=info['id'], name=info['name'],
-                          status=info['status'], size_id=info['size_slug'],
-                          created_at=info['created_at'])
-        if 'v4' in info['networks']:
-            for network in info['networks']['v4']:
-                if network['type'] == 'public':
-                    attributes['ip_address'] = network['ip_address']
-                    break
-        if 'slug' in info['region']:
-            attributes['region_id'] = info['region']['slug']
-        if 'id' in info['image']:
-            attributes['image_id'] = info['image']['id']
-        return Droplet.from_dict(attributes)
+        return Droplet.from_dict(info, self.droplet_paths)
 
     def create_droplet(self, name, size_id, image_id, region_id,
                        ssh_key_ids=None, private_networking=False,
-                       backups_enabled=False, virtio=True, user_data=None):
+                       backups_enabled=False, virtio=True, user_data=None,
+                       tags=None):
+        params = self._create_params(
+            size_id, image_id, region_id, ssh_key_ids,
+            private_networking, backups_enabled, user_data, tags)
+        params['name'] = name
+
+        data = self.request('/droplets', 'POST', data=params)
+        ans = self.make_droplet(data.get('droplet', {}))
+        for action in data.get('links', {}).get('actions', []):
+            ans.event_id = action['href']
+        return ans
+
+    def create_droplets(self, names, size_id, image_id, region_id,
+                        ssh_key_ids=None, private_networking=False,
+                        backups_enabled=False, virtio=True, user_data=None,
+                        tags=None):
+        """Create several droplets from one template in a single call.
+        """
+        if len(names) == 1:
+            return [self.create_droplet(
+                names[0], size_id, image_id, region_id, ssh_key_ids,
+                private_networking, backups_enabled, virtio, user_data,
+                tags)]
+        params = self._create_params(
+            size_id, image_id, region_id, ssh_key_ids,
+            private_networking, backups_enabled, user_data, tags)
+        params['names'] = list(names)
+
+        data = self.request('/droplets', 'POST', data=params)
+        droplets = map(self.make_droplet, data.get('droplets', []))
+        # Create actions are listed in the same order as the droplets.
+        actions = data.get('links', {}).get('actions', [])
+        for droplet, action in zip(droplets, actions):
+            droplet.event_id = action['href']
+        return droplets
+
+    def _create_params(self, size_id, image_id, region_id, ssh_key_ids,
+                       private_networking, backups_enabled, user_data, tags):
         params = dict(
-            name=name, size=size_id,
+            size=size_id,
             image=image_id, region=region_id,
             private_networking=bool(private_networking),
             backups=bool(backups_enabled))
@@ -259,47 +499,161 @@ class Client_v2(Client):
             params['user_data'] = user_data
         if ssh_key_ids:
             params['ssh_keys'] = ssh_key_ids
+        if tags:
+            params['tags'] = list(tags)
+        return params
+
+    def get_tag(self, name):
+        """Return a tag's details, or None if it doesn't exist.
+        """
+        try:
+            return self.request("/tags/%s" % name).get('tag')
+        except ProviderAPIError, e:
+            if e.response.status_code == 404:
+                return None
+            raise
+
+    def create_tag(self, name):
+        self.request("/tags", 'POST', data={'name': name})
+
+    def delete_tag(self, name):
+        self.request("/tags/%s" % name, 'DELETE')
+
+    def tag_droplets(self, name, droplet_ids):
+        self.request(
+            "/tags/%s/resources" % name, 'POST',
+            data={'resources': [
+                {'resource_id': str(i), 'resource_type': 'droplet'}
+                for i in droplet_ids]})
+
+    def untag_droplets(self, name, droplet_ids):
+        self.request(
+            "/tags/%s/resources" % name, 'DELETE',
+            data={'resources': [
+                {'resource_id': str(i), 'resource_type': 'droplet'}
+                for i in droplet_ids]})
+
+    def rename_droplet(self, droplet_id, name):
+        return self.droplet_action(droplet_id, 'rename', name=name)
+
+    def droplet_action(self, droplet_id, action_type, **params):
+        """Start an action on a droplet, returning the action's details.
+        """
+        params['type'] = action_type
+        data = self.request(
+            "/droplets/%s/actions" % droplet_id, 'POST', data=params)
+        return data.get('action', {})
 
-        data = self.request('/droplets', 'POST', data=params)
-        ans = self.make_droplet(data.get('droplet', {}))
-        for action in data.get('links', {}).get('actions', []):
-            ans.event_id = action['href']
-        return ans
+    def get_action(self, action_id):
+        return self.request("/actions/%s" % action_id).get('action', {})
 
-    def create_done(self, event_id, name):
-        data = self.request(event_id)
-        event = data.get('action', {})
-        if event.get('type', 'create') != 'create':
-            raise ValueError("Waiting on invalid action type: %s for %s" %
-                             (event['type'], name))
-        completed = event.get('status') == 'completed'
-        return completed, event
+    def get_snapshots(self, droplet_id):
+        data = self.request("/droplets/%s/snapshots" % droplet_id)
+        return map(self.make_image, data.get('snapshots', []))
 
     def destroy_droplet(self, droplet_id, scrub=True):
-        self.request("/droplets/%s" % droplet_id, 'DELETE')
+        attempts = []
+
+        def destroy():
+            attempts.append(droplet_id)
+            try:
+                self._send(
+                    "/droplets/%s" % droplet_id, 'DELETE', None, None, None)
+            except ProviderAPIError, e:
+                # An earlier attempt may have taken effect before failing.
+                if len(attempts) > 1 and e.response.status_code == 404:
+                    return
+                raise
+        self.retry.call(destroy)
+
+    def iter_collection(self, target, key, params=None):
+        """Yield the items of a paginated collection as each page arrives.
+
+        The next page is fetched in the background while the current one
+        is consumed by the caller.
+        """
+        page = PageFetch.done(self.request(target, params=params))
+        while page is not None:
+            data = page.result()
+            next_url = data.get('links', {}).get('pages', {}).get('next')
+            page = next_url and PageFetch(self, next_url) or None
+            for info in data.get(key, []):
+                yield info
+
+    def get_catalog(self, resource, etag=None):
+        """Fetch a catalog collection, revalidating against a prior etag.
+
+        Returns (None, etag) if the server reports the collection as
+        unchanged.
+        """
+        headers = etag and {'If-None-Match': etag} or None
+        response = self.send("/%s" % resource, headers=headers)
+        if response.status_code == 304:
+            return None, etag
+        data = self.decode(response)
+        infos = list(data.get(resource, []))
+        next_url = data.get('links', {}).get('pages', {}).get('next')
+        if next_url:
+            infos.extend(self.iter_collection(next_url, resource))
+        factory = getattr(self, 'make_%s' % resource[:-1])
+        entities = filter(None, map(factory, infos))
+        return entities, response.headers.get('ETag')
 
     def request(self, target, method='GET', params=None, data=None):
+        response = self.send(target, method, params, data)
+        if method.lower() != 'delete' and response.status_code != 204:
+            return self.decode(response)
+
+    def send(self, target, method='GET', params=None, data=None,
+             headers=None):
+        policy = method.upper() == 'POST' and self.retry_unsent or self.retry
+        return policy.call(
+            self._send, target, method, params, data, headers)
+
+    def _send(self, target, method, params, data, headers):
         p = params and dict(params) or {}
-        p['per_page'] = 1000
+        # Page links carry their own paging parameters.
+        if 'per_page=' not in target:
+            p.setdefault('per_page', self.page_size)
 
-        headers = {'User-Agent': 'juju/client',
-                   'Authorization': 'Bearer ' + self.oauth_token}
+        headers = dict(headers or {})
+        headers['Authorization'] = 'Bearer ' + self.oauth_token
         url = self.get_url(target)
 
-        if data is not None:
-            response = requests.request(method, url, headers=headers, params=p,
-                                        json=data)
-        else:
-            response = requests.request(method, url, headers=headers, params=p)
+        with tracing.span("api", method=method.upper(),
+                          target=target) as span:
+            self.limiter.acquire(mutation=method.upper() != 'GET')
+            response = None
+            try:
+                if data is not None:
+                    response = self.session.request(
+                        method, url, headers=headers, params=p, json=data)
+                else:
+                    response = self.session.request(
+                        method, url, headers=headers, params=p)
+            finally:
+                self.limiter.release(
+                    response is not None and response.headers or None)
+            if span is not None:
+                span.attrs['status'] = response.status_code
+
+        if response.status_code == 304:
+            return response
 
         if not (200 <= response.status_code < 300):
-            raise ProviderAPIError(response, response.json())
-
-        if method.lower() != 'delete':
-            data = response.json()
-            if not data:
-                raise ProviderAPIError(response, 'No json result found')
-            return data
+            try:
+                message = response.json()
+            except ValueError:
+                # Proxies and load balancers answer with html.
+                message = response.reason
+            raise ProviderAPIError(response, message)
+        return response
+
+    def decode(self, response):
+        data = response.json()
+        if not data:
+            raise ProviderAPIError(response, 'No json result found')
+        return data
 
 
 def main():
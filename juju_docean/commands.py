@@ -1,11 +1,18 @@
 import logging
+import os
 import time
 import uuid
 import yaml
 
 from juju_docean import constraints
 from juju_docean.exceptions import ConfigError, PrecheckError
+from juju_docean.inventory import DropletInventory, env_name_of
 from juju_docean import ops
+from juju_docean.pipeline import Pipeline
+from juju_docean.pool import POOL_FILE, WarmPool, refill_in_background
+from juju_docean.snapshots import SNAPSHOT_FILE, SnapshotCache
+from juju_docean import ssh, tracing
+from juju_docean.watcher import AgentWatcher
 from juju_docean.runner import Runner
 
 
@@ -14,18 +21,51 @@ log = logging.getLogger("juju.docean")
 
 class BaseCommand(object):
 
+    # Stock images by series, looked up once.
+    images = None
+
     def __init__(self, config, provider, environment):
         self.config = config
         self.provider = provider
         self.env = environment
         self.runner = Runner()
+        self.inventory = DropletInventory(
+            provider, config.get_env_name())
 
-    def solve_constraints(self):
+    def solve_constraints(self, stock=False):
+        """Return image, size and region, preferring a built image for the
+        series unless stock is set.
+        """
         size, region = constraints.solve_constraints(self.config.constraints)
         t = time.time()
-        image_map = constraints.get_images(self.provider.client)
+        image = self.resolve_image(region, stock)
         log.debug("Looked up docean images in %0.2f seconds", time.time() - t)
-        return image_map[self.config.series], size, region
+        return image, size, region
+
+    def resolve_image(self, region, stock=False):
+        """Return the image for the series in a region, preferring a built
+        image unless stock is set.
+
+        Built images are snapshots only available in the regions they were
+        copied to, so each placement resolves its own.
+        """
+        if self.images is None:
+            self.images = constraints.get_images(self.provider)
+        if not stock:
+            snapshot = self.get_snapshots().preferred(
+                self.config.series, region, self.provider)
+            if snapshot is not None:
+                log.debug("Using built image %s in %s", snapshot, region)
+                return snapshot
+        return self.images[self.config.series]
+
+    def get_snapshots(self):
+        return SnapshotCache(
+            os.path.join(self.config.juju_home, SNAPSHOT_FILE))
+
+    def get_pool(self):
+        return WarmPool(
+            self.provider, os.path.join(self.config.juju_home, POOL_FILE))
 
     def get_do_ssh_keys(self):
         return [k.id for k in self.provider.get_ssh_keys()]
@@ -33,11 +73,18 @@ class BaseCommand(object):
     def check_preconditions(self):
         """Check for provider ssh key, and configured environments.yaml.
         """
+        keys = self.check_ssh_keys()
+        self.check_environment_conf()
+        return keys
+
+    def check_ssh_keys(self):
         keys = self.get_do_ssh_keys()
         if not keys:
             raise ConfigError(
                 "SSH Public Key must be uploaded to digital ocean")
+        return keys
 
+    def check_environment_conf(self):
         env_name = self.config.get_env_name()
         with open(self.config.get_env_conf()) as fh:
             conf = yaml.safe_load(fh.read())
@@ -56,7 +103,6 @@ class BaseCommand(object):
                 raise ConfigError(
                     "Environment %r already has a bootstrap-host" % (
                         env_name))
-        return keys
 
 
 class Bootstrap(BaseCommand):
@@ -73,34 +119,73 @@ class Bootstrap(BaseCommand):
     - bootstrap-host must be null
     - at least one ssh key must exist.
     - ? existing digital ocean with matching env name does not exist.
+
+    Steps run as a dependency graph, so the precondition and catalog
+    lookups run concurrently, and the sandbox juju home is prepared while
+    the instance boots.
     """
+    op = None
+
     def run(self):
-        keys = self.check_preconditions()
-        image, size, region = self.solve_constraints()
+        env_name = self.config.get_env_name()
+        pipeline = Pipeline("Bootstrap")
+        pipeline.add('keys', lambda r: self.check_ssh_keys())
+        pipeline.add('config', lambda r: self.check_environment_conf())
+        pipeline.add('running', lambda r: self.check_not_running())
+        pipeline.add('constraints', lambda r: self.solve_constraints())
+        pipeline.add(
+            'tag', lambda r: self.provider.ensure_environment_tag(env_name),
+            requires=('keys', 'config', 'running'))
+        pipeline.add(
+            'launch', self.launch,
+            requires=('keys', 'config', 'running', 'constraints', 'tag'))
+        pipeline.add(
+            'sandbox', lambda r: self.env.prepare_boot_home(),
+            requires=('config',))
+        pipeline.add(
+            'bootstrap', self.bootstrap, requires=('launch', 'sandbox'))
+        try:
+            pipeline.run()
+        finally:
+            if self.op is not None:
+                self.op.close()
+            if 'bootstrap' not in pipeline.results:
+                self.env.remove_boot_home()
+                # Whichever stage failed, don't leave the host running.
+                instance = pipeline.results.get('launch')
+                if instance is not None:
+                    self.provider.terminate_instance(instance.id)
+            pipeline.report()
+        log.info("Bootstrap complete.")
+
+    def launch(self, results):
+        image, size, region = results['constraints']
         log.info("Launching bootstrap host (eta 5m)...")
         params = dict(
             name="%s-0" % self.config.get_env_name(), image_id=image,
-            size_id=size, region_id=region, ssh_key_ids=keys)
-
-        op = ops.MachineAdd(
+            size_id=size, region_id=region, ssh_key_ids=results['keys'],
+            tags=[results['tag']])
+        self.op = ops.MachineAdd(
             self.provider, self.env, params, series=self.config.series)
-        instance = op.run()
+        return self.op.run()
 
+    def bootstrap(self, results):
+        instance = results['launch']
         log.info("Bootstrapping environment...")
-        try:
-            self.env.bootstrap_jenv(instance.ip_address)
-        except:
-            self.provider.terminate_instance(instance.id)
-            raise
-        log.info("Bootstrap complete.")
+        self.env.bootstrap_jenv(
+            instance.ip_address, env=self.op.master.env(),
+            boot_home=results['sandbox'])
 
     def check_preconditions(self):
         result = super(Bootstrap, self).check_preconditions()
+        self.check_not_running()
+        return result
+
+    def check_not_running(self):
         if self.env.is_running():
             raise PrecheckError(
                 "Environment %s is already bootstrapped" % (
                 self.config.get_env_name()))
-        return result
 
 
 class ListMachines(BaseCommand):
@@ -111,17 +196,19 @@ class ListMachines(BaseCommand):
             "Id", "Name", "Size", "Status", "Created", "Region", "Address")
 
         allmachines = self.config.options.all
-        for m in self.provider.get_instances():
-            if not allmachines and not m.name.startswith('%s-' % env_name):
+        if allmachines:
+            inventory = DropletInventory(self.provider)
+        else:
+            inventory = self.inventory
+        regions = dict((r.id, r.slug) for r in constraints.REGIONS)
+        for m in inventory.stream():
+            if not allmachines and env_name_of(m.name) != env_name:
                 continue
 
             if header:
                 print(header)
                 header = None
 
-            for r in constraints.REGIONS:
-                if m.region_id == r.id:
-                    break
             name = m.name
             if len(name) > 18:
                 name = name[:15] + "..."
@@ -136,7 +223,7 @@ class ListMachines(BaseCommand):
                 size_name,
                 m.status,
                 m.created_at[:-10],
-                r.slug,
+                regions.get(m.region_id, m.region_id),
                 m.ip_address).strip())
 
 
@@ -147,33 +234,224 @@ class AddMachine(BaseCommand):
         image, size, region = self.solve_constraints()
         log.info("Launching %d instances...", self.config.num_machines)
 
+        env_name = self.config.get_env_name()
         template = dict(
-            image_id=image, size_id=size, region_id=region, ssh_key_ids=keys)
+            ssh_key_ids=keys,
+            tags=[self.provider.ensure_environment_tag(env_name)])
+        # Only spread machines fail over to other regions.
+        scheduler = None
+        if self.config.spread:
+            scheduler = constraints.get_scheduler(self.config.constraints)
+            allocation = scheduler.allocate(self.config.num_machines)
+        else:
+            allocation = [(size, region, self.config.num_machines)]
+
+        placements = []
+        for size, region, count in allocation:
+            log.debug("Placing %d instances of %s in %s", count, size, region)
+            placed = dict(
+                template, size_id=size, region_id=region,
+                image_id=self.resolve_image(region))
+            placements.append((placed, [
+                "%s-%s" % (env_name, uuid.uuid4().hex)
+                for n in range(count)]))
+
+        if self.provider.version == 2.0:
+            claimed = self.claim_from_pool(placements)
+            if claimed:
+                self.provision(claimed)
+                refill_in_background(env_name)
+            # Identical machines are created in batches.
+            batch = self.provider.client.max_batch
+            for placed, names in placements:
+                for i in range(0, len(names), batch):
+                    self.runner.queue_op(
+                        ops.MachineUserDataRegister(
+                            self.provider, self.env, dict(placed),
+                            names=names[i:i + batch],
+                            series=self.config.series,
+                            scheduler=scheduler,
+                            images=self.resolve_image))
+        else:
+            self.launch_and_provision(placements, scheduler)
+
+        machine_ids = []
+        for instance in self.iter_instances():
+            if getattr(instance, 'ip_address', None):
+                info = "ip:%s" % instance.ip_address
+            else:
+                info = "mid: %s" % instance.machine_id
+            log.info("Registered id:%s name:%s %s as juju machine",
+                     instance.id, instance.name, info)
+            machine_ids.append(instance.machine_id)
+
+        if machine_ids and self.config.wait_for_agents:
+            self.wait_for_agents(machine_ids)
+
+    def wait_for_agents(self, machine_ids):
+        log.info("Waiting for %d machine agents to start...",
+                 len(machine_ids))
+        with tracing.span("agent-wait", count=len(machine_ids)):
+            started, failed, pending = AgentWatcher(self.env).wait(
+                machine_ids)
+        for machine_id, info in sorted(failed.items()):
+            log.error("Machine %s failed to provision: %s", machine_id, info)
+        if pending:
+            log.warning("Machines %s not started before timeout",
+                        " ".join(pending))
+        log.info("Started %d of %d machines", len(started), len(machine_ids))
+
+    def claim_from_pool(self, placements):
+        """Claim ready machines from the warm pool, removing their names
+        from the placements left to launch.
+        """
+        pool = self.get_pool()
+        claimed = []
+        for placed, names in placements:
+            instances = pool.claim(
+                placed['size_id'], placed['region_id'], placed['image_id'],
+                names, placed['tags'])
+            del names[:len(instances)]
+            claimed.extend(instances)
+        return claimed
+
+    def launch_and_provision(self, placements, scheduler=None):
+        """Launch instances and wait for ssh, then register all the ready
+        ones with juju at once, and queue their provisioning over ssh.
+        """
+        adds = []
+        for template, names in placements:
+            for name in names:
+                params = dict(template)
+                params['name'] = name
+                adds.append(ops.MachineAdd(
+                    self.provider, self.env, params,
+                    series=self.config.series, scheduler=scheduler,
+                    images=self.resolve_image))
+                self.runner.queue_op(adds[-1])
+        for result in self.runner.iter_results():
+            pass
 
-        op_class = self.provider.version == 2.0 and \
-            ops.MachineUserDataRegister or ops.MachineRegister
+        ready = [op for op in adds if op.instance is not None]
+        self.provision(
+            [op.instance for op in ready],
+            dict((op.instance.id, op.master) for op in ready))
 
-        for n in range(self.config.num_machines):
-            params = dict(template)
-            params['name'] = "%s-%s" % (
-                self.config.get_env_name(), uuid.uuid4().hex)
+    def provision(self, instances, masters=None):
+        """Register running instances with juju at once, and queue their
+        provisioning over ssh.
+        """
+        masters = masters or {}
+        try:
+            with tracing.span("register", count=len(instances)):
+                registered = self.env.register_machines([
+                    {'name': instance.name,
+                     'series': self.config.series,
+                     'hardware': constraints.size_to_resources(
+                         instance.size_id)} for instance in instances])
+        except:
+            for instance in instances:
+                if masters.get(instance.id) is not None:
+                    masters[instance.id].stop()
+                self.provider.terminate_instance(instance.id)
+            raise
 
+        for instance, (machine_id, script) in zip(instances, registered):
             self.runner.queue_op(
-                op_class(
-                    self.provider, self.env, params,
-                    series=self.config.series,
+                ops.MachineProvision(
+                    self.provider, self.env,
+                    {'instance': instance, 'machine_id': machine_id,
+                     'script': script},
+                    master=masters.get(instance.id),
                     key=self.config.options.ssh_key))
 
-        for instance in self.runner.iter_results():
-            # V1 legacy support / TODO Remove 10/2015
-            if isinstance(instance, tuple):
-                instance, id = instance
-            if getattr(instance, 'ip_address', None):
-                info = "ip:%s" % instance.ip_address
+    def iter_instances(self):
+        for result in self.runner.iter_results():
+            # Batched ops return a list of instances.
+            if isinstance(result, list):
+                for instance in result:
+                    yield instance
             else:
-                info = "mid: %s" % instance.machine_id
-            log.info("Registered id:%s name:%s %s as juju machine",
-                     instance.id, instance.name, info)
+                yield result
+
+
+class Pool(BaseCommand):
+    """Keep ready machines for add-machine to claim.
+
+    Sets the number of machines to keep for the solved size, region, and
+    series, then refills the pool. With --refill only the existing
+    targets are refilled, and --watch keeps refilling periodically.
+    """
+    def run(self):
+        if not self.provider.client.supports_tags:
+            raise PrecheckError(
+                "The machine pool requires the digital ocean v2 api")
+        options = self.config.options
+        pool = self.get_pool()
+        if not options.refill:
+            image, size, region = self.solve_constraints()
+            pool.set_target(
+                self.config.series, size, region, image,
+                self.config.num_machines, int(options.max_age * 3600))
+        keys = self.get_do_ssh_keys()
+        while True:
+            pool.refill(self.runner, keys)
+            if not options.watch:
+                break
+            time.sleep(options.watch)
+
+
+class BuildImage(BaseCommand):
+    """Build a machine image with juju's agent dependencies preinstalled.
+
+    Launches a droplet from the stock image for the series, upgrades it
+    and installs the packages juju provisioning would, then snapshots it.
+    Later machines of the series use the snapshot where it's available.
+    """
+    def run(self):
+        if not self.provider.client.supports_tags:
+            raise PrecheckError(
+                "Building images requires the digital ocean v2 api")
+        series = self.config.series
+        image, size, region = self.solve_constraints(stock=True)
+        name = "juju-image-%s-%s" % (series, time.strftime("%Y%m%d%H%M%S"))
+        params = dict(
+            name=name, image_id=image, size_id=size, region_id=region,
+            ssh_key_ids=self.get_do_ssh_keys())
+
+        log.info("Launching image build host (eta 10m)...")
+        op = ops.MachineAdd(self.provider, self.env, params, series=series)
+        instance = op.run()
+        try:
+            log.info("Installing packages...")
+            ssh.prepare_image(instance.ip_address, master=op.master)
+            op.close()
+            log.info("Snapshotting image %s...", name)
+            snapshot = self.provider.snapshot_instance(instance.id, name)
+        finally:
+            op.close()
+            self.provider.terminate_instance(instance.id)
+
+        self.get_snapshots().record(series, snapshot)
+        # The new image isn't in the cached image catalog yet.
+        if self.provider.catalog is not None:
+            self.provider.catalog.invalidate('images')
+        log.info("Built image %s id:%s for %s", name, snapshot.id, series)
+
+
+class TagEnvironment(BaseCommand):
+    """Migrate an environment created before tagging.
+
+    Tags the environment's existing droplets, so they can be listed by
+    tag rather than filtering every droplet on the account by name.
+    """
+    def run(self):
+        env_name = self.config.get_env_name()
+        if not self.provider.client.supports_tags:
+            raise PrecheckError(
+                "Tagging requires the digital ocean v2 api")
+        count = self.provider.tag_environment(env_name)
+        log.info("Tagged %d machines in environment %s", count, env_name)
 
 
 class TerminateMachine(BaseCommand):
@@ -190,61 +468,50 @@ class TerminateMachine(BaseCommand):
             self.config.options.machines if mid != '0'])
 
     def _terminate_machines(self, machine_filter=None):
-        status = self.env.status()
-        machines = status.get('machines', {})
+        machines = self.env.machines()
 
         machine_filter = machine_filter or self._machine_filter
         # Using the api instance-id can be the provider id, but
         # else it defaults to ip, and we have to disambiguate.
-        remove = []
-        for m in machines:
-            if machine_filter(m, machines[m]):
-                remove.append(
-                    {'address': machines[m].get('dns-name'),
-                     'instance_id': machines[m]['instance-id'],
-                     'machine_id': m})
-
-        address_map = dict([(d.ip_address, d) for
-                            d in self.provider.get_instances()])
+        remove = [m for m in machines if machine_filter(m.id, m)]
+
+        address_map = self.inventory.load().by_address
         if not remove:
-            return status, address_map
+            return machines, address_map
 
         log.info("Terminating machines %s",
-                 " ".join([m['machine_id'] for m in remove]))
+                 " ".join([m.id for m in remove]))
+
+        # Remove all the machines from juju state in one call, including
+        # those we can't find in the provider, so destroy can proceed.
+        self.env.terminate_machines([m.id for m in remove])
 
         for m in remove:
             instance = None
-            if m['address']:
-                instance = address_map.get(m['address'])
+            if m.dns_name:
+                instance = address_map.get(m.dns_name)
             else:
                 instances = [
-                    i for i in address_map.values()
-                    if m['instance_id'] == i.name]
+                    i for i in self.inventory.environment(
+                        self.config.get_env_name())
+                    if m.instance_id == i.name]
                 if len(instances) == 1:
                     instance = instances[0]
-                    #instances['instance'] =
-            env_only = False  # Remove from only env or also provider.
             if instance is None:
                 log.warning(
                     "Couldn't resolve machine %s's address %s to instance" % (
-                        m['machine_id'], m['address']))
-                # We have a machine in juju state that we couldn't
-                # find in provider. Remove it from state so destroy
-                # can proceed.
-                env_only = True
-                instance_id = None
-            else:
-                instance_id = instance.id
+                        m.id, m.dns_name))
+                continue
             self.runner.queue_op(
                 ops.MachineDestroy(
                     self.provider, self.env, {
-                        'machine_id': m['machine_id'],
-                        'instance_id': instance_id},
-                    env_only=env_only))
+                        'machine_id': m.id,
+                        'instance_id': instance.id},
+                    iaas_only=True))
         for result in self.runner.iter_results():
             pass
 
-        return status, address_map
+        return machines, address_map
 
 
 class DestroyEnvironment(TerminateMachine):
@@ -264,7 +531,7 @@ class DestroyEnvironment(TerminateMachine):
         if force:
             return self.force_environment_destroy()
 
-        env_status, instance_map = self._terminate_machines(
+        machines, instance_map = self._terminate_machines(
             state_service_filter)
 
         # sadness, machines are marked dead, but juju is async to
@@ -276,18 +543,15 @@ class DestroyEnvironment(TerminateMachine):
         self.env.destroy_environment()
 
         # Remove the state server.
-        bootstrap_host = env_status.get(
-            'machines', {}).get('0', {}).get('dns-name')
-        instance = instance_map.get(bootstrap_host)
+        state_server = machines.get('0')
+        instance = state_server and instance_map.get(state_server.dns_name)
         if instance:
             log.info("Terminating state server")
             self.provider.terminate_instance(instance.id)
         log.info("Environment Destroyed")
 
     def force_environment_destroy(self):
-        env_name = self.config.get_env_name()
-        env_machines = [m for m in self.provider.get_instances()
-                        if m.name.startswith("%s-" % env_name)]
+        env_machines = self.inventory.environment(self.config.get_env_name())
 
         log.info("Destroying environment")
         for m in env_machines:
@@ -15,7 +15,7 @@ class Config(object):
     def connect_provider(self):
         """Connect to digital ocean.
         """
-        return provider.factory()
+        return provider.factory(self)
 
     def connect_environment(self):
         """Return a websocket connection to the environment.
@@ -34,6 +34,10 @@ class Config(object):
     def constraints(self):
         return self.options.constraints
 
+    @property
+    def refresh_catalog(self):
+        return getattr(self.options, 'refresh_catalog', False)
+
     @property
     def series(self):
         return self.options.series
@@ -46,6 +50,14 @@ class Config(object):
     def num_machines(self):
         return getattr(self.options, 'num_machines', 0)
 
+    @property
+    def spread(self):
+        return getattr(self.options, 'spread', False)
+
+    @property
+    def wait_for_agents(self):
+        return not getattr(self.options, 'no_wait', False)
+
     @property
     def juju_home(self):
         jhome = os.environ.get("JUJU_HOME")
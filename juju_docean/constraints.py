@@ -1,9 +1,19 @@
+import logging
+
 from juju_docean.exceptions import ConstraintError
+from juju_docean.placement import Scheduler
+
+log = logging.getLogger("juju.docean")
+
+# Region constraint value selecting the nearest matching region.
+AUTO_REGION = 'auto'
 
 DEFAULT_REGION = 'nyc3'
 REGIONS = ()
 SIZES_SORTED = ('512mb',)
 SIZE_MAP = {'512mb': {}}
+SIZE_INDEX = None
+LATENCY = None
 
 # Would be nice to use ubuntu-distro-info, but portability.
 SERIES_MAP = {
@@ -23,34 +33,108 @@ SUFFIX_SIZES = {
     "p": 1024 * 1024 * 1024}
 
 
-def init(client, data=None):
-    global SIZE_MAP, SIZES_SORTED, REGIONS, DEFAULT_REGION
+def init(client, data=None, latency=None):
+    global SIZE_MAP, SIZES_SORTED, SIZE_INDEX, REGIONS, DEFAULT_REGION
+    global LATENCY
 
-    if data is not None:
-        SIZE_MAP = data['sizes']
-        SIZES_SORTED = tuple(sorted(
-            SIZE_MAP.keys(), key=lambda id: SIZE_MAP[id].price))
-        REGIONS = data['regions']
-        return
+    if data is None:
+        data = {'sizes': size_map(client.get_sizes()),
+                'regions': client.get_regions()}
 
     # Record sizes so we can offer constraints around disk, cpu and transfer.
-    SIZE_MAP = dict((size.id, size) for size in client.get_sizes())
-    # Resize disks to mb (silly default in juju-core)
-    for s in SIZE_MAP.values():
-        s.disk *= 1024
-
+    SIZE_MAP = data['sizes']
     SIZES_SORTED = tuple(sorted(SIZE_MAP.keys(),
                                 key=lambda id: SIZE_MAP[id].price))
 
     # Record regions so we can offer nice aliases.
-    REGIONS = client.get_regions()
+    REGIONS = data['regions']
+    SIZE_INDEX = SizeIndex(SIZE_MAP, REGIONS)
+
+    # Region latencies are probed only when needed for placement.
+    LATENCY = latency
 
     for region in REGIONS:
         if region.slug == 'nyc3':
             DEFAULT_REGION = region.id
             break
     else:
-        raise ValueError("Could not find region 'nyc3'")
+        DEFAULT_REGION = AUTO_REGION
+
+
+def size_map(sizes):
+    """Index sizes by id, with disk resized to mb (silly default in juju-core).
+    """
+    sizes = dict((size.id, size) for size in sizes)
+    for s in sizes.values():
+        s.disk *= 1024
+    return sizes
+
+
+class SizeIndex(object):
+    """Sizes available in each region, as rows of their constrainable
+    attributes ordered by price.
+
+    A query scans a region's rows once, so the first row satisfying every
+    lower bound is the cheapest feasible size.
+    """
+
+    attributes = ('memory', 'cpus', 'disk', 'transfer')
+
+    def __init__(self, sizes, regions):
+        self.regions = {}
+        ordered = sorted(sizes.values(), key=lambda s: s.price)
+        for region in regions:
+            available = [s for s in ordered if self.is_available(s, region)]
+            self.regions[region.id] = (
+                tuple(s.id for s in available),
+                tuple(s.price for s in available),
+                tuple(tuple(getattr(s, a) for a in self.attributes)
+                      for s in available))
+
+    @staticmethod
+    def is_available(size, region):
+        # Availability is only reported by the v2 api.
+        region_sizes = getattr(region, 'sizes', None)
+        if region_sizes is not None and size.id not in region_sizes:
+            return False
+        size_regions = getattr(size, 'regions', None)
+        if size_regions is not None and region.slug not in size_regions:
+            return False
+        return True
+
+    def bounds(self, constraints):
+        return tuple(constraints.get(a, 0) for a in self.attributes)
+
+    def feasible(self, region_id, constraints):
+        """Yield (size id, price) of sizes matching constraints in a region,
+        cheapest first.
+        """
+        bounds = self.bounds(constraints)
+        ids, prices, rows = self.regions.get(region_id, ((), (), ()))
+        for size_id, price, row in zip(ids, prices, rows):
+            for value, bound in zip(row, bounds):
+                if value < bound:
+                    break
+            else:
+                yield size_id, price
+
+    def cheapest(self, region_id, constraints):
+        for size_id, price in self.feasible(region_id, constraints):
+            return size_id
+
+    def rank(self, constraints, region_ids=None):
+        """Return the cheapest matching (size id, region id) of each region,
+        ordered by price.
+        """
+        if region_ids is None:
+            region_ids = sorted(self.regions)
+        ranked = []
+        for region_id in region_ids:
+            for size_id, price in self.feasible(region_id, constraints):
+                ranked.append((price, size_id, region_id))
+                break
+        ranked.sort()
+        return [(size_id, region_id) for price, size_id, region_id in ranked]
 
 
 def size_to_resources(size_id):
@@ -118,7 +202,9 @@ def parse_constraints(constraints):
         if not d in ARCHES:
             raise ConstraintError("Unsupported arch %s" % d)
 
-    if 'region' in c:
+    if c.get('region') == AUTO_REGION:
+        c_out['region'] = AUTO_REGION
+    elif 'region' in c:
         for r in REGIONS:
             if c['region'] == r.name:
                 c_out['region'] = r.id
@@ -137,25 +223,71 @@ def solve_constraints(constraints):
     constraints = parse_constraints(constraints)
     region = constraints.pop('region', DEFAULT_REGION)
 
-    if not constraints:
-        return SIZES_SORTED[0], region
+    if region == AUTO_REGION:
+        region = nearest_region(constraints)
+
+    if SIZE_INDEX is None:
+        # Without the catalog only the default size is known.
+        size = not constraints and SIZES_SORTED[0] or None
+    else:
+        size = SIZE_INDEX.cheapest(region, constraints)
+    if size is None:
+        raise ConstraintError("Could not match constraints %s in %s" % (
+            ", ".join(["%s=%s" % (k, v) for k, v in constraints.items()]),
+            region))
+    return size, region
+
+
+def region_latencies(region_ids=None, probe=True):
+    """Return latencies of regions by id, probing stale ones if probe is
+    set, else only those already known.
+    """
+    if LATENCY is None:
+        return {}
+    slugs = dict((r.slug, r.id) for r in REGIONS
+                 if region_ids is None or r.id in region_ids)
+    if probe:
+        latencies = LATENCY.get(slugs.keys())
+    else:
+        latencies = LATENCY.cached(slugs.keys())
+    return dict((slugs[s], l) for s, l in latencies.items())
 
-    for s in SIZES_SORTED:
-        s_info = SIZE_MAP[s]
-        matched = True
-        for k, v in constraints.items():
-            if not getattr(s_info, k) >= v:
-                matched = False
-        if matched:
-            return s, region
 
-    raise ConstraintError("Could not match constraints %s" % (
-        ", ".join(["%s=%s" % (k, v in constraints.items())])))
+def nearest_region(constraints):
+    """Return the lowest latency region offering a size matching the
+    (parsed) constraints, or the cheapest one if none could be probed.
+    """
+    index = SIZE_INDEX or SizeIndex({}, ())
+    ranked = [r for s, r in index.rank(constraints)]
+    if not ranked:
+        raise ConstraintError("No region matches constraints")
+    latencies = region_latencies(ranked)
+    if not latencies:
+        log.debug("No region latencies, using cheapest region")
+        return ranked[0]
+    region = min(latencies, key=latencies.get)
+    log.debug("Nearest region %s (%0.1fms)", region, latencies[region] * 1000)
+    return region
+
+
+def get_scheduler(constraints):
+    """Return a placement scheduler over the regions matching constraints.
+
+    With the auto region, regions are probed so the scheduler favors the
+    nearest, otherwise it uses whatever latencies are already known.
+    """
+    index = SIZE_INDEX or SizeIndex({}, ())
+    constraints = parse_constraints(constraints)
+    auto = constraints.get('region') == AUTO_REGION
+    if auto:
+        del constraints['region']
+    return Scheduler(
+        index, constraints, region_latencies(probe=auto))
 
 
 def get_images(client):
     images = {}
-    for i in client.get_images():
+    for i in client.iter_images():
         if not i.public:
             continue
         if not i.distribution == "Ubuntu":
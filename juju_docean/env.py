@@ -1,8 +1,12 @@
+from contextlib import contextmanager
 import httplib
 import logging
 import shutil
 import subprocess
 import socket
+import threading
+import time
+import uuid
 
 import os
 import yaml
@@ -11,6 +15,157 @@ log = logging.getLogger("juju.docean")
 
 from jujuclient import Environment as Client
 from juju_docean.constraints import SERIES_MAP
+from juju_docean.exceptions import RegistrationError
+from juju_docean.runner import resource, RESOURCE_LIMITS
+
+
+class ConnectionPool(object):
+    """Authenticated api connections reused across ops.
+
+    Connections idle for longer than max_idle are checked with a cheap
+    api call before reuse, and replaced if stale. A connection whose
+    use raised an error is discarded rather than returned to the pool.
+    """
+
+    max_idle = 30
+
+    def __init__(self, connect, size=RESOURCE_LIMITS['juju']):
+        self.connect = connect
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    @contextmanager
+    def connection(self):
+        client = self.acquire()
+        try:
+            yield client
+        except:
+            self.discard(client)
+            raise
+        self.release(client)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                client, last_used = self.idle.pop()
+            if time.time() - last_used < self.max_idle or self.alive(client):
+                self._count('reused')
+                return client
+            log.debug("Discarding stale environment api connection")
+            self.discard(client)
+        client = self.connect()
+        self._count('created')
+        return client
+
+    def release(self, client):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((client, time.time()))
+                return
+        client.close()
+
+    def discard(self, client):
+        self._count('discarded')
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def alive(self, client):
+        try:
+            client.info()
+        except Exception:
+            return False
+        return True
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for client, _ in idle:
+            client.close()
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, idle=len(self.idle))
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+class MachineStatus(object):
+    """A machine's entry in environment status.
+
+    Attributes: id, dns_name, instance_id, agent_state, series,
+                agent_state_info
+    """
+    __slots__ = ('id', 'dns_name', 'instance_id', 'agent_state', 'series',
+                 'agent_state_info')
+
+    def __init__(self, id, dns_name=None, instance_id=None,
+                 agent_state=None, series=None, agent_state_info=None):
+        self.id = id
+        self.dns_name = dns_name
+        self.instance_id = instance_id
+        self.agent_state = agent_state
+        self.series = series
+        self.agent_state_info = agent_state_info
+
+    def __repr__(self):
+        return "<MachineStatus id:%s dns-name:%s instance-id:%s>" % (
+            self.id, self.dns_name, self.instance_id)
+
+
+class MachineTable(object):
+    """Environment machines indexed by machine id, dns-name and instance-id.
+    """
+
+    def __init__(self, machines=()):
+        self.machines = {}
+        self.by_address = {}
+        self.by_instance = {}
+        for m in machines:
+            self.machines[m.id] = m
+            if m.dns_name:
+                self.by_address[m.dns_name] = m
+            if m.instance_id:
+                self.by_instance[m.instance_id] = m
+
+    @classmethod
+    def from_api(cls, status):
+        machines = status.get('Machines') or {}
+        return cls([
+            MachineStatus(
+                mid, info.get('DNSName') or None,
+                info.get('InstanceId') or None,
+                info.get('AgentState') or None, info.get('Series') or None,
+                info.get('AgentStateInfo') or None)
+            for mid, info in machines.items()])
+
+    @classmethod
+    def from_cli(cls, status):
+        machines = status and status.get('machines') or {}
+        return cls([
+            MachineStatus(
+                mid, info.get('dns-name'), info.get('instance-id'),
+                info.get('agent-state'), info.get('series'),
+                info.get('agent-state-info'))
+            for mid, info in machines.items()])
+
+    def get(self, machine_id):
+        return self.machines.get(machine_id)
+
+    def __iter__(self):
+        return iter(sorted(
+            self.machines.values(),
+            key=lambda m: (len(m.id), m.id)))
+
+    def __len__(self):
+        return len(self.machines)
 
 
 class Environment(object):
@@ -19,6 +174,7 @@ class Environment(object):
 
     def __init__(self, config):
         self.config = config
+        self.pool = ConnectionPool(self.connect)
 
     def _run(self, command, env=None, capture_err=False):
         if env is None:
@@ -28,11 +184,12 @@ class Environment(object):
         args.extend(command)
         log.debug("Running juju command: %s", " ".join(args))
         try:
-            if capture_err:
-                return subprocess.check_call(
+            with resource('juju'):
+                if capture_err:
+                    return subprocess.check_call(
+                        args, env=env, stderr=subprocess.STDOUT)
+                return subprocess.check_output(
                     args, env=env, stderr=subprocess.STDOUT)
-            return subprocess.check_output(
-                args, env=env, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError, e:
             log.error(
                 "Failed to run command %s\n%s",
@@ -40,18 +197,40 @@ class Environment(object):
             raise
 
     def connect(self):
-        # TODO TLS Conn Cache, underlying socket supports async, but client lib
-        # we're using is synchronous based.
-        return Client.connect(self.config.get_env_name())
+        with resource('juju'):
+            return Client.connect(self.config.get_env_name())
+
+    def connection(self):
+        """Context manager for a pooled api connection to the environment.
+        """
+        return self.pool.connection()
 
     def close(self):
         if self._client:
             self._client.close()
             self._client = None
+        log.debug(
+            "Environment api connections created:%(created)d"
+            " reused:%(reused)d discarded:%(discarded)d",
+            self.pool.metrics())
+        self.pool.close()
 
     def status(self):
         return yaml.safe_load(self._run(['status']))
 
+    def machines(self):
+        """Return the environment's machine table.
+
+        Status comes from the api, falling back to parsing cli output if
+        the api server can't be reached.
+        """
+        try:
+            with self.connection() as client:
+                return MachineTable.from_api(client.status())
+        except Exception, e:
+            log.debug("Api status unavailable, using cli: %s", e)
+        return MachineTable.from_cli(self.status())
+
     def is_running(self):
         """Try to connect the api server websocket to see if env is running.
         """
@@ -75,16 +254,66 @@ class Environment(object):
         except socket.error:
             return False
 
-    def add_machine(self, location, key=None, debug=False):
-        ops = ['add-machine', location]
-        if key:
-            ops.extend(['--ssh-key', key])
-        if debug:
-            ops.append('--debug')
+    def register_machines(self, machines):
+        """Register machines with the environment over one api connection.
+
+        Each machine is a dict with name, series and hardware keys, and
+        optionally addrs. Returns a list of (machine_id, script) tuples,
+        where script provisions the machine as that juju machine.
+        """
+        params = []
+        for m in machines:
+            params.append({
+                'Series': m['series'],
+                'InstanceId': m['name'],
+                'Jobs': ['JobHostUnits'],
+                'HardwareCharacteristics': m['hardware'],
+                'Addrs': m.get('addrs', []),
+                'Nonce': "manual:%s" % uuid.uuid4().get_hex()})
+        if not params:
+            return []
 
-        return self._run(ops, capture_err=debug)
+        registered = []
+        injected = []
+        try:
+            with self.connection() as client:
+                result = client.register_machines(params)
+                results = result.get('Machines') or \
+                    result.get('machines') or []
+                injected = [r['Machine'] for r in results
+                            if r.get('Machine') and not r.get('Error')]
+                for p, r in zip(params, results):
+                    if r.get('Error'):
+                        raise RegistrationError(
+                            "Could not register %s: %s" % (
+                                p['InstanceId'], r['Error'].get('Message')))
+                    script = client.provisioning_script(
+                        r['Machine'], p['Nonce'])
+                    registered.append((r['Machine'], script['Script']))
+            if len(registered) != len(params):
+                raise RegistrationError(
+                    "Registered %d of %d machines" % (
+                        len(registered), len(params)))
+        except:
+            # Machines are injected all at once, don't leave the rest
+            # waiting on provisioning that will never happen.
+            if injected:
+                self.terminate_machines(injected)
+            raise
+        return registered
 
     def terminate_machines(self, machines):
+        """Force remove machines from the environment in one api call.
+
+        Falls back to the cli if the api server can't be reached.
+        """
+        if not machines:
+            return
+        try:
+            with self.connection() as client:
+                return client.destroy_machines(list(machines), force=True)
+        except Exception, e:
+            log.debug("Api destroy machines failed, using cli: %s", e)
         cmd = ['terminate-machine', '--force']
         cmd.extend(machines)
         return self._run(cmd)
@@ -111,22 +340,17 @@ class Environment(object):
     def bootstrap(self):
         return self._run(['bootstrap', '-v'])
 
-    def bootstrap_jenv(self, host):
-        """Bootstrap an environment in a sandbox.
+    def get_boot_home(self):
+        return os.path.join(
+            self.config.juju_home, "boot-%s" % self.config.get_env_name())
 
-        Manual provider config keeps transient state in the form of
-        bootstrap-host for its config.
-
-        A temporary JUJU_HOME is used to modify environments.yaml
+    def prepare_boot_home(self):
+        """Prepare a sandbox JUJU_HOME for bootstrap, returning its path.
         """
-        env_name = self.config.get_env_name()
-
         # Prep a new juju home
-        boot_home = os.path.join(
-            self.config.juju_home, "boot-%s" % env_name)
-
-        if not os.path.exists(boot_home):
-            os.makedirs(os.path.join(boot_home, 'environments'))
+        boot_home = self.get_boot_home()
+        self.remove_boot_home()
+        os.makedirs(os.path.join(boot_home, 'environments'))
 
         # Check that this installation has been used before.
         jenv_dir = os.path.join(self.config.juju_home, 'environments')
@@ -143,6 +367,25 @@ class Environment(object):
         shutil.copytree(
             ssh_key_dir,
             os.path.join(boot_home, 'ssh'))
+        return boot_home
+
+    def remove_boot_home(self):
+        boot_home = self.get_boot_home()
+        if os.path.exists(boot_home):
+            shutil.rmtree(boot_home)
+
+    def bootstrap_jenv(self, host, env=None, boot_home=None):
+        """Bootstrap an environment in a sandbox.
+
+        Manual provider config keeps transient state in the form of
+        bootstrap-host for its config.
+
+        A temporary JUJU_HOME is used to modify environments.yaml, it's
+        prepared here unless already prepared via prepare_boot_home.
+        """
+        env_name = self.config.get_env_name()
+        if boot_home is None:
+            boot_home = self.prepare_boot_home()
 
         # Updated env config with the bootstrap host.
         with open(self.config.get_env_conf()) as fh:
@@ -154,7 +397,7 @@ class Environment(object):
             fh.write(yaml.safe_dump({'environments': {env_name: env_conf}}))
 
         # Change JUJU_ENV
-        env = dict(os.environ)
+        env = dict(env is None and os.environ or env)
         env['JUJU_HOME'] = boot_home
         env['JUJU_LOGGING'] = "<root>=DEBUG"
         cmd = ['bootstrap', '--debug']
@@ -40,3 +40,31 @@ class ProviderAPIError(Exception):
         return "<ProviderAPIError message:%s response:%r>" % (
             self.message or "Unknown",
             self.response.status_code)
+
+
+class SSHError(Exception):
+    """Could not run a command on an instance over ssh.
+    """
+    def __init__(self, host, message, output=""):
+        self.host = host
+        self.message = message
+        self.output = output
+
+    def __str__(self):
+        return "<%s host:%s message:%s>" % (
+            self.__class__.__name__, self.host, self.message)
+
+
+class SSHUnavailable(SSHError):
+    """Instance is not (yet) accepting ssh connections.
+    """
+
+
+class SSHAuthError(SSHError):
+    """Instance rejected our ssh credentials.
+    """
+
+
+class RegistrationError(Exception):
+    """Machine could not be registered with the juju environment.
+    """
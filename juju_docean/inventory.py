@@ -0,0 +1,103 @@
+"""
+In memory index of the account's droplets.
+
+Commands look droplets up by id, environment, address and region. The
+inventory lists droplets at most once per invocation and is then kept
+current incrementally.
+"""
+
+
+def env_name_of(name):
+    """Return the environment a droplet name belongs to.
+
+    Juju machine droplets are named <env-name>-<suffix>.
+    """
+    if '-' not in name:
+        return None
+    return name.rsplit('-', 1)[0]
+
+
+class DropletInventory(object):
+    """Droplets, either all on the account or those of one environment.
+    """
+
+    def __init__(self, provider, env_name=None):
+        self.provider = provider
+        self.env_name = env_name
+        self.loaded = False
+        self.by_id = {}
+        self.by_env = {}
+        self.by_address = {}
+        self.by_region = {}
+
+    def stream(self):
+        """Yield all droplets, indexing them as they're listed.
+        """
+        if self.loaded:
+            for d in self.by_id.values():
+                yield d
+            return
+        if self.env_name is None:
+            droplets = self.provider.iter_instances()
+        else:
+            droplets = self.provider.iter_instances(self.env_name)
+        for d in droplets:
+            self.add(d)
+            yield d
+        self.loaded = True
+
+    def load(self):
+        if not self.loaded:
+            for d in self.stream():
+                pass
+        return self
+
+    def __iter__(self):
+        return iter(self.load().by_id.values())
+
+    def __len__(self):
+        return len(self.load().by_id)
+
+    def get(self, droplet_id):
+        return self.load().by_id.get(droplet_id)
+
+    def address(self, ip_address):
+        return self.load().by_address.get(ip_address)
+
+    def environment(self, env_name):
+        return sorted(
+            self.load().by_env.get(env_name, {}).values(),
+            key=lambda d: d.name)
+
+    def region(self, region_id):
+        return self.load().by_region.get(region_id, {}).values()
+
+    def add(self, droplet):
+        self.discard(droplet.id)
+        self.by_id[droplet.id] = droplet
+        env_name = env_name_of(droplet.name)
+        if env_name:
+            self.by_env.setdefault(env_name, {})[droplet.id] = droplet
+        address = getattr(droplet, 'ip_address', None)
+        if address:
+            self.by_address[address] = droplet
+        region = getattr(droplet, 'region_id', None)
+        if region:
+            self.by_region.setdefault(region, {})[droplet.id] = droplet
+
+    def discard(self, droplet_id):
+        droplet = self.by_id.pop(droplet_id, None)
+        if droplet is None:
+            return
+        self.by_env.get(env_name_of(droplet.name), {}).pop(droplet_id, None)
+        address = getattr(droplet, 'ip_address', None)
+        if self.by_address.get(address) is droplet:
+            del self.by_address[address]
+        region = getattr(droplet, 'region_id', None)
+        self.by_region.get(region, {}).pop(droplet_id, None)
+
+    def refresh(self, droplet_ids):
+        """Refetch individual droplets, rather than relisting all of them.
+        """
+        for droplet_id in droplet_ids:
+            self.add(self.provider.get_instance(droplet_id))
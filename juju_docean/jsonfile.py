@@ -0,0 +1,45 @@
+"""
+Json state files kept under JUJU_HOME.
+
+The catalog, latency, snapshot and pool records are all small json files
+that are only an optimization or a convenience to keep. An unreadable or
+unwritable file is logged and treated as empty rather than failing the
+command, and files are replaced atomically so concurrent commands never
+read a partial write.
+"""
+import json
+import logging
+import os
+
+log = logging.getLogger("juju.docean")
+
+
+def load(path, default=None):
+    """Return the decoded contents of path, or default if it's missing
+    or unreadable.
+    """
+    if path is None or not os.path.exists(path):
+        return default
+    try:
+        with open(path) as fh:
+            return json.loads(fh.read())
+    except (IOError, ValueError), e:
+        log.debug("Ignoring unreadable %s: %s", path, e)
+        return default
+
+
+def save(path, data, indent=None):
+    """Write data to path via a temporary file, returning whether it was
+    written.
+    """
+    if path is None:
+        return False
+    tmp_path = "%s.tmp" % path
+    try:
+        with open(tmp_path, 'w') as fh:
+            fh.write(json.dumps(data, indent=indent))
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        log.debug("Could not write %s: %s", path, e)
+        return False
+    return True
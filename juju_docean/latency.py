@@ -0,0 +1,94 @@
+"""
+Network latency from this host to digital ocean regions.
+
+Each region has a speedtest endpoint, whose tcp connect time is a good
+proxy for the round trip to machines in that region. Regions are probed
+in parallel, and results are cached under JUJU_HOME with a ttl.
+"""
+import logging
+import socket
+import threading
+import time
+
+from juju_docean import jsonfile
+
+log = logging.getLogger("juju.docean")
+
+ENDPOINT = "speedtest-%s.digitalocean.com"
+PORT = 80
+LATENCY_FILE = "docean-latency.json"
+
+# Seconds before a region's latency is probed again.
+DEFAULT_TTL = 6 * 60 * 60
+
+
+def probe(host, port=PORT, timeout=2.0):
+    """Return the seconds taken to connect to host, or None if unreachable.
+    """
+    started = time.time()
+    try:
+        sock = socket.create_connection((host, port), timeout)
+    except (socket.error, socket.timeout), e:
+        log.debug("Could not probe latency to %s: %s", host, e)
+        return None
+    elapsed = time.time() - started
+    sock.close()
+    return elapsed
+
+
+def probe_regions(slugs, timeout=2.0):
+    """Probe regions in parallel, returning {slug: seconds or None}.
+    """
+    results = {}
+
+    def measure(slug):
+        results[slug] = probe(ENDPOINT % slug, timeout=timeout)
+
+    threads = [threading.Thread(target=measure, args=(s,)) for s in slugs]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join(timeout + 1)
+    return dict((s, results.get(s)) for s in slugs)
+
+
+class LatencyCache(object):
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self.data = self.load()
+
+    def load(self):
+        return jsonfile.load(self.path, {})
+
+    def save(self):
+        jsonfile.save(self.path, self.data)
+
+    def is_fresh(self, slug):
+        entry = self.data.get(slug)
+        if entry is None or self.refresh:
+            return False
+        return time.time() - entry['probed'] < self.ttl
+
+    def cached(self, slugs):
+        """Return known latencies of regions, without probing.
+        """
+        return dict((s, self.data[s]['latency']) for s in slugs
+                    if s in self.data and
+                    self.data[s]['latency'] is not None)
+
+    def get(self, slugs):
+        """Return latencies of reachable regions, probing stale ones.
+        """
+        stale = [s for s in slugs if not self.is_fresh(s)]
+        if stale:
+            now = time.time()
+            for slug, latency in probe_regions(stale).items():
+                self.data[slug] = {'latency': latency, 'probed': now}
+            log.debug("Probed latency to %d regions in %0.2f seconds",
+                      len(stale), time.time() - now)
+            self.save()
+        return self.cached(slugs)
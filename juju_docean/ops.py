@@ -1,11 +1,12 @@
+import base64
 import logging
-import subprocess
 import time
-import uuid
 
 
-from juju_docean.exceptions import TimeoutError, ProviderAPIError
-from juju_docean import ssh, constraints
+from juju_docean.exceptions import (
+    TimeoutError, ProviderAPIError, SSHError, SSHUnavailable)
+from juju_docean.retry import RetryPolicy, UNPROCESSABLE
+from juju_docean import ssh, constraints, tracing
 
 
 log = logging.getLogger("juju.docean")
@@ -19,42 +20,162 @@ class MachineOp(object):
         self.params = params
         self.created = time.time()
         self.options = options
+        # Ops run in runner threads, traced under the span they're made in.
+        self.trace_parent = tracing.current()
 
     def run(self):
         raise NotImplementedError()
 
+    def launch(self, launch, params, *args):
+        """Launch with params, failing over to the next best region if the
+        placement scheduler's chosen region rejects the create.
+
+        Images can be regional, so the image is resolved again for the new
+        region where the op was given an images function.
+        """
+        scheduler = self.options.get('scheduler')
+        while True:
+            try:
+                with tracing.span("create", region=params['region_id'],
+                                  size=params['size_id']):
+                    return launch(params, *args)
+            except ProviderAPIError, e:
+                if scheduler is None or not scheduler.is_rejection(e):
+                    raise
+                placement = scheduler.failover(
+                    params['region_id'], params['size_id'])
+                if placement is None:
+                    raise
+                log.warning(
+                    "Region %s rejected machine create (%s), trying %s",
+                    params['region_id'], e.message, placement[1])
+                params = dict(params)
+                params['size_id'], params['region_id'] = placement
+                if self.options.get('images') is not None:
+                    params['image_id'] = self.options['images'](
+                        params['region_id'])
+
 
 class MachineUserDataRegister(MachineOp):
+    """Register machines with juju, and launch them with juju's provisioning
+    scripts as user data.
+
+    The machines provision themselves as they boot, so there's no waiting
+    on ssh. Completion is seen as each machine's agent starting. Identical
+    machines are launched together with one api call, sharing user data
+    that carries each machine's script and dispatches on the droplet name
+    reported by the metadata service.
+    """
+
+    # Digital ocean's limit on user data size.
+    max_user_data = 64 * 1024
+
+    # Provisioning output is kept on the machine for debugging.
+    script_header = """#!/bin/bash
+exec >> /var/log/juju-provision.log 2>&1
+"""
+
+    dispatch_header = (
+        "name=$(curl -s http://169.254.169.254/metadata/v1/hostname"
+        " || hostname)\n"
+        "case \"$name\" in\n")
+    dispatch_case = """%s)
+    echo %s | base64 -d > /tmp/juju-provision.sh ;;
+"""
+    dispatch_footer = """*)
+    echo "No juju provisioning script for $name" >&2; exit 1 ;;
+esac
+exec /bin/bash /tmp/juju-provision.sh
+"""
 
     def run(self):
-        client = self.env.connect()
-        nonce = "manual:%s" % uuid.uuid4().get_hex()
-        result = client.register_machine(
-            self.params['name'],
-            nonce,
-            series=self.options['series'],
-            hardware=constraints.size_to_resources(self.params['size_id']),
-            addrs=[])
-        script = client.provisioning_script(result['Machine'], nonce)
-        self.params['user_data'] = "#!/bin/bash\n%s" % script['Script']
-        instance = self.provider.launch_instance(self.params)
-        instance.machine_id = result['Machine']
-        client.close()
-        return instance
+        names = self.options.get('names') or [self.params['name']]
+        with tracing.span("register", count=len(names)):
+            registered = self.env.register_machines(
+                map(self.machine_spec, names))
+        machines = [(name,) + r for name, r in zip(names, registered)]
+
+        instances = []
+        try:
+            for batch in self.batches(machines):
+                params = dict(self.params)
+                params['user_data'] = self.user_data(batch)
+                launched = self.launch(
+                    self.provider.launch_instances, params,
+                    [name for name, _, _ in batch])
+                for instance, (_, machine_id, _) in zip(launched, batch):
+                    instance.machine_id = machine_id
+                instances.extend(launched)
+        except:
+            # Don't leave juju waiting on machines that will never start.
+            launched_ids = set(i.machine_id for i in instances)
+            self.env.terminate_machines([
+                m for _, m, _ in machines if m not in launched_ids])
+            raise
+        return instances
+
+    def machine_spec(self, name):
+        return {
+            'name': name,
+            'series': self.options['series'],
+            'hardware': constraints.size_to_resources(
+                self.params['size_id'])}
+
+    def user_data(self, machines):
+        """Return user data running each (name, machine id, script)'s
+        provisioning script on the droplet of that name.
+        """
+        if len(machines) == 1:
+            return "%s%s" % (self.script_header, machines[0][2])
+        cases = [self.dispatch_case % (
+                 name, base64.b64encode(script.encode('utf-8')))
+                 for name, _, script in machines]
+        return "%s%s%s%s" % (
+            self.script_header, self.dispatch_header, "".join(cases),
+            self.dispatch_footer)
+
+    def batches(self, machines):
+        """Split machines into groups whose user data fits the size limit.
+        """
+        batch = []
+        for m in machines:
+            if batch and len(self.user_data(batch + [m])) > \
+                    self.max_user_data:
+                yield batch
+                batch = []
+            batch.append(m)
+        if batch:
+            yield batch
 
 
 class MachineAdd(MachineOp):
 
     timeout = 360
-    delay = 8
+    # Readiness is probed without forking ssh, so we can check often.
+    delay = 3
+
+    master = None
+    # The droplet once created, and once it's ready.
+    launched = None
+    instance = None
 
     def run(self):
-        instance = self.provider.launch_instance(self.params)
-        self.provider.wait_on(instance)
-        instance = self.provider.get_instance(instance.id)
-        self.verify_ssh(instance)
+        instance = self.launch(self.provider.launch_instance, self.params)
+        self.launched = instance
+        with tracing.span("active-wait", instance_id=instance.id):
+            self.provider.wait_on(instance, self.params.get('tags'))
+            instance = self.provider.get_instance(instance.id)
+        with tracing.span("ssh-ready", instance_id=instance.id):
+            self.verify_ssh(instance)
+        self.instance = instance
         return instance
 
+    def close(self):
+        """Tear down the ssh connection held open for later steps.
+        """
+        if self.master is not None:
+            self.master.stop()
+
     def verify_ssh(self, instance):
         """Workaround for manual provisioning and ssh availability.
 
@@ -63,27 +184,24 @@ class MachineAdd(MachineOp):
         """
         max_time = self.timeout + time.time()
         running = False
+        self.master = ssh.ControlMaster(instance.ip_address)
         while max_time > time.time():
             try:
-                if ssh.check_ssh(instance.ip_address):
+                if ssh.check_ssh(instance.ip_address, master=self.master):
                     running = True
                     break
-            except subprocess.CalledProcessError, e:
-                if ("Connection refused" in e.output or
-                        "Connection timed out" in e.output or
-                        "Connection closed" in e.output or
-                        "Connection reset by peer" in e.output):
-                    log.debug(
-                        "Waiting for ssh on id:%s ip:%s name:%s remaining:%d",
-                        instance.id, instance.ip_address, instance.name,
-                        int(max_time-time.time()))
-                    time.sleep(self.delay)
-                else:
-                    log.error(
-                        "Could not ssh to instance name: %s id: %s ip: %s\n%s",
-                        instance.name, instance.id, instance.ip_address,
-                        e.output)
-                    raise
+            except SSHUnavailable, e:
+                log.debug(
+                    "Waiting for ssh on id:%s ip:%s name:%s remaining:%d (%s)",
+                    instance.id, instance.ip_address, instance.name,
+                    int(max_time-time.time()), e.message)
+                time.sleep(self.delay)
+            except SSHError, e:
+                log.error(
+                    "Could not ssh to instance name: %s id: %s ip: %s\n%s",
+                    instance.name, instance.id, instance.ip_address,
+                    e.output or e.message)
+                raise
 
         if running is False:
             raise TimeoutError(
@@ -91,38 +209,53 @@ class MachineAdd(MachineOp):
                     instance.id, instance.name, instance.ip_address))
 
 
-class MachineRegister(MachineAdd):
+class MachineProvision(MachineOp):
+    """Provision a running, registered instance as a juju machine over ssh.
+
+    Runs the machine's juju provisioning script as manual provisioning
+    would, reusing the ssh connection from the readiness check.
+    """
 
     def run(self):
-        instance = super(MachineRegister, self).run()
+        instance = self.params['instance']
+        master = self.options.get('master')
+        options = master is not None and master.options() or []
+        if self.options.get('key'):
+            options = options + ['-i', self.options['key']]
         try:
-            machine_id = self.env.add_machine(
-                "ssh:root@%s" % instance.ip_address,
-                key=self.options.get('key'))
+            with tracing.span("provision", instance_id=instance.id):
+                ssh.run(instance.ip_address, ["/bin/bash", "-s"],
+                        options=options, input=self.params['script'])
         except:
+            self.env.terminate_machines([self.params['machine_id']])
             self.provider.terminate_instance(instance.id)
             raise
-        return instance, machine_id
+        finally:
+            if master is not None:
+                master.stop()
+        instance.machine_id = self.params['machine_id']
+        return instance
 
 
 class MachineDestroy(MachineOp):
 
+    # Droplets can't be destroyed while they have a pending event, ie.
+    # while still being created, so those refusals are retried. Transient
+    # errors are already retried by the client.
+    retry = RetryPolicy(
+        attempts=10, base_delay=6.0, max_delay=60.0,
+        retry_on=(UNPROCESSABLE,))
+
     def run(self):
+        with tracing.span("terminate", instance_id=self.params.get(
+                'instance_id'), machine_id=self.params.get('machine_id')):
+            self.terminate()
+
+    def terminate(self):
         if not self.options.get('iaas_only'):
             self.env.terminate_machines([self.params['machine_id']])
         if self.options.get('env_only'):
             return
         log.debug("Destroying instance %s", self.params['instance_id'])
-        while True:
-            try:
-                self.provider.terminate_instance(self.params['instance_id'])
-                break
-            except ProviderAPIError, e:
-                # The vm has a pending event, sleep and try again.
-                if e.message['id'] == 'unprocessable_entity':
-                    log.debug(
-                        "Waiting for pending instance action to complete.")
-                    time.sleep(6)
-                    continue
-                raise
-            break
+        self.retry.call(
+            self.provider.terminate_instance, self.params['instance_id'])
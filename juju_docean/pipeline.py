@@ -0,0 +1,122 @@
+"""
+Dependency graph execution of command stages.
+
+Stages declare the stages they require, and each runs in its own thread
+as soon as those have completed, so independent api lookups, local file
+preparation, and waiting on droplets overlap. Per stage timings are kept
+for reporting.
+"""
+import logging
+import threading
+import time
+
+from juju_docean import tracing
+
+log = logging.getLogger("juju.docean")
+
+
+class Stage(object):
+
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+class Pipeline(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.results = {}
+        self.errors = []
+        self.cond = threading.Condition()
+        self.started = None
+        self.finished = None
+
+    def add(self, name, func, requires=()):
+        """Add a stage, called with the results of its required stages.
+        """
+        for r in requires:
+            if r not in [s.name for s in self.stages]:
+                raise ValueError("Stage %s requires unknown stage %s" % (
+                    name, r))
+        self.stages.append(Stage(name, func, requires))
+
+    def run(self):
+        """Run all stages, returning their results by name.
+
+        On a stage failure no further stages are started, and the error is
+        raised once running stages have finished.
+        """
+        self.started = time.time()
+        pending = list(self.stages)
+        running = set()
+        with self.cond:
+            while pending or running:
+                if not self.errors:
+                    for stage in [s for s in pending if self.is_ready(s)]:
+                        pending.remove(stage)
+                        running.add(stage)
+                        self.start(stage, running)
+                elif not running:
+                    break
+                self.cond.wait(1)
+        self.finished = time.time()
+        if self.errors:
+            raise self.errors[0]
+        return self.results
+
+    def is_ready(self, stage):
+        return all(r in self.results for r in stage.requires)
+
+    def start(self, stage, running):
+        parent = tracing.current()
+
+        def run():
+            stage.started = time.time()
+            try:
+                with tracing.attached(parent):
+                    with tracing.span("stage.%s" % stage.name):
+                        result = stage.func(self.results)
+            except Exception, e:
+                log.debug("%s stage %s failed: %s", self.name, stage.name, e)
+                result, error = None, e
+            else:
+                error = None
+            stage.finished = time.time()
+            with self.cond:
+                if error is None:
+                    self.results[stage.name] = result
+                else:
+                    self.errors.append(error)
+                running.discard(stage)
+                self.cond.notify_all()
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def report(self):
+        """Log the time taken by each stage, and the overall time.
+        """
+        lines = ["%s stage timings:" % self.name]
+        for stage in sorted(self.stages, key=lambda s: s.started or 0):
+            if stage.started is None:
+                lines.append("  %-12s skipped" % stage.name)
+                continue
+            lines.append("  %-12s %6.2fs  (at +%.2fs)" % (
+                stage.name, stage.elapsed, stage.started - self.started))
+        total = (self.finished or time.time()) - self.started
+        busy = sum(s.elapsed for s in self.stages if s.started is not None)
+        lines.append("  %-12s %6.2fs  (%.2fs in stages)" % (
+            "total", total, busy))
+        log.info("\n".join(lines))
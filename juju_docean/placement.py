@@ -0,0 +1,117 @@
+"""
+Placement of machines across digital ocean regions.
+
+Machines can be spread over every region offering a size that matches
+their constraints, in proportion to how well each region scores on
+price, latency, and availability. A region that rejects a create is
+marked unavailable, and the machine fails over to the next best region.
+"""
+import logging
+import re
+import threading
+
+log = logging.getLogger("juju.docean")
+
+# Create failures meaning a region can't take the droplet at the moment,
+# rather than that the request itself is invalid. The api answers 422
+# for both, so they're told apart by the error message.
+REJECTED_STATUS = (422,)
+REJECTED_MESSAGE = re.compile(
+    r"capacity|(region|size).*(unavailable|not available)|"
+    r"(unavailable|not available).*(region|size)", re.I)
+
+
+class Scheduler(object):
+
+    # Weight of each factor in a region's cost. Price and latency are
+    # relative to the best region, availability counts rejected creates.
+    weights = {'price': 1.0, 'latency': 0.5, 'availability': 2.0}
+
+    def __init__(self, index, constraints, latencies=None, weights=None):
+        constraints = dict(constraints)
+        region = constraints.pop('region', None)
+        self.latencies = latencies or {}
+        if weights:
+            self.weights = dict(self.weights, **weights)
+        # region id -> (cheapest matching size id, price)
+        self.placements = {}
+        region_ids = region and [region] or sorted(index.regions)
+        for region_id in region_ids:
+            for size_id, price in index.feasible(region_id, constraints):
+                self.placements[region_id] = (size_id, price)
+                break
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_rejection(error):
+        """Whether a create failed for lack of capacity in the region.
+
+        Other refusals, ie. the account's droplet limit, or an image or
+        ssh key that doesn't exist, would fail in every region.
+        """
+        response = getattr(error, 'response', None)
+        if getattr(response, 'status_code', None) not in REJECTED_STATUS:
+            return False
+        message = getattr(error, 'message', None)
+        if isinstance(message, dict):
+            message = message.get('message')
+        if not isinstance(message, basestring) or 'image' in message.lower():
+            return False
+        return REJECTED_MESSAGE.search(message) is not None
+
+    def cost(self, region_id):
+        size_id, price = self.placements[region_id]
+        best_price = min(p for s, p in self.placements.values()) or 1.0
+        latency = 1.0
+        known = [l for r, l in self.latencies.items()
+                 if r in self.placements]
+        if region_id in self.latencies and min(known) > 0:
+            latency = self.latencies[region_id] / min(known)
+        return (self.weights['price'] * price / best_price +
+                self.weights['latency'] * latency +
+                self.weights['availability'] *
+                self.failures.get(region_id, 0))
+
+    def ranked(self):
+        """Return available regions, best first.
+        """
+        return sorted(
+            [r for r in self.placements if not self.failures.get(r)],
+            key=lambda r: (self.cost(r), r))
+
+    def allocate(self, count):
+        """Split count machines over regions in inverse proportion to
+        their cost, returning [(size id, region id, count)].
+        """
+        with self.lock:
+            regions = self.ranked()
+            if not regions:
+                return []
+            shares = [1.0 / self.cost(r) for r in regions]
+            quotas = [count * s / sum(shares) for s in shares]
+            counts = [int(q) for q in quotas]
+            # Largest remainders take the machines left over by rounding.
+            by_remainder = sorted(
+                range(len(regions)), key=lambda i: counts[i] - quotas[i])
+            for i in by_remainder[:count - sum(counts)]:
+                counts[i] += 1
+        return [(self.placements[r][0], r, n)
+                for r, n in zip(regions, counts) if n]
+
+    def failover(self, region_id, size_id=None):
+        """Mark a region as having rejected a create, and return the next
+        best (size id, region id) placement, or None if there's none left.
+
+        Regions offering the same size are preferred, so the machine keeps
+        the hardware it was registered with.
+        """
+        with self.lock:
+            self.failures[region_id] = self.failures.get(region_id, 0) + 1
+            regions = self.ranked()
+        if not regions:
+            return None
+        for r in regions:
+            if self.placements[r][0] == size_id:
+                return size_id, r
+        return self.placements[regions[0]][0], regions[0]
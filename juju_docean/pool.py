@@ -0,0 +1,284 @@
+"""
+Warm pool of ready droplets for add-machine to claim.
+
+Most of adding a machine is waiting for the droplet to boot and accept
+ssh. The pool keeps a target number of booted, ssh verified droplets per
+size, region, and image, so add-machine can claim them and go straight
+to registering them with juju.
+
+Droplets are tagged juju-pool-warming while booting, and juju-pool once
+verified. Claiming moves a droplet out of the pool by retagging and
+renaming it into the environment. Targets are kept under JUJU_HOME, so
+the pool can be refilled in the background after a claim, and claims and
+trims hold a lock file beside them so concurrent commands don't move the
+same droplet twice. The tags are account wide, so only droplets matching
+this JUJU_HOME's targets are ever expired.
+"""
+import calendar
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean import jsonfile, ops
+from juju_docean.watcher import ActionWatcher
+
+log = logging.getLogger("juju.docean")
+
+POOL_TAG = "juju-pool"
+WARMING_TAG = "juju-pool-warming"
+POOL_FILE = "docean-pool.json"
+
+# Seconds a droplet may sit idle in the pool before it's replaced.
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+# Seconds after which a droplet still warming has failed to boot or
+# accept ssh, and will never be verified.
+WARMING_TIMEOUT = ActionWatcher.timeout + ops.MachineAdd.timeout
+
+
+def created_time(droplet):
+    try:
+        return calendar.timegm(
+            time.strptime(droplet.created_at, "%Y-%m-%dT%H:%M:%SZ"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def refill_in_background(env_name):
+    """Start a detached refill of the pool, outliving this command.
+    """
+    with open(os.devnull, 'w') as devnull:
+        subprocess.Popen(
+            [sys.executable, "-m", "juju_docean.cli",
+             "pool", "--refill", "-e", env_name],
+            stdin=devnull, stdout=devnull, stderr=devnull,
+            close_fds=True, preexec_fn=os.setsid)
+
+
+class WarmPool(object):
+
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = path
+        self.targets = self.load()
+        self.members = None
+
+    def load(self):
+        return jsonfile.load(self.path, [])
+
+    def save(self):
+        if not jsonfile.save(self.path, self.targets, indent=2):
+            log.warning("Could not save pool targets to %s", self.path)
+
+    def target(self, size_id, region_id, image_id):
+        for t in self.targets:
+            if (t['size_id'], t['region_id'], t['image_id']) == (
+                    size_id, region_id, image_id):
+                return t
+
+    def set_target(self, series, size_id, region_id, image_id, count,
+                   max_age=DEFAULT_MAX_AGE):
+        """Set the number of droplets to keep ready.
+
+        A target set to zero is kept until its droplets have expired, as
+        droplets without a target are left alone.
+        """
+        target = self.target(size_id, region_id, image_id)
+        if target is not None:
+            self.targets.remove(target)
+        self.targets.append(dict(
+            series=series, size_id=size_id, region_id=region_id,
+            image_id=image_id, count=count, max_age=max_age))
+        self.save()
+
+    def list_members(self):
+        """Return pool droplets by (size, region, image) and tag, listed
+        once until reset.
+        """
+        if self.members is None:
+            self.members = {}
+            client = self.provider.client
+            for tag in (POOL_TAG, WARMING_TAG):
+                for d in client.iter_droplets(tag_name=tag):
+                    key = (d.size_id, d.region_id, d.image_id)
+                    self.members.setdefault(key, {}).setdefault(
+                        tag, []).append(d)
+        return self.members
+
+    def reset(self):
+        self.members = None
+
+    @contextmanager
+    def locked(self):
+        """Hold the pool's lock, listing members afresh under it.
+        """
+        with open("%s.lock" % self.path, 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                self.reset()
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def claim(self, size_id, region_id, image_id, names, tags=()):
+        """Claim up to len(names) ready droplets, moving them into an
+        environment under the given names and tags.
+        """
+        target = self.target(size_id, region_id, image_id)
+        if target is None:
+            return []
+        with self.locked():
+            ready = self.list_members().get(
+                (size_id, region_id, image_id), {}).get(POOL_TAG, [])
+            # Oldest first, as they're closest to expiring.
+            ready.sort(key=lambda d: created_time(d) or 0)
+            pool_names = dict((d.id, d.name) for d in ready)
+            claimed = []
+            for d in [d for d in ready if d.status == 'active']:
+                if len(claimed) == len(names):
+                    break
+                try:
+                    if self.move(d, names[len(claimed)], tags):
+                        claimed.append(d)
+                except ProviderAPIError:
+                    self.restore(claimed + [d], pool_names, tags)
+                    raise
+                ready.remove(d)
+        if claimed:
+            log.info("Claimed %d machines from the pool", len(claimed))
+        return claimed
+
+    def move(self, droplet, name, tags=()):
+        """Take a droplet out of the pool under a new name and tags,
+        returning False if it's been destroyed meanwhile.
+
+        The droplet is tagged into the environment before it's untagged
+        from the pool, so a failure never leaves it without either.
+        """
+        client = self.provider.client
+        try:
+            for tag in tags:
+                client.tag_droplets(tag, [droplet.id])
+            client.untag_droplets(POOL_TAG, [droplet.id])
+            client.rename_droplet(droplet.id, name)
+        except ProviderAPIError, e:
+            if e.response.status_code != 404:
+                raise
+            log.debug("Pool droplet %s is gone", droplet.name)
+            return False
+        droplet.name = name
+        return True
+
+    def restore(self, droplets, pool_names, tags=()):
+        """Return droplets from a failed claim to the pool, destroying
+        any that can't be.
+        """
+        client = self.provider.client
+        for d in droplets:
+            try:
+                client.tag_droplets(POOL_TAG, [d.id])
+                for tag in tags:
+                    client.untag_droplets(tag, [d.id])
+                if d.name != pool_names[d.id]:
+                    client.rename_droplet(d.id, pool_names[d.id])
+                    d.name = pool_names[d.id]
+            except ProviderAPIError, e:
+                log.warning(
+                    "Destroying droplet %s, it couldn't be returned to the"
+                    " pool: %s", d.name, e)
+                try:
+                    self.provider.terminate_instance(d.id)
+                except ProviderAPIError, e:
+                    log.error("Could not destroy droplet %s: %s", d.name, e)
+
+    def expire(self):
+        """Destroy droplets idle past their target's max age, warming past
+        the time they could be verified, or beyond the target's count,
+        returning them.
+
+        Droplets without a target may belong to another JUJU_HOME's pool
+        on the same account, and are left alone.
+        """
+        now = time.time()
+        expired = []
+        with self.locked():
+            for key, members in self.list_members().items():
+                target = self.target(*key)
+                if target is None:
+                    continue
+                for tag, droplets in members.items():
+                    for d in list(droplets):
+                        idle = now - (created_time(d) or now)
+                        if idle > target['max_age'] or (
+                                tag == WARMING_TAG and
+                                idle > WARMING_TIMEOUT):
+                            expired.append(d)
+                            droplets.remove(d)
+                # Trim ready droplets beyond the target, oldest first.
+                excess = sum(map(len, members.values())) - target['count']
+                ready = sorted(members.get(POOL_TAG, []),
+                               key=lambda d: created_time(d) or now)
+                for d in ready[:max(excess, 0)]:
+                    expired.append(d)
+                    members[POOL_TAG].remove(d)
+            for d in expired:
+                log.debug("Expiring pool droplet %s", d.name)
+                self.provider.terminate_instance(d.id)
+            emptied = [t for t in self.targets if not t['count'] and not any(
+                self.list_members().get((
+                    t['size_id'], t['region_id'], t['image_id']),
+                    {}).values())]
+            if emptied:
+                self.targets = [
+                    t for t in self.targets if t not in emptied]
+                self.save()
+        return expired
+
+    def refill(self, runner, ssh_key_ids):
+        """Expire stale droplets, then launch and verify enough new ones to
+        meet each target. Returns the number of droplets added.
+        """
+        self.expire()
+        client = self.provider.client
+        adds = []
+        for target in self.targets:
+            members = self.list_members().get((
+                target['size_id'], target['region_id'],
+                target['image_id']), {})
+            deficit = target['count'] - sum(map(len, members.values()))
+            for i in range(deficit):
+                params = dict(
+                    name="%s-%s" % (POOL_TAG, uuid.uuid4().hex),
+                    size_id=target['size_id'], region_id=target['region_id'],
+                    image_id=target['image_id'], ssh_key_ids=ssh_key_ids,
+                    tags=[WARMING_TAG])
+                adds.append(ops.MachineAdd(
+                    self.provider, None, params, series=target['series']))
+                runner.queue_op(adds[-1])
+        for result in runner.iter_results():
+            pass
+
+        ready = []
+        for op in adds:
+            op.close()
+            if op.instance is not None:
+                ready.append(op.instance.id)
+            elif op.launched is not None:
+                # Failed warmups would otherwise count against the target
+                # until they expire.
+                log.debug("Destroying failed pool droplet %s",
+                          op.launched.name)
+                self.provider.terminate_instance(op.launched.id)
+        if ready:
+            client.create_tag(POOL_TAG)
+            client.tag_droplets(POOL_TAG, ready)
+            client.untag_droplets(WARMING_TAG, ready)
+        self.reset()
+        log.info("Added %d of %d machines to the pool", len(ready), len(adds))
+        return len(ready)
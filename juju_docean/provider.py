@@ -1,18 +1,33 @@
 import logging
 import os
+import re
 import time
 
+from juju_docean.catalog import Catalog, CATALOG_FILE
 from juju_docean.exceptions import ConfigError, ProviderError
 from juju_docean.client import Client
 from juju_docean.constraints import init
+from juju_docean.inventory import env_name_of
+from juju_docean.latency import LatencyCache, LATENCY_FILE
+from juju_docean.runner import RESOURCE_LIMITS
+from juju_docean.watcher import ActionWatcher
 
 log = logging.getLogger("juju.docean")
 
 
-def factory():
+def factory(config=None):
     cfg = DigitalOcean.get_config()
     ans = DigitalOcean(cfg)
-    init(ans.client)
+    if config is None:
+        init(ans.client, latency=LatencyCache())
+        return ans
+    ans.catalog = Catalog(
+        ans.client, os.path.join(config.juju_home, CATALOG_FILE),
+        refresh=config.refresh_catalog)
+    latency = LatencyCache(
+        os.path.join(config.juju_home, LATENCY_FILE),
+        refresh=config.refresh_catalog)
+    init(ans.client, data=ans.catalog.constraint_data(), latency=latency)
     return ans
 
 
@@ -20,14 +35,28 @@ def validate():
     DigitalOcean.get_config()
 
 
+def env_tag(env_name):
+    """Return the tag marking droplets as part of a juju environment.
+    """
+    return "juju-env-%s" % re.sub(r"[^A-Za-z0-9:_-]", "_", env_name)
+
+
 class DigitalOcean(object):
 
+    catalog = None
+
+    # Droplet actions like snapshots can take several minutes.
+    action_timeout = 1800
+    action_interval = 10
+
     def __init__(self, config, client=None):
         self.config = config
         if client is None:
-            self.client = Client.connect(config)
+            self.client = Client.connect(
+                config, pool_size=RESOURCE_LIMITS['api'])
         else:
             self.client = client
+        self.watcher = ActionWatcher(self.client)
 
     @property
     def version(self):
@@ -53,6 +82,10 @@ class DigitalOcean(object):
         if ssh_key:
             provider_conf['DO_SSH_KEY'] = ssh_key
 
+        api_url = os.environ.get('DO_API_URL')
+        if api_url:
+            provider_conf['DO_API_URL'] = api_url
+
         if (not 'DO_CLIENT_ID' in provider_conf or
                 not 'DO_API_KEY' in provider_conf) and \
            not 'DO_OAUTH_TOKEN' in provider_conf:
@@ -66,45 +99,122 @@ class DigitalOcean(object):
         log.debug("Using DO ssh keys: %s" % (", ".join(k.name for k in keys)))
         return keys
 
-    def get_instances(self):
-        return self.client.get_droplets()
+    def iter_images(self):
+        if self.catalog is not None:
+            return iter(self.catalog.get('images'))
+        return self.client.iter_images()
+
+    def iter_instances(self, env_name=None):
+        """Iterate over droplets, optionally only those in an environment.
+
+        Environments are filtered by tag on the api side once their tag
+        exists. Otherwise all droplets are listed and filtered by name.
+        """
+        if env_name is None:
+            return self.client.iter_droplets()
+        if self.client.supports_tags and self.client.get_tag(
+                env_tag(env_name)):
+            return self.client.iter_droplets(tag_name=env_tag(env_name))
+        return (d for d in self.client.iter_droplets()
+                if env_name_of(d.name) == env_name)
+
+    def tag_environment(self, env_name):
+        """Tag an environment's existing droplets, returning their count.
+
+        The tag is only relied on for listing once it exists, so it's
+        created along with tagging all the droplets it should cover, and
+        removed again if they can't all be tagged.
+        """
+        if not self.client.supports_tags:
+            return 0
+        tag = env_tag(env_name)
+        droplet_ids = [d.id for d in self.client.iter_droplets()
+                       if env_name_of(d.name) == env_name]
+        self.client.create_tag(tag)
+        try:
+            if droplet_ids:
+                self.client.tag_droplets(tag, droplet_ids)
+        except:
+            self.client.delete_tag(tag)
+            raise
+        log.debug("Tagged %d droplets with %s", len(droplet_ids), tag)
+        return len(droplet_ids)
+
+    def ensure_environment_tag(self, env_name):
+        """Migrate an environment to tagging before launching into it.
+        """
+        if self.client.supports_tags and not self.client.get_tag(
+                env_tag(env_name)):
+            self.tag_environment(env_name)
+        return env_tag(env_name)
 
     def get_instance(self, instance_id):
         return self.client.get_droplet(instance_id)
 
     def launch_instance(self, params):
+        return self.client.create_droplet(**self._launch_params(params))
+
+    def launch_instances(self, params, names):
+        """Launch droplets sharing a template, batched where the api allows.
+        """
+        params = self._launch_params(params)
+        params.pop('name', None)
+        batch = self.client.max_batch
+        instances = []
+        for i in range(0, len(names), batch):
+            instances.extend(
+                self.client.create_droplets(names[i:i + batch], **params))
+        return instances
+
+    def _launch_params(self, params):
+        params = dict(params)
+        if not self.client.supports_tags:
+            params.pop('tags', None)
         if not 'virtio' in params:
             params['virtio'] = True
         if not 'private_networking' in params:
             params['private_networking'] = True
         if 'ssh_key_ids' in params:
             params['ssh_key_ids'] = map(str, params['ssh_key_ids'])
-        return self.client.create_droplet(**params)
+        return params
 
     def terminate_instance(self, instance_id):
         self.client.destroy_droplet(instance_id)
 
-    def wait_on(self, instance):
-        return self._wait_on(instance.event_id, instance.name)
-
-    def _wait_on(self, event, name, event_type=1):
-        loop_count = 0
-        while 1:
-            time.sleep(8)  # Takes on average 1m for a do instance.
-            done, result = self.client.create_done(event, name)
-            if done:
-                log.debug("Instance %s ready", name)
-                return
-            else:
-                log.debug("Waiting on instance %s", name)
-            if loop_count > 8:
-                # Its taking a long while (2m+), give the user some
-                # diagnostics if in debug mode.
-                log.debug("Diagnostics on instance %s event %s",
-                          name, result)
-            if loop_count > 25:
-                # After 3.5m for instance, just bail as provider error.
+    def wait_on(self, instance, tags=None):
+        """Block until an instance is active, listing droplets by the
+        first of the tags it was launched with where supported.
+        """
+        tag = None
+        if tags and self.client.supports_tags:
+            tag = tags[0]
+        return self.watcher.wait(instance, tag)
+
+    def wait_on_action(self, action):
+        """Block until a droplet action completes.
+        """
+        max_time = time.time() + self.action_timeout
+        while action.get('status') == 'in-progress':
+            if time.time() > max_time:
                 raise ProviderError(
-                    "Failed to get running instance %s event: %s" % (
-                        name, result))
-            loop_count += 1
+                    "Timed out waiting on %s action %s" % (
+                        action.get('type'), action.get('id')))
+            time.sleep(self.action_interval)
+            action = self.client.get_action(action['id'])
+        if action.get('status') != 'completed':
+            raise ProviderError("Droplet %s action %s failed: %s" % (
+                action.get('type'), action.get('id'), action.get('status')))
+        return action
+
+    def snapshot_instance(self, instance_id, name):
+        """Power off an instance and snapshot it, returning the image.
+        """
+        self.wait_on_action(
+            self.client.droplet_action(instance_id, 'power_off'))
+        self.wait_on_action(
+            self.client.droplet_action(instance_id, 'snapshot', name=name))
+        for image in self.client.get_snapshots(instance_id):
+            if image.name == name:
+                return image
+        raise ProviderError("Snapshot %s of %s not found" % (
+            name, instance_id))
@@ -0,0 +1,90 @@
+"""
+Client side scheduling of api requests against the account rate limit.
+
+Digital ocean reports the request budget on each response via the
+RateLimit-Limit, RateLimit-Remaining, and RateLimit-Reset headers. We
+track it as a token bucket, delaying requests before they're sent rather
+than having them fail with a 429. A share of the budget is held back
+for mutations, so bulk polling can't starve creates and destroys.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger("juju.docean")
+
+
+class RateLimiter(object):
+
+    # Requests are counted against a rolling hour.
+    window = 3600.0
+    # Fraction of the budget only mutations may use.
+    reserve_ratio = 0.1
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.limit = None
+        self.tokens = None
+        self.in_flight = 0
+        self.reset_at = 0
+        self.updated = time.time()
+
+    def acquire(self, mutation=False):
+        """Block until a request may be sent.
+        """
+        with self.cond:
+            while True:
+                delay = self._delay(mutation)
+                if delay <= 0:
+                    break
+                log.debug("Throttling %s api request for %0.1fs",
+                          mutation and "mutation" or "poll", delay)
+                self.cond.wait(delay)
+            if self.tokens is not None:
+                self.tokens -= 1
+            self.in_flight += 1
+
+    def release(self, headers=None):
+        """Record a completed request and the budget its response reported.
+        """
+        with self.cond:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers is not None:
+                self._update(headers)
+            self.cond.notify_all()
+
+    def _delay(self, mutation):
+        if self.limit is None:
+            return 0
+        now = time.time()
+        self._refill(now)
+        floor = not mutation and self.limit * self.reserve_ratio or 0
+        if self.tokens - 1 >= floor:
+            return 0
+        if self.tokens < 1 and self.reset_at > now:
+            return self.reset_at - now
+        return (floor + 1 - self.tokens) / (self.limit / self.window)
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.tokens = min(
+            self.limit, self.tokens + elapsed * self.limit / self.window)
+
+    def _update(self, headers):
+        limit = headers.get('RateLimit-Limit')
+        remaining = headers.get('RateLimit-Remaining')
+        if limit is None or remaining is None:
+            return
+        try:
+            limit, remaining, reset_at = (
+                int(limit), int(remaining),
+                int(headers.get('RateLimit-Reset', 0)))
+        except ValueError:
+            log.debug("Ignoring invalid rate limit headers %s", headers)
+            return
+        self.limit = limit
+        # Requests still in flight haven't been counted by the server.
+        self.tokens = float(remaining - self.in_flight)
+        self.reset_at = reset_at
+        self.updated = time.time()
@@ -0,0 +1,98 @@
+"""
+Retries of transient provider failures, with jittered exponential backoff.
+
+Errors are classified by what they say about the request: whether it was
+rate limited, failed on the server, or never reached the server, and so
+whether sending it again is safe and likely to succeed. A policy retries
+only the classes of error it's given, waiting a random delay of up to
+base * 2^attempt seconds between attempts, so callers failing together
+don't retry in lockstep.
+"""
+import logging
+import random
+import time
+
+import requests
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
+from juju_docean.exceptions import ProviderAPIError
+
+log = logging.getLogger("juju.docean")
+
+# The request was refused by the rate limit, and not processed.
+RATE_LIMITED = 'rate-limited'
+# The request failed on the server, and may or may not have taken effect.
+SERVER_ERROR = 'server-error'
+# No connection could be made, so the request was never sent.
+CONNECT_ERROR = 'connect-error'
+# The connection failed or timed out after the request may have been sent.
+CONNECTION_ERROR = 'connection-error'
+# The request was valid but refused in the resource's current state, ie.
+# destroying a droplet with a pending event.
+UNPROCESSABLE = 'unprocessable'
+
+TRANSIENT = (RATE_LIMITED, SERVER_ERROR, CONNECT_ERROR, CONNECTION_ERROR)
+
+# Errors after which retrying can't repeat a request's effect.
+UNSENT = (RATE_LIMITED, CONNECT_ERROR)
+
+
+def classify(error):
+    """Return the class of a failure, or None if it isn't transient.
+    """
+    if isinstance(error, ProviderAPIError):
+        status = getattr(error.response, 'status_code', None)
+        if status == 429:
+            return RATE_LIMITED
+        if status is not None and status >= 500:
+            return SERVER_ERROR
+        message = error.message
+        if status == 422 or isinstance(message, dict) and \
+                message.get('id') == 'unprocessable_entity':
+            return UNPROCESSABLE
+        return None
+    if isinstance(error, requests.ConnectionError):
+        reason = error.args and getattr(error.args[0], 'reason', None)
+        if isinstance(error, requests.exceptions.ConnectTimeout) or \
+                isinstance(reason, ConnectTimeoutError):
+            return CONNECT_ERROR
+        return CONNECTION_ERROR
+    if isinstance(error, requests.Timeout):
+        return CONNECTION_ERROR
+    return None
+
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=5, base_delay=1.0, max_delay=30.0,
+                 retry_on=TRANSIENT):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+
+    def delay(self, attempt):
+        """Return a random delay before the given retry, counting from 0.
+        """
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kw):
+        """Call func, retrying on failures of the policy's classes until
+        its attempts are used up, when the last error is raised.
+        """
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kw)
+            except Exception, e:
+                kind = classify(e)
+                if kind not in self.retry_on or attempt >= self.attempts:
+                    raise
+                delay = self.delay(attempt - 1)
+                log.debug(
+                    "Retrying %s after %s in %0.1fs (attempt %d of %d): %s",
+                    getattr(func, '__name__', func), kind, delay,
+                    attempt + 1, self.attempts, e)
+                time.sleep(delay)
+                attempt += 1
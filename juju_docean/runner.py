@@ -1,20 +1,52 @@
 """
 Thread based concurrency around bulk ops. do api is sync
+
+Op threads spend most of their time sleeping on provisioning, so the
+runner is wide, and actual use of each shared resource is bounded
+separately via :func:`resource`.
 """
 
+from contextlib import contextmanager
 import logging
 from Queue import Queue, Empty
 import threading
+import time
+
+from juju_docean import tracing
 
 
 log = logging.getLogger("juju.docean")
 
+# Max concurrent use of each resource type across all op threads. Api
+# calls are bounded by the size of the client's http connection pool.
+RESOURCE_LIMITS = {
+    'api': 8,
+    'ssh': 16,
+    'juju': 4}
+
+_resource_locks = dict(
+    (name, threading.BoundedSemaphore(count))
+    for name, count in RESOURCE_LIMITS.items())
+
+
+@contextmanager
+def resource(name):
+    """Hold one of the limited slots for a resource type.
+    """
+    lock = _resource_locks[name]
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
 
 class Runner(object):
 
-    DEFAULT_NUM_RUNNER = 4
+    DEFAULT_NUM_RUNNER = 64
 
-    def __init__(self):
+    def __init__(self, num_runners=DEFAULT_NUM_RUNNER):
+        self.num_runners = num_runners
         self.jobs = Queue()
         self.results = Queue()
         self.job_count = 0
@@ -29,7 +61,7 @@ class Runner(object):
         auto = not self.started
 
         if auto:
-            self.start(min(self.DEFAULT_NUM_RUNNER, self.job_count))
+            self.start(min(self.num_runners, self.job_count))
 
         for i in range(self.job_count):
             self.job_count -= 1
@@ -74,8 +106,22 @@ class OpRunner(threading.Thread):
             if op is None:
                 return
             try:
-                result = op.run()
+                with tracing.attached(getattr(op, 'trace_parent', None)):
+                    with tracing.span(
+                            "op.%s" % op.__class__.__name__,
+                            **self.trace_attrs(op)):
+                        result = op.run()
             except Exception, e:
                 log.exception("Error while processing op %s", op)
                 result = e
             self.results.put(result)
+
+    @staticmethod
+    def trace_attrs(op):
+        attrs = {}
+        if getattr(op, 'created', None) is not None:
+            attrs['queued'] = round(time.time() - op.created, 3)
+        params = getattr(op, 'params', None)
+        if isinstance(params, dict) and 'name' in params:
+            attrs['droplet'] = params['name']
+        return attrs
@@ -0,0 +1,52 @@
+"""
+Record of machine images built by the build-image command.
+
+Snapshots of a provisioned droplet with juju's agent dependencies
+preinstalled boot into ready machines faster than stock images. Built
+snapshot ids are kept per series under JUJU_HOME, and are preferred
+over the stock image wherever the snapshot is still available.
+"""
+import logging
+import time
+
+from juju_docean import jsonfile
+
+log = logging.getLogger("juju.docean")
+
+SNAPSHOT_FILE = "docean-snapshots.json"
+
+
+class SnapshotCache(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.data = self.load()
+
+    def load(self):
+        return jsonfile.load(self.path, {})
+
+    def save(self):
+        if not jsonfile.save(self.path, self.data, indent=2):
+            log.warning("Could not record built images in %s", self.path)
+
+    def record(self, series, image):
+        self.data[series] = {
+            'image_id': image.id, 'name': image.name,
+            'regions': image.regions, 'built': time.time()}
+        self.save()
+
+    def preferred(self, series, region_id, provider):
+        """Return the snapshot image id for series if it's still available
+        in the region, else None.
+        """
+        entry = self.data.get(series)
+        if entry is None or region_id not in entry['regions']:
+            return None
+        for image in provider.iter_images():
+            if image.id == entry['image_id']:
+                if region_id in image.regions:
+                    return image.id
+                break
+        log.debug("Built image %s for %s unavailable in %s",
+                  entry['name'], series, region_id)
+        return None
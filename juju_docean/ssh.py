@@ -1,5 +1,13 @@
+import os
+import pipes
+import shutil
+import socket
 import subprocess
 import logging
+import tempfile
+
+from juju_docean.exceptions import SSHError, SSHUnavailable, SSHAuthError
+from juju_docean.runner import resource
 
 log = logging.getLogger('juju.docean')
 
@@ -8,26 +16,187 @@ log = logging.getLogger('juju.docean')
 # check and apt-get update on precise instances).
 SSH_CMD = ("/usr/bin/ssh",
            "-o", "StrictHostKeyChecking=no",
-           "-o", "UserKnownHostsFile=/dev/null")
+           "-o", "UserKnownHostsFile=/dev/null",
+           "-o", "BatchMode=yes",
+           "-o", "ConnectTimeout=10")
+
+SSH_PORT = 22
+
+# ssh exits with this on connection and authentication failures, else
+# with the exit status of the remote command.
+SSH_ERROR_CODE = 255
+
+
+def probe_ssh(host, port=None, timeout=5):
+    """Check an ssh daemon is accepting connections, without forking ssh.
+
+    Connects and reads the server's identification banner, which sshd
+    only sends once it is ready to negotiate.
+    """
+    try:
+        sock = socket.create_connection((host, port or SSH_PORT), timeout)
+    except socket.timeout:
+        raise SSHUnavailable(host, "Connection timed out")
+    except socket.error, e:
+        raise SSHUnavailable(host, e.strerror or str(e))
+    try:
+        banner = sock.recv(255)
+    except socket.timeout:
+        raise SSHUnavailable(host, "Timed out waiting for banner")
+    except socket.error, e:
+        raise SSHUnavailable(host, e.strerror or str(e))
+    finally:
+        sock.close()
+    if not banner:
+        raise SSHUnavailable(host, "Connection closed")
+    if not banner.startswith("SSH-"):
+        raise SSHError(host, "Unexpected banner %r" % banner[:40])
+    return banner.strip()
+
 
+def run(host, command, user="root", options=(), input=None):
+    """Run a command on a host, raising SSHError subclasses on failure.
+    """
+    cmd = list(SSH_CMD) + list(options) + ["%s@%s" % (user, host)]
+    cmd.extend(command)
+    with resource('ssh'):
+        process = subprocess.Popen(
+            args=cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            stdin=input is not None and subprocess.PIPE or None)
+        output, _ = process.communicate(input)
+    if not process.returncode:
+        return output
+    raise classify_error(host, command, process.returncode, output)
 
-def check_ssh(host, user="root"):
-    cmd = list(SSH_CMD) + ["%s@%s" % (user, host), "ls"]
-    process = subprocess.Popen(
-        args=cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-    output, err = process.communicate()
-    retcode = process.poll()
+def classify_error(host, command, returncode, output):
+    if returncode != SSH_ERROR_CODE:
+        return SSHError(
+            host, "%s exited with %d" % (" ".join(command), returncode),
+            output)
+    if "Permission denied" in output:
+        return SSHAuthError(host, "Permission denied", output)
+    return SSHUnavailable(host, "Connection failed", output)
 
-    if retcode:
-        raise subprocess.CalledProcessError(retcode, cmd, output + (err or ''))
+
+def check_ssh(host, user="root", master=None):
+    """Check that a host is ready for ssh provisioning.
+
+    Only forks ssh once the daemon is answering with a banner. If a
+    control master is given, the check establishes its connection.
+    """
+    probe_ssh(host)
+    if master is not None:
+        master.start()
+    else:
+        run(host, ["true"], user)
     return True
 
 
-def update_instance(host, user="root"):
-    base = list(SSH_CMD) + ["%s@%s" % (user, host)]
-    subprocess.check_output(
-        base + ["apt-get", "update"], stderr=subprocess.STDOUT)
+class ControlMaster(object):
+    """A multiplexed ssh connection to a host, shared by later ssh steps.
+
+    Subsequent ssh invocations with :meth:`options` reuse the established
+    connection instead of doing a fresh key exchange. The juju cli shells
+    out to ssh for manual provisioning, so :meth:`env` provides a PATH
+    with an ssh wrapper that does the same.
+    """
+
+    # Bound on the master outliving us if we exit without stopping it.
+    persist = 900
+
+    def __init__(self, host, user="root"):
+        self.host = host
+        self.user = user
+        self.path = None
+
+    @property
+    def running(self):
+        return self.path is not None
+
+    def options(self):
+        if not self.running:
+            return []
+        return ["-o", "ControlPath=%s" % os.path.join(
+            self.path, "%r@%h:%p")]
+
+    def start(self):
+        if self.running:
+            return
+        self.path = tempfile.mkdtemp(prefix="juju-docean-ssh-")
+        cmd = list(SSH_CMD) + self.options() + [
+            "-o", "ControlMaster=yes",
+            "-o", "ControlPersist=%d" % self.persist,
+            "-N", "-f", "%s@%s" % (self.user, self.host)]
+        # The backgrounded master holds onto stdout, so we can't pipe it.
+        log_path = os.path.join(self.path, "master.log")
+        with resource('ssh'):
+            with open(os.devnull, 'r+') as null:
+                with open(log_path, 'w') as err:
+                    returncode = subprocess.call(
+                        cmd, stdin=null, stdout=null, stderr=err)
+        if returncode:
+            with open(log_path) as fh:
+                output = fh.read()
+            self._cleanup()
+            raise classify_error(
+                self.host, ["ControlMaster"], returncode, output)
+        with open(os.path.join(self.path, "ssh"), 'w') as fh:
+            fh.write('#!/bin/sh\nexec %s %s "$@"\n' % (
+                SSH_CMD[0], " ".join(map(pipes.quote, self.options()))))
+            os.fchmod(fh.fileno(), 0755)
+        log.debug("Started ssh control master for %s", self.host)
+
+    def env(self, env=None):
+        """Return a process environment that routes ssh via the master.
+        """
+        env = dict(env is None and os.environ or env)
+        if self.running:
+            env['PATH'] = os.pathsep.join(
+                [self.path, env.get('PATH', os.defpath)])
+        return env
+
+    def stop(self):
+        if not self.running:
+            return
+        cmd = list(SSH_CMD) + self.options() + [
+            "-O", "exit", "%s@%s" % (self.user, self.host)]
+        with open(os.devnull, 'r+') as null:
+            subprocess.call(cmd, stdin=null, stdout=null, stderr=null)
+        self._cleanup()
+        log.debug("Stopped ssh control master for %s", self.host)
+
+    def _cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+
+# Packages installed by juju's manual provisioning of machine agents.
+AGENT_PACKAGES = (
+    "curl", "cpu-checker", "bridge-utils", "rsyslog-gnutls", "cloud-utils",
+    "tmux")
+
+PREPARE_IMAGE_SCRIPT = """set -e
+export DEBIAN_FRONTEND=noninteractive APT_LISTCHANGES_FRONTEND=none
+apt-get -q update
+apt-get -q -y -o Dpkg::Options::=--force-confold dist-upgrade
+apt-get -q -y install %s
+apt-get clean
+rm -rf /var/lib/cloud/instances/* /var/log/cloud-init*.log
+"""
+
+
+def prepare_image(host, packages=AGENT_PACKAGES, user="root", master=None):
+    """Upgrade a host and install packages, readying it for a snapshot.
+    """
+    options = master is not None and master.options() or ()
+    return run(host, ["/bin/bash", "-s"], user, options,
+               input=PREPARE_IMAGE_SCRIPT % " ".join(packages))
+
+
+def update_instance(host, user="root", master=None):
+    options = master is not None and master.options() or ()
+    run(host, ["apt-get", "update"], user, options)
 # Don't really need to update the image, just the package lists.
 #    subprocess.check_output(base + [
 #        'DEBIAN_FRONTEND=noninteractive',
@@ -0,0 +1,94 @@
+import time
+
+from juju_docean.bench.fakeapi import FakeAPIServer, FakeCloud
+from juju_docean.bench.fakes import FakeJuju
+from juju_docean.client import Client_v1, Client_v2
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean.tests.base import Base
+
+
+class FakeAPITest(Base):
+
+    def setUp(self):
+        self.cloud = FakeCloud(boot_latency=0.2)
+        self.server = FakeAPIServer(self.cloud)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_v2_droplets(self):
+        client = Client_v2('abc', api_url=self.server.url)
+        client.page_size = 2
+        self.addCleanup(client.close)
+        droplets = client.create_droplets(
+            ['a', 'b', 'c'], '512mb', 1001, 'nyc3', tags=['juju-env-x'])
+        self.assertEqual([d.status for d in droplets], ['new'] * 3)
+        self.assertEqual(
+            client.request(droplets[0].event_id)['action']['status'],
+            'in-progress')
+
+        time.sleep(0.2)
+        # Listed over two pages.
+        listed = list(client.iter_droplets(tag_name='juju-env-x'))
+        self.assertEqual([d.name for d in listed], ['a', 'b', 'c'])
+        self.assertEqual(listed[0].status, 'active')
+        self.assertTrue(listed[0].ip_address.startswith('127.'))
+        self.assertEqual(client.get_tag('juju-env-x')['resources'], {
+            'droplets': {'count': 3}})
+
+        client.destroy_droplet(listed[0].id)
+        self.assertEqual(len(client.get_droplets()), 2)
+        self.assertEqual(
+            self.cloud.counts['POST v2.create_droplets'], 1)
+
+    def test_v1_droplets(self):
+        client = Client_v1('abc', 'xyz', api_url=self.server.url)
+        self.addCleanup(client.close)
+        [size] = [s for s in client.get_sizes() if s.slug == '512mb']
+        [region] = [r for r in client.get_regions() if r.slug == 'nyc3']
+        droplet = client.create_droplet('a', size.id, 1001, region.id)
+        self.assertEqual(client.get_droplet(droplet.id).status, 'new')
+        time.sleep(0.2)
+        self.assertEqual(client.get_droplet(droplet.id).status, 'active')
+
+    def test_rate_limit(self):
+        self.cloud.rate_limit = self.cloud.tokens = 1000
+        client = Client_v2('abc', api_url=self.server.url)
+        self.addCleanup(client.close)
+        client.get_ssh_keys()
+        self.assertEqual(client.limiter.limit, 1000)
+        self.assertEqual(client.limiter.tokens, 999)
+        self.cloud.tokens = 0
+        response = client.session.get(self.server.url + "/v2/account/keys")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['RateLimit-Remaining'], '0')
+
+    def test_error_injection(self):
+        self.cloud.reject_rate = 1.0
+        client = Client_v2('abc', api_url=self.server.url)
+        self.addCleanup(client.close)
+        with self.assertRaises(ProviderAPIError) as e:
+            client.create_droplet('a', '512mb', 1001, 'nyc3')
+        self.assertEqual(e.exception.response.status_code, 422)
+        self.assertEqual(self.cloud.statuses[422], 1)
+
+
+class FakeJujuTest(Base):
+
+    def test_agents_start_after_boot(self):
+        cloud = FakeCloud(boot_latency=0.1)
+        juju = FakeJuju(cloud, agent_latency=0.1)
+        client = juju.client()
+        droplet, _ = cloud.create('a', '512mb', 'nyc3', 1001)
+        result = client.register_machines([
+            {'InstanceId': 'a', 'Series': 'trusty'}])
+        machine_id = result['Machines'][0]['Machine']
+        status = client.status()['Machines']
+        self.assertEqual(status[machine_id]['AgentState'], 'pending')
+        self.assertEqual(status[machine_id]['DNSName'], '')
+        time.sleep(0.2)
+        status = client.status()['Machines']
+        self.assertEqual(status[machine_id]['AgentState'], 'started')
+        self.assertEqual(
+            status[machine_id]['DNSName'], cloud.address(droplet))
+        client.destroy_machines([machine_id], force=True)
+        self.assertEqual(sorted(client.status()['Machines']), ['0'])
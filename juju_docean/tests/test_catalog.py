@@ -0,0 +1,74 @@
+import json
+import os
+
+import mock
+
+from juju_docean.catalog import Catalog
+from juju_docean.client import Image, Region, Size
+from juju_docean.tests.base import Base
+
+
+class CatalogTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'catalog.json')
+        self.client = mock.MagicMock()
+        self.client.version = 2.0
+        self.client.get_catalog.side_effect = self.get_catalog
+
+    def get_catalog(self, resource, etag=None):
+        if resource == 'sizes':
+            return [Size.from_dict(dict(
+                id='512mb', slug='512mb', name='512mb', memory=512, cpus=1,
+                disk=20, transfer=1, price=5.0))], 'etag-sizes'
+        elif resource == 'regions':
+            return [Region.from_dict(dict(
+                id='nyc3', slug='nyc3', name='New York 3'))], 'etag-regions'
+        return [Image.from_dict(dict(
+            id=1, slug='ubuntu-14-04-x64', name='14.04', public=True,
+            distribution='Ubuntu', regions=['nyc3']))], None
+
+    def test_warm_cache(self):
+        catalog = Catalog(self.client, self.path)
+        data = catalog.constraint_data()
+        self.assertEqual(data['sizes']['512mb'].disk, 20480)
+        self.assertEqual([r.slug for r in data['regions']], ['nyc3'])
+        self.assertEqual(self.client.get_catalog.call_count, 2)
+
+        self.client.get_catalog.reset_mock()
+        catalog = Catalog(self.client, self.path)
+        data = catalog.constraint_data()
+        self.assertEqual(data['sizes']['512mb'].disk, 20480)
+        self.assertEqual(
+            [i.slug for i in catalog.get('images')], ['ubuntu-14-04-x64'])
+        self.assertEqual(
+            [c[0][0] for c in self.client.get_catalog.call_args_list],
+            ['images'])
+
+    def test_stale_revalidated_with_etag(self):
+        Catalog(self.client, self.path).get('sizes')
+        with open(self.path) as fh:
+            data = json.loads(fh.read())
+        data['resources']['sizes']['fetched'] = 0
+        with open(self.path, 'w') as fh:
+            fh.write(json.dumps(data))
+
+        self.client.get_catalog.reset_mock()
+        self.client.get_catalog.side_effect = None
+        self.client.get_catalog.return_value = (None, 'etag-sizes')
+        sizes = Catalog(self.client, self.path).get('sizes')
+        self.client.get_catalog.assert_called_once_with('sizes', 'etag-sizes')
+        self.assertEqual([s.id for s in sizes], ['512mb'])
+
+    def test_refresh_ignores_cache(self):
+        Catalog(self.client, self.path).get('regions')
+        self.client.get_catalog.reset_mock()
+        Catalog(self.client, self.path, refresh=True).get('regions')
+        self.client.get_catalog.assert_called_once_with('regions', None)
+
+    def test_version_mismatch_ignores_cache(self):
+        Catalog(self.client, self.path).get('regions')
+        self.client.get_catalog.reset_mock()
+        self.client.version = 1.0
+        Catalog(self.client, self.path).get('regions')
+        self.client.get_catalog.assert_called_once_with('regions', None)
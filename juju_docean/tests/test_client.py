@@ -0,0 +1,206 @@
+import mock
+
+from juju_docean.bench.fakeapi import FakeAPIServer, FakeCloud
+from juju_docean.cli import log_connection_stats
+from juju_docean.client import Client, Client_v1, Client_v2, Droplet, Size
+from juju_docean.tests.base import Base
+
+
+class EntityTest(Base):
+
+    droplet_info = {
+        'id': 3, 'name': 'docean-0', 'status': 'active',
+        'size_slug': '512mb', 'created_at': '2014-08-25T12:00:00Z',
+        'region': {'slug': 'nyc3'}, 'image': {},
+        'networks': {'v4': [
+            {'type': 'private', 'ip_address': '10.0.0.2'},
+            {'type': 'public', 'ip_address': '162.243.1.2'}]}}
+
+    def test_lazy_fields(self):
+        droplet = Client_v2('abc').make_droplet(self.droplet_info)
+        self.assertFalse(hasattr(droplet, '__dict__'))
+        self.assertEqual(droplet.size_id, '512mb')
+        self.assertEqual(droplet.ip_address, '162.243.1.2')
+        self.assertEqual(droplet.region_id, 'nyc3')
+        self.assertRaises(AttributeError, getattr, droplet, 'image_id')
+        self.assertRaises(AttributeError, getattr, droplet, 'machine_id')
+        self.assertRaises(AttributeError, setattr, droplet, 'bogus', 1)
+        droplet.machine_id = '1'
+        self.assertEqual(droplet.machine_id, '1')
+
+    def test_to_json_round_trip(self):
+        droplet = Client_v2('abc').make_droplet(self.droplet_info)
+        droplet.event_id = '/actions/1'
+        data = droplet.to_json()
+        self.assertEqual(data, {
+            'id': 3, 'name': 'docean-0', 'status': 'active',
+            'size_id': '512mb', 'created_at': '2014-08-25T12:00:00Z',
+            'region_id': 'nyc3', 'ip_address': '162.243.1.2',
+            'event_id': '/actions/1'})
+        self.assertEqual(Droplet.from_dict(data).to_json(), data)
+
+    def test_assigned_field_overrides_json(self):
+        size = Size.from_dict({'id': '1gb', 'disk': 30})
+        size.disk *= 1024
+        self.assertEqual(size.disk, 30720)
+        self.assertEqual(size.to_json(), {'id': '1gb', 'disk': 30720})
+
+    def test_v1_paths(self):
+        size = Client_v1('abc', 'xyz').make_size({
+            'id': 66, 'name': '512MB', 'slug': '512mb', 'memory': 512,
+            'cpu': 1, 'disk': 20, 'cost_per_month': '5.0'})
+        self.assertEqual(
+            (size.cpus, size.transfer, size.price), (1, 1, 5.0))
+
+
+class ClientTest(Base):
+
+    def test_connect_pool_size(self):
+        client = Client.connect({'DO_OAUTH_TOKEN': 'abc'}, pool_size=12)
+        self.assertIsInstance(client, Client_v2)
+        self.assertEqual(client.pool_size, 12)
+        client = Client.connect(
+            {'DO_CLIENT_ID': 'abc', 'DO_API_KEY': 'xyz'}, pool_size=3)
+        self.assertIsInstance(client, Client_v1)
+        self.assertEqual(client.pool_size, 3)
+
+    def test_connect_api_url(self):
+        client = Client.connect({'DO_OAUTH_TOKEN': 'abc'})
+        self.assertEqual(
+            client.get_url("/droplets"),
+            "https://api.digitalocean.com/v2/droplets")
+        client = Client.connect({
+            'DO_OAUTH_TOKEN': 'abc', 'DO_API_URL': 'http://127.0.0.1:8080/'})
+        self.assertEqual(
+            client.get_url("/droplets"), "http://127.0.0.1:8080/v2/droplets")
+
+    def test_session_shared(self):
+        client = Client_v2('abc', pool_size=8)
+        session = client.session
+        self.assertIs(client.session, session)
+        adapter = session.get_adapter('https://api.digitalocean.com/v2')
+        self.assertEqual(adapter._pool_maxsize, 8)
+        self.assertTrue(adapter._pool_block)
+        client.close()
+        self.assertIsNot(client.session, session)
+
+    def test_connection_stats(self):
+        server = FakeAPIServer(FakeCloud())
+        server.start()
+        self.addCleanup(server.stop)
+        client = Client_v2('abc', api_url=server.url)
+        self.addCleanup(client.close)
+        self.assertEqual(
+            client.connection_stats(),
+            {'requests': 0, 'connections': 0, 'reused': 0})
+        for i in range(3):
+            client.get_ssh_keys()
+        self.assertEqual(
+            client.connection_stats(),
+            {'requests': 3, 'connections': 1, 'reused': 2})
+
+    def test_connection_stats_never_fail_command(self):
+        client = mock.MagicMock()
+        client.connection_stats.side_effect = NotImplementedError()
+        log_connection_stats(client)
+
+    def test_request_uses_session(self):
+        client = Client_v2('abc')
+        response = mock.MagicMock(status_code=200)
+        response.json.return_value = {'droplets': []}
+        with mock.patch.object(
+                client.session, 'request',
+                return_value=response) as request:
+            self.assertEqual(client.get_droplets(), [])
+        self.assertEqual(
+            request.call_args[0],
+            ('GET', 'https://api.digitalocean.com/v2/droplets'))
+        self.assertEqual(
+            request.call_args[1]['headers'],
+            {'Authorization': 'Bearer abc'})
+
+    def test_iter_droplets_follows_pages(self):
+        client = Client_v2('abc')
+        next_url = ('https://api.digitalocean.com/v2/droplets'
+                    '?page=2&per_page=1')
+
+        def droplet(id):
+            return {'id': id, 'name': 'docean-%d' % id, 'status': 'active',
+                    'size_slug': '512mb', 'created_at': '', 'region': {},
+                    'image': {}, 'networks': {}}
+
+        pages = {
+            '/droplets': {
+                'droplets': [droplet(1)],
+                'links': {'pages': {'next': next_url}}},
+            next_url: {'droplets': [droplet(2)], 'links': {}}}
+        targets = []
+
+        def request(target, method='GET', params=None, data=None):
+            targets.append(target)
+            return pages[target]
+
+        client.request = request
+        self.assertEqual(
+            [d.id for d in client.iter_droplets()], [1, 2])
+        self.assertEqual(targets, ['/droplets', next_url])
+
+    def test_get_catalog_not_modified(self):
+        client = Client_v2('abc')
+        response = mock.MagicMock(status_code=304)
+        with mock.patch.object(
+                client.session, 'request',
+                return_value=response) as request:
+            self.assertEqual(
+                client.get_catalog('sizes', 'xyz'), (None, 'xyz'))
+        self.assertEqual(
+            request.call_args[1]['headers']['If-None-Match'], 'xyz')
+
+    def test_create_droplets(self):
+        client = Client_v2('abc')
+
+        def droplet(id, name):
+            return {'id': id, 'name': name, 'status': 'new',
+                    'size_slug': '512mb', 'created_at': '', 'region': {},
+                    'image': {}, 'networks': {}}
+
+        client.request = mock.MagicMock(return_value={
+            'droplets': [droplet(1, 'a'), droplet(2, 'b')],
+            'links': {'actions': [
+                {'id': 10, 'rel': 'create', 'href': '/actions/10'},
+                {'id': 11, 'rel': 'create', 'href': '/actions/11'}]}})
+        droplets = client.create_droplets(
+            ['a', 'b'], '512mb', 123, 'nyc3', ssh_key_ids=['1'])
+        self.assertEqual(
+            [(d.id, d.event_id) for d in droplets],
+            [(1, '/actions/10'), (2, '/actions/11')])
+        params = client.request.call_args[1]['data']
+        self.assertEqual(params['names'], ['a', 'b'])
+        self.assertNotIn('name', params)
+        self.assertEqual(params['ssh_keys'], ['1'])
+
+    def test_iter_droplets_by_tag(self):
+        client = Client_v2('abc')
+        client.request = mock.MagicMock(
+            return_value={'droplets': [], 'links': {}})
+        self.assertEqual(
+            list(client.iter_droplets(tag_name='juju-env-x')), [])
+        self.assertEqual(
+            client.request.call_args[1]['params'], {'tag_name': 'juju-env-x'})
+
+    def test_get_tag_missing(self):
+        client = Client_v2('abc')
+        response = mock.MagicMock(status_code=404)
+        response.json.return_value = {'id': 'not_found'}
+        with mock.patch.object(
+                client.session, 'request', return_value=response):
+            self.assertIsNone(client.get_tag('juju-env-x'))
+
+    def test_tag_droplets(self):
+        client = Client_v2('abc')
+        client.request = mock.MagicMock(return_value={})
+        client.tag_droplets('juju-env-x', [1, 2])
+        client.request.assert_called_once_with(
+            '/tags/juju-env-x/resources', 'POST', data={'resources': [
+                {'resource_id': '1', 'resource_type': 'droplet'},
+                {'resource_id': '2', 'resource_type': 'droplet'}]})
@@ -3,19 +3,23 @@ import mock
 import os
 import StringIO
 import tempfile
+import threading
 import unittest
 import yaml
 
 from juju_docean.commands import (
     BaseCommand,
     Bootstrap,
+    BuildImage,
     AddMachine,
     TerminateMachine,
     DestroyEnvironment)
 
 
-from juju_docean.client import SSHKey, Droplet
-from juju_docean.exceptions import ConfigError
+from juju_docean.client import SSHKey, Droplet, Image
+from juju_docean.env import MachineTable
+from juju_docean.ops import MachineUserDataRegister
+from juju_docean.exceptions import ConfigError, PrecheckError
 from juju_docean.tests.base import Base
 
 # Generated from constraints.images(do_client)
@@ -38,6 +42,9 @@ class CommandBase(Base):
         self.provider.get_ssh_keys.return_value = [
             SSHKey.from_dict({'id': 1, 'name': 'abc'})]
         self.config.series = "precise"
+        self.config.spread = False
+        self.config.wait_for_agents = False
+        self.config.juju_home = self.mkdir()
         with tempfile.NamedTemporaryFile(delete=False) as f:
             self.config.get_env_conf.return_value = f.name
             self.config.get_env_name.return_value = 'docean'
@@ -86,6 +93,27 @@ class BaseCommandTest(CommandBase):
         self.setup_env()
         self.assertEqual(self.cmd.check_preconditions(), [1])
 
+    @mock.patch('juju_docean.constraints.solve_constraints')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_solve_constraints_built_image(self, mock_get_images, mock_solve):
+        mock_get_images.return_value = IMAGE_MAP
+        mock_solve.return_value = ('512mb', 'nyc3')
+        self.setup_env()
+        self.assertEqual(
+            self.cmd.solve_constraints(), (5588928, '512mb', 'nyc3'))
+        image = Image.from_dict(dict(
+            id=99, name='juju-image-precise', regions=['nyc3']))
+        self.cmd.get_snapshots().record('precise', image)
+        self.provider.iter_images.side_effect = lambda: iter([image])
+        self.assertEqual(
+            self.cmd.solve_constraints(), (99, '512mb', 'nyc3'))
+        self.assertEqual(
+            self.cmd.solve_constraints(stock=True),
+            (5588928, '512mb', 'nyc3'))
+        # The snapshot isn't available in other regions.
+        self.assertEqual(self.cmd.resolve_image('sfo1'), 5588928)
+        self.assertEqual(mock_get_images.call_count, 1)
+
     def test_check_preconditions_host_exist(self):
         self.setup_env({
             'environments': {
@@ -149,7 +177,49 @@ class BootstrapTest(CommandBase):
             ip_address="10.0.2.1"))
         self.cmd.run()
 
-        mock_ssh.check_ssh.assert_called_once_with('10.0.2.1')
+        mock_ssh.check_ssh.assert_called_once_with(
+            '10.0.2.1', master=mock_ssh.ControlMaster.return_value)
+        mock_ssh.ControlMaster.return_value.stop.assert_called_once_with()
+        self.env.bootstrap_jenv.assert_called_once_with(
+            '10.0.2.1', env=mock_ssh.ControlMaster.return_value.env(),
+            boot_home=self.env.prepare_boot_home.return_value)
+        self.assertIn("Bootstrap stage timings:", self.output.getvalue())
+
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_bootstrap_precondition_failure(self, mock_get_images):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.env.is_running.return_value = True
+        self.assertRaises(PrecheckError, self.cmd.run)
+        self.assertFalse(self.provider.launch_instance.called)
+        self.assertFalse(self.provider.ensure_environment_tag.called)
+        self.env.remove_boot_home.assert_called_once_with()
+
+    @mock.patch('juju_docean.constraints.get_images')
+    @mock.patch('juju_docean.ops.ssh')
+    def test_bootstrap_sandbox_failure(self, mock_ssh, mock_get_images):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.env.is_running.return_value = False
+        launching = threading.Event()
+
+        def launch_instance(params):
+            launching.set()
+            return Droplet.from_dict(dict(id=2121))
+
+        def prepare_boot_home():
+            # Fail while the host is being launched.
+            launching.wait(5)
+            raise OSError("no space")
+
+        self.provider.launch_instance.side_effect = launch_instance
+        self.env.prepare_boot_home.side_effect = prepare_boot_home
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Droplet.from_dict(dict(
+            id=2121, name='docean-0', ip_address="10.0.2.1"))
+        self.assertRaises(OSError, self.cmd.run)
+        self.provider.terminate_instance.assert_called_once_with(2121)
+        self.assertFalse(self.env.bootstrap_jenv.called)
 
     # TODO
     # test existing named host / ie precondition check for live env
@@ -168,6 +238,180 @@ class AddMachineTest(CommandBase):
         self.setup_env()
         self.cmd.run()
 
+    @mock.patch('juju_docean.constraints.size_to_resources')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_add_machine_batched(self, mock_get_images, mock_resources):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.config.num_machines = 12
+        self.provider.version = 2.0
+        self.provider.client.max_batch = 10
+        machine_ids = iter(range(1, 13))
+        self.env.register_machines.side_effect = lambda specs: [
+            (str(mid), 'echo %s' % mid) for spec, mid in zip(
+                specs, machine_ids)]
+
+        def launch_instances(params, names):
+            self.assertIn('user_data', params)
+            return [Droplet.from_dict(dict(id=n, name=n)) for n in names]
+
+        self.provider.launch_instances.side_effect = launch_instances
+        self.cmd.run()
+        self.assertEqual(
+            sorted([len(c[0][1]) for c in
+                    self.provider.launch_instances.call_args_list]),
+            [2, 10])
+        self.assertEqual(
+            sorted([len(c[0][0]) for c in
+                    self.env.register_machines.call_args_list]),
+            [2, 10])
+
+    @mock.patch('juju_docean.commands.AgentWatcher')
+    @mock.patch('juju_docean.constraints.size_to_resources')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_add_machine_waits_for_agents(
+            self, mock_get_images, mock_resources, mock_watcher):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.config.num_machines = 2
+        self.config.wait_for_agents = True
+        self.provider.version = 2.0
+        self.provider.client.max_batch = 10
+        self.env.register_machines.return_value = [
+            ('1', 'echo 1'), ('2', 'echo 2')]
+        self.provider.launch_instances.side_effect = lambda params, names: [
+            Droplet.from_dict(dict(id=n, name=n)) for n in names]
+        mock_watcher.return_value.wait.return_value = (
+            ['1'], {'2': 'no tools'}, [])
+        self.cmd.run()
+        mock_watcher.return_value.wait.assert_called_once_with(['1', '2'])
+        self.assertIn(
+            "Machine 2 failed to provision: no tools", self.output.getvalue())
+
+    @mock.patch('juju_docean.ops.ssh')
+    @mock.patch('juju_docean.constraints.size_to_resources')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_add_machine_provision(
+            self, mock_get_images, mock_resources, mock_ssh):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.config.num_machines = 2
+        self.config.options.ssh_key = None
+        self.provider.version = 1.0
+        self.provider.get_instance.side_effect = lambda id: Droplet.from_dict(
+            dict(id=id, name='docean-%s' % id, ip_address='10.0.1.%s' % id,
+                 size_id='512mb'))
+        self.provider.launch_instance.side_effect = [
+            Droplet.from_dict(dict(id=1)), Droplet.from_dict(dict(id=2))]
+        self.env.register_machines.return_value = [
+            ('1', 'script-1'), ('2', 'script-2')]
+        mock_ssh.run.return_value = ''
+        self.cmd.run()
+
+        self.env.register_machines.assert_called_once()
+        self.assertEqual(
+            sorted([s['name'] for s in
+                    self.env.register_machines.call_args[0][0]]),
+            ['docean-1', 'docean-2'])
+        self.assertEqual(mock_ssh.run.call_count, 2)
+        self.assertEqual(
+            mock_ssh.run.call_args[0][1], ['/bin/bash', '-s'])
+        self.assertIn(
+            mock_ssh.run.call_args[1]['input'], ['script-1', 'script-2'])
+
+    @mock.patch('juju_docean.commands.refill_in_background')
+    @mock.patch('juju_docean.ops.ssh')
+    @mock.patch('juju_docean.constraints.size_to_resources')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_add_machine_from_pool(
+            self, mock_get_images, mock_resources, mock_ssh, mock_refill):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        self.config.num_machines = 3
+        self.config.options.ssh_key = None
+        self.provider.version = 2.0
+        self.provider.client.max_batch = 10
+        self.provider.ensure_environment_tag.return_value = 'juju-env-docean'
+        pool = self.cmd.get_pool()
+        pool.set_target('precise', '512mb', 'nyc3', IMAGE_MAP['precise'], 2)
+        self.provider.client.iter_droplets.side_effect = lambda tag_name: iter(
+            tag_name == 'juju-pool' and [Droplet.from_dict(dict(
+                id=i, name='juju-pool-%d' % i, status='active',
+                size_id='512mb', region_id='nyc3',
+                image_id=IMAGE_MAP['precise'], ip_address='10.0.1.%d' % i))
+                for i in (1, 2)] or [])
+        self.env.register_machines.side_effect = lambda specs: [
+            (s['name'], 'script') for s in specs]
+        self.provider.launch_instances.side_effect = lambda params, names: [
+            Droplet.from_dict(dict(id=n, name=n)) for n in names]
+        mock_ssh.run.return_value = ''
+
+        with mock.patch('juju_docean.constraints.solve_constraints',
+                        return_value=('512mb', 'nyc3')):
+            self.cmd.run()
+
+        self.assertEqual(
+            len(self.provider.launch_instances.call_args[0][1]), 1)
+        self.assertEqual(mock_ssh.run.call_count, 2)
+        self.assertEqual(
+            self.provider.client.rename_droplet.call_count, 2)
+        mock_refill.assert_called_once_with('docean')
+
+
+class BuildImageTest(CommandBase):
+
+    def setUp(self):
+        super(BuildImageTest, self).setUp()
+        self.cmd = BuildImage(self.config, self.provider, self.env)
+
+    @mock.patch('juju_docean.commands.ssh')
+    @mock.patch('juju_docean.commands.ops.MachineAdd')
+    @mock.patch('juju_docean.constraints.get_images')
+    def test_build_image(self, mock_get_images, mock_add, mock_ssh):
+        mock_get_images.return_value = IMAGE_MAP
+        self.setup_env()
+        instance = Droplet.from_dict(dict(id=5, ip_address='10.0.1.5'))
+        mock_add.return_value.run.return_value = instance
+        self.provider.snapshot_instance.return_value = Image.from_dict(dict(
+            id=99, name='juju-image-precise', regions=['nyc3']))
+        self.cmd.run()
+
+        mock_ssh.prepare_image.assert_called_once_with(
+            '10.0.1.5', master=mock_add.return_value.master)
+        self.assertTrue(
+            self.provider.snapshot_instance.call_args[0][1].startswith(
+                'juju-image-precise-'))
+        self.provider.terminate_instance.assert_called_once_with(5)
+        self.assertEqual(
+            self.cmd.get_snapshots().data['precise']['image_id'], 99)
+        self.provider.catalog.invalidate.assert_called_once_with('images')
+
+
+class MachineUserDataRegisterTest(CommandBase):
+
+    def test_user_data_dispatch(self):
+        op = MachineUserDataRegister(
+            self.provider, self.env, {}, names=[], series='trusty')
+        single = op.user_data([('docean-a', '1', 'echo a')])
+        self.assertEqual(
+            single,
+            "#!/bin/bash\nexec >> /var/log/juju-provision.log 2>&1\necho a")
+        multi = op.user_data(
+            [('docean-a', '1', 'echo a'), ('docean-b', '2', 'echo b')])
+        self.assertTrue(multi.startswith(op.script_header))
+        self.assertIn('docean-a)\n    echo ZWNobyBh | base64 -d', multi)
+        self.assertIn('docean-b)\n    echo ZWNobyBi | base64 -d', multi)
+
+    def test_batches_fit_user_data_limit(self):
+        op = MachineUserDataRegister(
+            self.provider, self.env, {}, names=[], series='trusty')
+        op.max_user_data = 2048
+        machines = [('docean-%d' % i, str(i), 'x' * 500) for i in range(6)]
+        batches = list(op.batches(machines))
+        self.assertEqual(map(len, batches), [2, 2, 2])
+        for batch in batches:
+            self.assertLessEqual(len(op.user_data(batch)), 2048)
+
 
 class TerminateMachineTest(CommandBase):
 
@@ -177,17 +421,17 @@ class TerminateMachineTest(CommandBase):
 
     def test_terminate_machine(self):
         self.setup_env()
-        self.env.status.return_value = {
+        self.env.machines.return_value = MachineTable.from_cli({
             'machines': {
                 '1': {
                     'dns-name': '10.0.1.23',
                     'instance-id': 'manual:ip_address'}
-            }}
-        self.provider.get_instances.return_value = [
+            }})
+        self.provider.iter_instances.return_value = iter([
             Droplet.from_dict(dict(
                 id=221, name="docean-123123", ip_address="10.0.1.23")),
             Droplet.from_dict(dict(
-                id=258, name="docena-209123", ip_address="10.0.1.103"))]
+                id=258, name="docena-209123", ip_address="10.0.1.103"))])
         self.config.options.machines = ["1"]
         self.cmd.run()
         self.provider.terminate_instance.assert_called_once_with(221)
@@ -202,7 +446,7 @@ class DestroyEnvironmentTest(CommandBase):
     def test_destroy_environment_force(self):
         self.config.options.force = True
         self.setup_env()
-        self.provider.get_instances.return_value = [
+        self.provider.iter_instances.return_value = iter([
             Droplet.from_dict(dict(
                 id=220, name="doceanabc", ip_address="10.0.1.19")),
             Droplet.from_dict(dict(
@@ -212,7 +456,7 @@ class DestroyEnvironmentTest(CommandBase):
             Droplet.from_dict(dict(
                 id=233, name="mary", ip_address="10.0.1.32")),
             Droplet.from_dict(dict(
-                id=234, name="loug", ip_address="10.0.1.18"))]
+                id=234, name="loug", ip_address="10.0.1.18"))])
 
         self.cmd.run()
         self.assertEqual(
@@ -224,7 +468,7 @@ class DestroyEnvironmentTest(CommandBase):
     def test_destroy_environment(self, mock_time):
         self.config.options.force = False
         self.setup_env()
-        self.env.status.return_value = {
+        self.env.machines.return_value = MachineTable.from_cli({
             'machines': {
                 '0': {
                     'dns-name': '10.0.1.23',
@@ -232,12 +476,12 @@ class DestroyEnvironmentTest(CommandBase):
                 '1': {
                     'dns-name': '10.0.1.25',
                     'instance-id': 'manual:ip_address'}
-            }}
-        self.provider.get_instances.return_value = [
+            }})
+        self.provider.iter_instances.return_value = iter([
             Droplet.from_dict(dict(
                 id=221, name="docean-123123", ip_address="10.0.1.23")),
             Droplet.from_dict(dict(
-                id=258, name="docena-209123", ip_address="10.0.1.25"))]
+                id=258, name="docena-209123", ip_address="10.0.1.25"))])
 
         # Destroy Env has a sleep / mock it out.
         mock_time.sleep.return_value = None
@@ -251,7 +495,7 @@ class DestroyEnvironmentTest(CommandBase):
     def test_destroy_environment_with_missing_iaas_machine(self, mock_time):
         self.config.options.force = False
         self.setup_env()
-        self.env.status.return_value = {
+        self.env.machines.return_value = MachineTable.from_cli({
             'machines': {
                 '0': {
                     'dns-name': '10.0.1.23',
@@ -262,12 +506,12 @@ class DestroyEnvironmentTest(CommandBase):
                 '2': {
                     'dns-name': '10.0.1.27',
                     'instance-id': 'manual:ip_address'}
-            }}
-        self.provider.get_instances.return_value = [
+            }})
+        self.provider.iter_instances.return_value = iter([
             Droplet.from_dict(dict(
                 id=221, name="docean-123123", ip_address="10.0.1.23")),
             Droplet.from_dict(dict(
-                id=258, name="docena-209123", ip_address="10.0.1.25"))]
+                id=258, name="docena-209123", ip_address="10.0.1.25"))])
 
         # Destroy Env has a sleep / mock it out.
         mock_time.sleep.return_value = None
@@ -275,9 +519,7 @@ class DestroyEnvironmentTest(CommandBase):
         self.assertEqual(
             self.provider.terminate_instance.call_args_list,
             [mock.call(258), mock.call(221)])
-        self.assertEqual(
-            self.env.terminate_machines.call_args_list,
-            [mock.call(['1']), mock.call(['2'])])
+        self.env.terminate_machines.assert_called_once_with(['1', '2'])
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,7 +5,8 @@ from base import Base
 
 from juju_docean.client import Region, Size
 from juju_docean.constraints import (
-    solve_constraints, size_to_resources, init)
+    solve_constraints, size_to_resources, init, get_scheduler, SizeIndex)
+from juju_docean.exceptions import ConstraintError
 
 
 class ConstraintTests(Base):
@@ -39,3 +40,49 @@ class ConstraintTests(Base):
              'CpuCores': 1,
              'Arch': 'amd64',
              'RootDisk': 30720})
+
+    def test_unmatched_constraints(self):
+        self.assertRaises(
+            ConstraintError, solve_constraints, "region=nyc2, mem=1t")
+
+    def test_scheduler_placements(self):
+        placements = get_scheduler("mem=2G").placements
+        self.assertTrue(len(placements) > 1)
+        self.assertEqual(
+            set(s for s, p in placements.values()), set(['2gb']))
+        self.assertEqual(
+            get_scheduler("region=ams3, mem=2G").placements.keys(), ['ams3'])
+
+
+class SizeIndexTests(Base):
+
+    def setUp(self):
+        self.sizes = dict((s.id, s) for s in [
+            Size.from_dict(dict(
+                id='512mb', price=5.0, memory=512, cpus=1, disk=20,
+                transfer=1, regions=['nyc3'])),
+            Size.from_dict(dict(
+                id='1gb', price=10.0, memory=1024, cpus=1, disk=30,
+                transfer=2, regions=['nyc3', 'sfo1'])),
+            Size.from_dict(dict(
+                id='2gb', price=20.0, memory=2048, cpus=2, disk=40,
+                transfer=3, regions=['nyc3', 'sfo1']))])
+        self.index = SizeIndex(self.sizes, [
+            Region.from_dict(dict(
+                id='nyc3', slug='nyc3', sizes=['512mb', '1gb'])),
+            Region.from_dict(dict(
+                id='sfo1', slug='sfo1', sizes=['512mb', '1gb', '2gb']))])
+
+    def test_region_availability(self):
+        self.assertEqual(self.index.cheapest('sfo1', {}), '1gb')
+        self.assertEqual(self.index.cheapest('nyc3', {'cpus': 2}), None)
+        self.assertEqual(self.index.cheapest('sfo1', {'cpus': 2}), '2gb')
+
+    def test_rank(self):
+        self.assertEqual(
+            self.index.rank({}), [('512mb', 'nyc3'), ('1gb', 'sfo1')])
+        self.assertEqual(
+            self.index.rank({'memory': 1024}),
+            [('1gb', 'nyc3'), ('1gb', 'sfo1')])
+        self.assertEqual(
+            self.index.rank({'memory': 1024}, ['sfo1']), [('1gb', 'sfo1')])
@@ -3,8 +3,9 @@ import mock
 import os
 import yaml
 
-from juju_docean.env import Environment
+from juju_docean.env import ConnectionPool, Environment, MachineTable
 
+from juju_docean.exceptions import RegistrationError
 from juju_docean.tests.base import Base
 
 
@@ -68,3 +69,161 @@ class EnvironmentTest(Base):
         self.env.bootstrap_jenv('1.1.1.1')
 
         self.assertNotIn('boot-docean', os.listdir(juju_home))
+
+
+class ConnectionPoolTest(Base):
+
+    def setUp(self):
+        self.connect = mock.MagicMock(
+            side_effect=lambda: mock.MagicMock())
+        self.pool = ConnectionPool(self.connect, size=2)
+
+    def test_reuse(self):
+        with self.pool.connection() as client:
+            pass
+        with self.pool.connection() as other:
+            self.assertIs(client, other)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(
+            self.pool.metrics(),
+            {'created': 1, 'reused': 1, 'discarded': 0, 'idle': 1})
+
+    def test_error_discards(self):
+        try:
+            with self.pool.connection() as client:
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        client.close.assert_called_once_with()
+        with self.pool.connection() as other:
+            self.assertIsNot(client, other)
+        self.assertEqual(self.pool.metrics()['discarded'], 1)
+
+    def test_stale_reconnect(self):
+        with self.pool.connection() as client:
+            pass
+        client.info.side_effect = IOError("closed")
+        self.pool.max_idle = -1
+        with self.pool.connection() as other:
+            self.assertIsNot(client, other)
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertEqual(self.pool.metrics()['discarded'], 1)
+
+    def test_pool_size(self):
+        clients = [self.pool.acquire() for i in range(3)]
+        for c in clients:
+            self.pool.release(c)
+        self.assertEqual(self.pool.metrics()['idle'], 2)
+        clients[-1].close.assert_called_once_with()
+        self.pool.close()
+        clients[0].close.assert_called_once_with()
+        self.assertEqual(self.pool.metrics()['idle'], 0)
+
+
+class MachineTableTest(Base):
+
+    def test_from_api(self):
+        table = MachineTable.from_api({'Machines': {
+            '0': {'Id': '0', 'DNSName': '10.0.1.23',
+                  'InstanceId': 'manual:', 'AgentState': 'started',
+                  'Series': 'trusty'},
+            '10': {'Id': '10', 'DNSName': '',
+                   'InstanceId': 'docean-abc', 'AgentState': 'pending'},
+            '2': {'Id': '2', 'DNSName': '10.0.1.25',
+                  'InstanceId': 'manual:10.0.1.25'}}})
+        self.assertEqual([m.id for m in table], ['0', '2', '10'])
+        self.assertEqual(table.by_address['10.0.1.25'].id, '2')
+        self.assertEqual(table.by_instance['docean-abc'].id, '10')
+        self.assertIsNone(table.get('10').dns_name)
+        self.assertEqual(table.get('0').agent_state, 'started')
+
+    def test_from_cli(self):
+        table = MachineTable.from_cli({'machines': {
+            '1': {'dns-name': '10.0.1.23', 'instance-id': 'manual:',
+                  'agent-state': 'started'}}})
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.by_address['10.0.1.23'].agent_state,
+                         'started')
+
+    @mock.patch('subprocess.check_output')
+    def test_machines_cli_fallback(self, run_juju):
+        env = Environment(mock.MagicMock())
+        env.connect = mock.MagicMock(side_effect=IOError("unreachable"))
+        env.pool.connect = env.connect
+        run_juju.return_value = yaml.safe_dump(
+            {'machines': {'0': {'dns-name': '10.0.1.23'}}})
+        self.assertEqual(
+            env.machines().get('0').dns_name, '10.0.1.23')
+
+    def test_machines_api(self):
+        env = Environment(mock.MagicMock())
+        client = mock.MagicMock()
+        client.status.return_value = {
+            'Machines': {'0': {'DNSName': '10.0.1.23'}}}
+        env.pool.connect = lambda: client
+        self.assertEqual(
+            env.machines().get('0').dns_name, '10.0.1.23')
+
+
+class MachineRegistrationTest(Base):
+
+    def setUp(self):
+        self.env = Environment(mock.MagicMock())
+        self.client = mock.MagicMock()
+        self.env.pool.connect = lambda: self.client
+
+    def test_register_machines(self):
+        self.client.register_machines.return_value = {
+            'Machines': [{'Machine': '1'}, {'Machine': '2'}]}
+        self.client.provisioning_script.side_effect = lambda mid, nonce: {
+            'Script': 'script-%s' % mid}
+        hardware = {'Mem': 512}
+        self.assertEqual(
+            self.env.register_machines([
+                {'name': 'docean-a', 'series': 'trusty',
+                 'hardware': hardware},
+                {'name': 'docean-b', 'series': 'trusty',
+                 'hardware': hardware}]),
+            [('1', 'script-1'), ('2', 'script-2')])
+        self.client.register_machines.assert_called_once()
+        params = self.client.register_machines.call_args[0][0]
+        self.assertEqual(
+            [p['InstanceId'] for p in params], ['docean-a', 'docean-b'])
+        self.assertTrue(params[0]['Nonce'].startswith('manual:'))
+        self.assertEqual(
+            self.client.provisioning_script.call_args_list[0],
+            mock.call('1', params[0]['Nonce']))
+
+    def test_register_machines_error(self):
+        self.client.register_machines.return_value = {
+            'Machines': [{'Error': {'Message': 'bad series'}}]}
+        self.assertRaises(
+            RegistrationError, self.env.register_machines,
+            [{'name': 'docean-a', 'series': 'foo', 'hardware': {}}])
+        self.assertFalse(self.client.destroy_machines.called)
+
+    def test_register_machines_partial_failure(self):
+        self.client.register_machines.return_value = {
+            'Machines': [{'Machine': '1'}, {'Machine': '2'},
+                         {'Error': {'Message': 'bad series'}}]}
+        self.client.provisioning_script.side_effect = [
+            {'Script': 'script-1'}, IOError("closed")]
+        self.assertRaises(
+            IOError, self.env.register_machines,
+            [{'name': 'docean-%s' % n, 'series': 'trusty', 'hardware': {}}
+             for n in 'abc'])
+        self.client.destroy_machines.assert_called_once_with(
+            ['1', '2'], force=True)
+
+    def test_terminate_machines(self):
+        self.env.terminate_machines(['1', '2'])
+        self.client.destroy_machines.assert_called_once_with(
+            ['1', '2'], force=True)
+
+    @mock.patch('subprocess.check_output')
+    def test_terminate_machines_cli_fallback(self, run_juju):
+        self.client.destroy_machines.side_effect = IOError("closed")
+        self.env.terminate_machines(['1', '2'])
+        self.assertEqual(
+            run_juju.call_args[0][0],
+            ['juju', 'terminate-machine', '--force', '1', '2'])
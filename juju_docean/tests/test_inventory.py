@@ -0,0 +1,107 @@
+import mock
+
+from juju_docean.client import Droplet
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean.inventory import DropletInventory, env_name_of
+from juju_docean.provider import DigitalOcean, env_tag
+from juju_docean.tests.base import Base
+
+
+class InventoryTest(Base):
+
+    def setUp(self):
+        self.provider = mock.MagicMock()
+        self.provider.iter_instances.side_effect = lambda: iter([
+            self.droplet(1, "docean-0", "10.0.1.1", "nyc3"),
+            self.droplet(2, "docean-abc", "10.0.1.2", "nyc3"),
+            self.droplet(3, "other-env-0", "10.0.1.3", "sfo1"),
+            self.droplet(4, "mary", "10.0.1.4", "sfo1")])
+        self.inventory = DropletInventory(self.provider)
+
+    def droplet(self, id, name, ip_address, region_id):
+        return Droplet.from_dict(dict(
+            id=id, name=name, ip_address=ip_address, region_id=region_id))
+
+    def test_env_name_of(self):
+        self.assertEqual(env_name_of("docean-0"), "docean")
+        self.assertEqual(env_name_of("my-env-abc123"), "my-env")
+        self.assertEqual(env_name_of("mary"), None)
+
+    def test_indexes(self):
+        self.assertEqual(len(self.inventory), 4)
+        self.assertEqual(
+            [d.id for d in self.inventory.environment("docean")], [1, 2])
+        self.assertEqual(
+            [d.id for d in self.inventory.environment("other-env")], [3])
+        self.assertEqual(self.inventory.address("10.0.1.4").name, "mary")
+        self.assertEqual(
+            sorted(d.id for d in self.inventory.region("sfo1")), [3, 4])
+        self.assertEqual(self.inventory.get(2).name, "docean-abc")
+        self.assertEqual(self.provider.iter_instances.call_count, 1)
+
+    def test_stream_lists_once(self):
+        self.assertEqual(len(list(self.inventory.stream())), 4)
+        self.assertEqual(len(list(self.inventory.stream())), 4)
+        self.assertEqual(self.provider.iter_instances.call_count, 1)
+
+    def test_incremental_updates(self):
+        self.inventory.load()
+        self.inventory.discard(2)
+        self.assertEqual(
+            [d.id for d in self.inventory.environment("docean")], [1])
+        self.assertIsNone(self.inventory.address("10.0.1.2"))
+
+        self.provider.get_instance.return_value = self.droplet(
+            1, "docean-0", "10.0.1.9", "nyc3")
+        self.inventory.refresh([1])
+        self.assertIsNone(self.inventory.address("10.0.1.1"))
+        self.assertEqual(self.inventory.address("10.0.1.9").id, 1)
+        self.assertEqual(self.provider.iter_instances.call_count, 1)
+
+
+class EnvironmentTagTest(Base):
+
+    def setUp(self):
+        self.client = mock.MagicMock(supports_tags=True)
+        self.client.iter_droplets.side_effect = lambda tag_name=None: iter([
+            Droplet.from_dict(dict(id=1, name="docean-0")),
+            Droplet.from_dict(dict(id=2, name="docean-abc")),
+            Droplet.from_dict(dict(id=3, name="other-env-0"))])
+        self.provider = DigitalOcean.__new__(DigitalOcean)
+        self.provider.client = self.client
+
+    def test_env_tag(self):
+        self.assertEqual(env_tag("docean"), "juju-env-docean")
+        self.assertEqual(env_tag("my env.1"), "juju-env-my_env_1")
+
+    def test_iter_instances_by_tag(self):
+        self.client.get_tag.return_value = {'name': 'juju-env-docean'}
+        list(self.provider.iter_instances("docean"))
+        self.client.iter_droplets.assert_called_once_with(
+            tag_name="juju-env-docean")
+
+    def test_iter_instances_untagged(self):
+        self.client.get_tag.return_value = None
+        self.assertEqual(
+            [d.id for d in self.provider.iter_instances("docean")], [1, 2])
+        self.client.iter_droplets.assert_called_once_with()
+
+    def test_ensure_environment_tag(self):
+        self.client.get_tag.return_value = None
+        self.assertEqual(
+            self.provider.ensure_environment_tag("docean"), "juju-env-docean")
+        self.client.create_tag.assert_called_once_with("juju-env-docean")
+        self.client.tag_droplets.assert_called_once_with(
+            "juju-env-docean", [1, 2])
+
+        self.client.reset_mock()
+        self.client.get_tag.return_value = {'name': 'juju-env-docean'}
+        self.provider.ensure_environment_tag("docean")
+        self.assertFalse(self.client.create_tag.called)
+
+    def test_tag_environment_failure_removes_tag(self):
+        self.client.tag_droplets.side_effect = ProviderAPIError(
+            mock.MagicMock(status_code=500), "error")
+        self.assertRaises(
+            ProviderAPIError, self.provider.tag_environment, "docean")
+        self.client.delete_tag.assert_called_once_with("juju-env-docean")
@@ -0,0 +1,25 @@
+import os
+
+from juju_docean import jsonfile
+from juju_docean.tests.base import Base
+
+
+class JsonFileTest(Base):
+
+    def test_round_trip(self):
+        path = os.path.join(self.mkdir(), 'state.json')
+        self.assertEqual(jsonfile.load(path, {}), {})
+        self.assertTrue(jsonfile.save(path, {'a': [1, 2]}, indent=2))
+        self.assertEqual(jsonfile.load(path), {'a': [1, 2]})
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_unreadable(self):
+        path = os.path.join(self.mkdir(), 'state.json')
+        with open(path, 'w') as fh:
+            fh.write('{"a": ')
+        self.assertEqual(jsonfile.load(path, []), [])
+
+    def test_unwritable(self):
+        path = os.path.join(self.mkdir(), 'missing', 'state.json')
+        self.assertFalse(jsonfile.save(path, {}))
+        self.assertFalse(jsonfile.save(None, {}))
@@ -0,0 +1,102 @@
+import os
+import socket
+import time
+
+import mock
+
+from juju_docean.client import Region, Size
+from juju_docean import constraints
+from juju_docean.latency import LatencyCache, probe, probe_regions
+from juju_docean.tests.base import Base
+
+
+class ProbeTest(Base):
+
+    @mock.patch('juju_docean.latency.socket.create_connection')
+    def test_probe(self, create_connection):
+        self.assertIsNotNone(probe('speedtest-nyc3.digitalocean.com'))
+        create_connection.assert_called_once_with(
+            ('speedtest-nyc3.digitalocean.com', 80), 2.0)
+        create_connection.return_value.close.assert_called_once_with()
+
+        create_connection.side_effect = socket.timeout()
+        self.assertIsNone(probe('speedtest-nyc3.digitalocean.com'))
+
+    @mock.patch('juju_docean.latency.probe')
+    def test_probe_regions(self, mock_probe):
+        mock_probe.side_effect = lambda host, timeout: {
+            'speedtest-nyc3.digitalocean.com': 0.02}.get(host)
+        self.assertEqual(
+            probe_regions(['nyc3', 'sgp1']), {'nyc3': 0.02, 'sgp1': None})
+
+
+class LatencyCacheTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'latency.json')
+        patcher = mock.patch('juju_docean.latency.probe_regions')
+        self.probe_regions = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.probe_regions.side_effect = lambda slugs: dict(
+            (s, {'nyc3': 0.02, 'sfo1': 0.08}.get(s)) for s in slugs)
+
+    def test_cached_until_stale(self):
+        cache = LatencyCache(self.path)
+        self.assertEqual(
+            cache.get(['nyc3', 'sfo1', 'sgp1']), {'nyc3': 0.02, 'sfo1': 0.08})
+        self.assertEqual(self.probe_regions.call_count, 1)
+
+        cache = LatencyCache(self.path)
+        self.assertEqual(cache.get(['nyc3']), {'nyc3': 0.02})
+        self.assertEqual(self.probe_regions.call_count, 1)
+
+        cache = LatencyCache(self.path, ttl=60)
+        cache.data['nyc3']['probed'] = time.time() - 120
+        cache.get(['nyc3', 'sfo1'])
+        self.probe_regions.assert_called_with(['nyc3'])
+
+    def test_refresh(self):
+        LatencyCache(self.path).get(['nyc3'])
+        LatencyCache(self.path, refresh=True).get(['nyc3'])
+        self.assertEqual(self.probe_regions.call_count, 2)
+
+
+class AutoRegionTest(Base):
+
+    def setUp(self):
+        sizes = {
+            '512mb': Size.from_dict(dict(
+                id='512mb', price=5.0, memory=512, cpus=1, disk=20,
+                transfer=1, regions=['sfo1', 'ams3'])),
+            '1gb': Size.from_dict(dict(
+                id='1gb', price=10.0, memory=1024, cpus=1, disk=30,
+                transfer=2, regions=['sfo1', 'ams3']))}
+        regions = [Region.from_dict(dict(id=r, slug=r, name=r))
+                   for r in ('ams3', 'sfo1')]
+        self.latency = mock.MagicMock()
+        self.latency.get.side_effect = lambda slugs: dict(
+            (s, {'ams3': 0.09, 'sfo1': 0.03}[s]) for s in slugs)
+        saved = dict((k, getattr(constraints, k)) for k in (
+            'SIZE_MAP', 'SIZES_SORTED', 'SIZE_INDEX', 'REGIONS',
+            'DEFAULT_REGION', 'LATENCY'))
+        self.addCleanup(
+            lambda: [setattr(constraints, k, v) for k, v in saved.items()])
+        constraints.init(
+            None, {'sizes': sizes, 'regions': regions}, self.latency)
+
+    def test_default_without_nyc3(self):
+        self.assertEqual(constraints.DEFAULT_REGION, constraints.AUTO_REGION)
+        self.assertEqual(constraints.solve_constraints(""), ('512mb', 'sfo1'))
+
+    def test_auto_region(self):
+        self.assertEqual(
+            constraints.solve_constraints("region=auto, mem=1G"),
+            ('1gb', 'sfo1'))
+        self.latency.get.side_effect = lambda slugs: {}
+        self.assertEqual(
+            constraints.solve_constraints("region=auto"), ('512mb', 'ams3'))
+
+    def test_auto_scheduler(self):
+        scheduler = constraints.get_scheduler("region=auto")
+        self.assertEqual(scheduler.latencies, {'ams3': 0.09, 'sfo1': 0.03})
+        self.assertEqual(scheduler.ranked(), ['sfo1', 'ams3'])
@@ -0,0 +1,63 @@
+import threading
+
+import mock
+
+from juju_docean.pipeline import Pipeline
+from juju_docean.tests.base import Base
+
+
+class PipelineTest(Base):
+
+    def test_dependencies(self):
+        pipeline = Pipeline("Test")
+        pipeline.add('a', lambda r: 1)
+        pipeline.add('b', lambda r: 2)
+        pipeline.add('sum', lambda r: r['a'] + r['b'], requires=('a', 'b'))
+        pipeline.add('double', lambda r: r['sum'] * 2, requires=('sum',))
+        self.assertEqual(
+            pipeline.run(), {'a': 1, 'b': 2, 'sum': 3, 'double': 6})
+
+    def test_independent_stages_overlap(self):
+        # Each stage waits on the other having started.
+        started = dict(a=threading.Event(), b=threading.Event())
+
+        def stage(name, other):
+            def run(results):
+                started[name].set()
+                return started[other].wait(5)
+            return run
+
+        pipeline = Pipeline("Test")
+        pipeline.add('a', stage('a', 'b'))
+        pipeline.add('b', stage('b', 'a'))
+        self.assertEqual(pipeline.run(), {'a': True, 'b': True})
+
+    def test_failure_stops_dependents(self):
+        ran = []
+
+        def fail(results):
+            raise ValueError("boom")
+
+        pipeline = Pipeline("Test")
+        pipeline.add('a', fail)
+        pipeline.add('b', lambda r: ran.append('b'), requires=('a',))
+        self.assertRaises(ValueError, pipeline.run)
+        self.assertEqual(ran, [])
+
+    def test_unknown_requirement(self):
+        pipeline = Pipeline("Test")
+        self.assertRaises(
+            ValueError, pipeline.add, 'a', lambda r: 1, ('b',))
+
+    @mock.patch('juju_docean.pipeline.log')
+    def test_report(self, log):
+        pipeline = Pipeline("Test")
+        pipeline.add('a', lambda r: 1)
+        pipeline.add('b', lambda r: 1 / 0, requires=('a',))
+        pipeline.add('c', lambda r: 1, requires=('b',))
+        self.assertRaises(ZeroDivisionError, pipeline.run)
+        pipeline.report()
+        report = log.info.call_args[0][0]
+        self.assertIn("Test stage timings:", report)
+        self.assertIn("c            skipped", report)
+        self.assertIn("total", report)
@@ -0,0 +1,112 @@
+import mock
+
+from juju_docean.client import Region, Size
+from juju_docean.constraints import SizeIndex
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean.ops import MachineUserDataRegister
+from juju_docean.placement import Scheduler
+from juju_docean.tests.base import Base
+
+
+class SchedulerTest(Base):
+
+    def setUp(self):
+        sizes = dict((s.id, s) for s in [
+            Size.from_dict(dict(
+                id='512mb', price=5.0, memory=512, cpus=1, disk=20,
+                transfer=1)),
+            Size.from_dict(dict(
+                id='1gb', price=10.0, memory=1024, cpus=1, disk=30,
+                transfer=2))])
+        self.index = SizeIndex(sizes, [
+            Region.from_dict(dict(id='nyc3', slug='nyc3')),
+            Region.from_dict(dict(id='sfo1', slug='sfo1')),
+            Region.from_dict(dict(
+                id='ams3', slug='ams3', sizes=['1gb']))])
+
+    def test_allocate_even(self):
+        scheduler = Scheduler(self.index, {'memory': 1024})
+        self.assertEqual(
+            scheduler.allocate(7),
+            [('1gb', 'ams3', 3), ('1gb', 'nyc3', 2), ('1gb', 'sfo1', 2)])
+
+    def test_allocate_weighted(self):
+        scheduler = Scheduler(
+            self.index, {},
+            latencies={'nyc3': 10.0, 'sfo1': 80.0, 'ams3': 10.0})
+        allocation = scheduler.allocate(10)
+        self.assertEqual(sum(n for s, r, n in allocation), 10)
+        counts = dict((r, n) for s, r, n in allocation)
+        # ams3 only offers the pricier size, sfo1 is far away.
+        self.assertEqual(allocation[0][:2], ('512mb', 'nyc3'))
+        self.assertTrue(counts['nyc3'] > counts['ams3'] > counts['sfo1'])
+
+    def test_region_constraint(self):
+        scheduler = Scheduler(self.index, {'region': 'sfo1'})
+        self.assertEqual(scheduler.allocate(3), [('512mb', 'sfo1', 3)])
+
+    def test_failover(self):
+        scheduler = Scheduler(self.index, {})
+        self.assertEqual(
+            scheduler.failover('nyc3', '512mb'), ('512mb', 'sfo1'))
+        self.assertEqual(scheduler.failover('sfo1', '512mb'), ('1gb', 'ams3'))
+        self.assertEqual(scheduler.failover('ams3', '1gb'), None)
+        self.assertEqual(scheduler.allocate(2), [])
+
+    def test_is_rejection(self):
+        def error(status, message):
+            return ProviderAPIError(
+                mock.MagicMock(status_code=status), message)
+
+        self.assertTrue(Scheduler.is_rejection(error(
+            422, "Region is out of capacity for this size")))
+        self.assertTrue(Scheduler.is_rejection(error(
+            422, {'id': 'unprocessable_entity',
+                  'message': 'Size is not available in this region.'})))
+        for message in [
+                "You have reached the droplet limit for your account.",
+                "Image is not available in the selected region.",
+                "Ssh key could not be found.",
+                {'id': 'unprocessable_entity'}]:
+            self.assertFalse(Scheduler.is_rejection(error(422, message)))
+        self.assertFalse(Scheduler.is_rejection(error(
+            500, "Region is out of capacity")))
+
+    def test_launch_failover(self):
+        scheduler = Scheduler(self.index, {})
+        provider = mock.MagicMock()
+        env = mock.MagicMock()
+        env.register_machines.return_value = [('1', 'echo')]
+        rejected = ProviderAPIError(
+            mock.MagicMock(status_code=422), 'Region unavailable')
+        provider.launch_instances.side_effect = [
+            rejected, [mock.MagicMock()]]
+        op = MachineUserDataRegister(
+            provider, env,
+            {'name': 'docean-a', 'size_id': '512mb', 'region_id': 'nyc3',
+             'image_id': 99},
+            series='trusty', scheduler=scheduler,
+            images={'nyc3': 99, 'sfo1': 42}.get)
+        with mock.patch('juju_docean.constraints.size_to_resources'):
+            op.run()
+        params = provider.launch_instances.call_args[0][0]
+        self.assertEqual((params['region_id'], params['image_id']),
+                         ('sfo1', 42))
+
+    def test_launch_other_errors(self):
+        for status, message in [
+                (401, 'Unauthorized'),
+                (422, 'You have reached the droplet limit.')]:
+            provider = mock.MagicMock()
+            env = mock.MagicMock()
+            env.register_machines.return_value = [('1', 'echo')]
+            provider.launch_instances.side_effect = ProviderAPIError(
+                mock.MagicMock(status_code=status), message)
+            op = MachineUserDataRegister(
+                provider, env,
+                {'name': 'docean-a', 'size_id': '512mb',
+                 'region_id': 'nyc3'},
+                series='trusty', scheduler=Scheduler(self.index, {}))
+            with mock.patch('juju_docean.constraints.size_to_resources'):
+                self.assertRaises(ProviderAPIError, op.run)
+            self.assertEqual(provider.launch_instances.call_count, 1)
@@ -0,0 +1,159 @@
+import os
+import time
+
+import mock
+
+from juju_docean.client import Droplet
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean.pool import (
+    POOL_TAG, WARMING_TAG, WarmPool, created_time)
+from juju_docean.tests.base import Base
+
+
+def iso_time(seconds_ago):
+    return time.strftime(
+        "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - seconds_ago))
+
+
+class WarmPoolTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'pool.json')
+        self.provider = mock.MagicMock()
+        self.client = self.provider.client
+        self.droplets = {POOL_TAG: [], WARMING_TAG: []}
+        self.client.iter_droplets.side_effect = lambda tag_name: iter(
+            list(self.droplets[tag_name]))
+        self.pool = WarmPool(self.provider, self.path)
+        self.pool.set_target('trusty', '1gb', 'nyc3', 42, 2, 3600)
+
+    def droplet(self, id, age, status='active', tag=POOL_TAG, size='1gb'):
+        d = Droplet.from_dict(dict(
+            id=id, name='juju-pool-%d' % id, status=status, size_id=size,
+            region_id='nyc3', image_id=42, created_at=iso_time(age)))
+        self.droplets[tag].append(d)
+        return d
+
+    def test_targets_persist(self):
+        pool = WarmPool(self.provider, self.path)
+        self.assertEqual(pool.target('1gb', 'nyc3', 42)['count'], 2)
+        pool.set_target('trusty', '1gb', 'nyc3', 42, 0)
+        pool = WarmPool(self.provider, self.path)
+        self.assertEqual(pool.target('1gb', 'nyc3', 42)['count'], 0)
+        # Dropped once its droplets are gone.
+        pool.expire()
+        self.assertEqual(WarmPool(self.provider, self.path).targets, [])
+
+    def test_created_time(self):
+        d = Droplet.from_dict(dict(created_at="2014-08-25T12:00:00Z"))
+        self.assertEqual(created_time(d), 1408968000)
+        self.assertEqual(created_time(Droplet.from_dict({})), None)
+
+    def test_claim(self):
+        self.droplet(1, 60)
+        self.droplet(2, 600)
+        self.droplet(3, 30, status='new')
+        claimed = self.pool.claim(
+            '1gb', 'nyc3', 42, ['docean-a'], ['juju-env-docean'])
+        self.assertEqual([d.id for d in claimed], [2])
+        self.assertEqual(claimed[0].name, 'docean-a')
+        self.assertEqual(self.client.method_calls, [
+            mock.call.iter_droplets(tag_name=POOL_TAG),
+            mock.call.iter_droplets(tag_name=WARMING_TAG),
+            mock.call.tag_droplets('juju-env-docean', [2]),
+            mock.call.untag_droplets(POOL_TAG, [2]),
+            mock.call.rename_droplet(2, 'docean-a')])
+
+    def test_claim_failure_restores(self):
+        self.droplet(1, 60)
+        self.droplet(2, 600)
+        self.droplet(3, 30)
+        failure = ProviderAPIError(mock.MagicMock(status_code=500), 'oops')
+        self.client.rename_droplet.side_effect = [{}, failure, {}]
+        self.client.untag_droplets.side_effect = [
+            {}, {}, {}, ProviderAPIError(
+                mock.MagicMock(status_code=500), 'oops')]
+        with self.assertRaises(ProviderAPIError) as e:
+            self.pool.claim(
+                '1gb', 'nyc3', 42, ['docean-a', 'docean-b'],
+                ['juju-env-docean'])
+        self.assertIs(e.exception, failure)
+        # Both are back in the pool under their old names, bar the one
+        # that couldn't be untagged from the environment.
+        self.assertEqual(self.client.tag_droplets.call_args_list[-2:], [
+            mock.call(POOL_TAG, [2]), mock.call(POOL_TAG, [1])])
+        self.client.rename_droplet.assert_called_with(2, 'juju-pool-2')
+        self.provider.terminate_instance.assert_called_once_with(1)
+
+    def test_claim_skips_gone(self):
+        self.droplet(1, 60)
+        self.droplet(2, 600)
+        self.client.rename_droplet.side_effect = [
+            ProviderAPIError(mock.MagicMock(status_code=404), 'not found'),
+            {}]
+        claimed = self.pool.claim('1gb', 'nyc3', 42, ['docean-a'])
+        self.assertEqual([d.id for d in claimed], [1])
+        self.client.rename_droplet.assert_called_with(1, 'docean-a')
+        self.assertTrue(os.path.exists(self.path + '.lock'))
+
+    def test_claim_lists_under_lock(self):
+        self.droplet(1, 60)
+        self.pool.list_members()
+        # Claimed by another process since the last listing.
+        self.droplets[POOL_TAG] = []
+        self.assertEqual(
+            self.pool.claim('1gb', 'nyc3', 42, ['docean-a']), [])
+        self.assertFalse(self.client.rename_droplet.called)
+
+    def test_claim_without_target(self):
+        self.assertEqual(
+            self.pool.claim('2gb', 'nyc3', 42, ['docean-a']), [])
+        self.assertFalse(self.client.iter_droplets.called)
+
+    def test_expire(self):
+        self.droplet(1, 60)
+        self.droplet(2, 7200)
+        self.droplet(3, 120)
+        self.droplet(4, 90, tag=WARMING_TAG)
+        self.droplet(5, 60, size='2gb')
+        self.droplet(6, 1200, tag=WARMING_TAG)
+        expired = self.pool.expire()
+        # Aged out, never verified, then the oldest beyond the count. The
+        # untargeted droplet may be another JUJU_HOME's.
+        self.assertEqual(sorted(d.id for d in expired), [2, 3, 6])
+        self.assertEqual(self.provider.terminate_instance.call_count, 3)
+
+    def test_expire_emptied_target(self):
+        self.droplet(1, 60)
+        self.droplet(2, 90, tag=WARMING_TAG)
+        self.pool.set_target('trusty', '1gb', 'nyc3', 42, 0)
+        self.assertEqual([d.id for d in self.pool.expire()], [1])
+        # Kept until the warming droplet is verified or times out.
+        self.assertEqual(len(self.pool.targets), 1)
+
+    def test_refill(self):
+        self.droplet(1, 60)
+        runner = mock.MagicMock()
+        runner.iter_results.return_value = []
+        with mock.patch('juju_docean.pool.ops.MachineAdd') as machine_add:
+            machine_add.return_value.instance.id = 7
+            self.assertEqual(self.pool.refill(runner, ['1']), 1)
+        params = machine_add.call_args[0][2]
+        self.assertEqual(params['tags'], [WARMING_TAG])
+        self.assertEqual(
+            (params['size_id'], params['region_id'], params['image_id']),
+            ('1gb', 'nyc3', 42))
+        machine_add.return_value.close.assert_called_once_with()
+        self.client.tag_droplets.assert_called_once_with(POOL_TAG, [7])
+        self.client.untag_droplets.assert_called_once_with(WARMING_TAG, [7])
+
+    def test_refill_destroys_failed(self):
+        runner = mock.MagicMock()
+        runner.iter_results.return_value = []
+        with mock.patch('juju_docean.pool.ops.MachineAdd') as machine_add:
+            machine_add.return_value.instance = None
+            machine_add.return_value.launched.id = 7
+            self.assertEqual(self.pool.refill(runner, ['1']), 0)
+        self.assertEqual(self.provider.terminate_instance.call_count, 2)
+        self.provider.terminate_instance.assert_called_with(7)
+        self.assertFalse(self.client.tag_droplets.called)
@@ -0,0 +1,57 @@
+import mock
+
+from juju_docean.ratelimit import RateLimiter
+from juju_docean.tests.base import Base
+
+
+class RateLimiterTest(Base):
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.now = 1000.0
+        patcher = mock.patch('juju_docean.ratelimit.time')
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_time.time.side_effect = lambda: self.now
+        self.limiter.cond = mock.MagicMock()
+        self.limiter.updated = self.now
+
+    def headers(self, limit, remaining, reset=0):
+        return {'RateLimit-Limit': str(limit),
+                'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(reset)}
+
+    def test_unknown_budget_unthrottled(self):
+        self.limiter.acquire()
+        self.limiter.release({})
+        self.assertEqual(self.limiter._delay(False), 0)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_learns_budget(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.limiter.release(self.headers(3600, 100))
+        # The other request is still in flight.
+        self.assertEqual(self.limiter.tokens, 99)
+        self.assertEqual(self.limiter.limit, 3600)
+
+    def test_polls_throttled_before_mutations(self):
+        self.limiter.release(self.headers(3600, 300))
+        self.assertEqual(self.limiter._delay(True), 0)
+        self.assertEqual(self.limiter._delay(False), 61)
+        self.now += 61
+        self.assertEqual(self.limiter._delay(False), 0)
+
+    def test_exhausted_waits_for_reset(self):
+        self.limiter.release(self.headers(3600, 0, reset=int(self.now) + 30))
+        self.assertEqual(self.limiter._delay(True), 30)
+
+    def test_acquire_waits(self):
+        self.limiter.release(self.headers(3600, 0))
+
+        def wait(delay):
+            self.now += delay
+        self.limiter.cond.wait.side_effect = wait
+        self.limiter.acquire(mutation=True)
+        self.limiter.cond.wait.assert_called_once_with(1.0)
+        self.assertEqual(self.limiter.in_flight, 1)
@@ -0,0 +1,155 @@
+import mock
+import requests
+
+from juju_docean.client import Client_v1, Client_v2
+from juju_docean.exceptions import ProviderAPIError
+from juju_docean.ops import MachineDestroy
+from juju_docean import retry
+from juju_docean.retry import RetryPolicy, classify
+from juju_docean.tests.base import Base
+
+
+def api_error(status, message=None):
+    return ProviderAPIError(mock.MagicMock(status_code=status), message)
+
+
+def response(status, data=None):
+    r = mock.MagicMock(status_code=status, headers={})
+    r.json.return_value = data
+    return r
+
+
+class ClassifyTest(Base):
+
+    def test_api_errors(self):
+        self.assertEqual(classify(api_error(429)), retry.RATE_LIMITED)
+        self.assertEqual(classify(api_error(503)), retry.SERVER_ERROR)
+        self.assertEqual(
+            classify(api_error(422, {'id': 'unprocessable_entity'})),
+            retry.UNPROCESSABLE)
+        self.assertEqual(classify(api_error(404, {'id': 'not_found'})), None)
+        self.assertEqual(classify(ValueError()), None)
+
+    def test_connection_errors(self):
+        try:
+            requests.get("http://127.0.0.1:1/")
+        except requests.ConnectionError, e:
+            self.assertEqual(classify(e), retry.CONNECT_ERROR)
+        self.assertEqual(
+            classify(requests.ConnectionError("reset")),
+            retry.CONNECTION_ERROR)
+        self.assertEqual(
+            classify(requests.exceptions.ReadTimeout()),
+            retry.CONNECTION_ERROR)
+
+
+@mock.patch('juju_docean.retry.time')
+class RetryPolicyTest(Base):
+
+    def test_retries_transient(self, mock_time):
+        func = mock.MagicMock(side_effect=[api_error(503), api_error(429), 1])
+        self.assertEqual(RetryPolicy().call(func, 'a'), 1)
+        self.assertEqual(func.call_count, 3)
+        func.assert_called_with('a')
+        self.assertEqual(mock_time.sleep.call_count, 2)
+
+    def test_gives_up(self, mock_time):
+        func = mock.MagicMock(side_effect=api_error(503))
+        with self.assertRaises(ProviderAPIError):
+            RetryPolicy(attempts=3).call(func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_not_retried(self, mock_time):
+        func = mock.MagicMock(side_effect=api_error(503))
+        with self.assertRaises(ProviderAPIError):
+            RetryPolicy(retry_on=retry.UNSENT).call(func)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(mock_time.sleep.called)
+
+    def test_backoff(self, mock_time):
+        policy = RetryPolicy(base_delay=2.0, max_delay=10.0)
+        with mock.patch('juju_docean.retry.random.uniform') as uniform:
+            policy.delay(0)
+            uniform.assert_called_with(0, 2.0)
+            policy.delay(2)
+            uniform.assert_called_with(0, 8.0)
+            policy.delay(5)
+            uniform.assert_called_with(0, 10.0)
+
+
+@mock.patch('juju_docean.retry.time')
+class ClientRetryTest(Base):
+
+    def test_v2_get_retried(self, mock_time):
+        client = Client_v2('abc')
+        with mock.patch.object(
+                client.session, 'request', side_effect=[
+                    response(502, None), response(200, {'droplets': []})]):
+            self.assertEqual(client.get_droplets(), [])
+
+    def test_v2_create_only_retried_if_unsent(self, mock_time):
+        client = Client_v2('abc')
+        created = response(202, {'droplet': {'id': 1}})
+        with mock.patch.object(
+                client.session, 'request',
+                side_effect=[response(429, {}), created]) as request:
+            self.assertEqual(
+                client.create_droplet('a', '512mb', 1, 'nyc3').id, 1)
+        self.assertEqual(request.call_count, 2)
+
+        with mock.patch.object(
+                client.session, 'request',
+                side_effect=[response(500, {}), created]) as request:
+            self.assertRaises(
+                ProviderAPIError,
+                client.create_droplet, 'a', '512mb', 1, 'nyc3')
+        self.assertEqual(request.call_count, 1)
+
+    def test_v2_destroy_retry_already_destroyed(self, mock_time):
+        client = Client_v2('abc')
+        with mock.patch.object(
+                client.session, 'request', side_effect=[
+                    response(503, {}), response(404, {'id': 'not_found'})]):
+            client.destroy_droplet(1)
+        with mock.patch.object(
+                client.session, 'request',
+                return_value=response(404, {'id': 'not_found'})):
+            self.assertRaises(ProviderAPIError, client.destroy_droplet, 1)
+
+    def test_v1_server_error(self, mock_time):
+        client = Client_v1('abc', 'xyz')
+        with mock.patch.object(
+                client.session, 'get', side_effect=[
+                    response(500), response(200, {
+                        'status': 'OK', 'ssh_keys': [{'id': 1}]})]):
+            self.assertEqual(
+                [k.id for k in client.get_ssh_keys()], [1])
+        with mock.patch.object(
+                client.session, 'get', side_effect=[
+                    response(500), response(200, {'status': 'OK'})]):
+            self.assertRaises(
+                ProviderAPIError,
+                client.create_droplet, 'a', 66, 1, 1)
+
+
+class MachineDestroyTest(Base):
+
+    @mock.patch('juju_docean.retry.time')
+    def test_waits_on_pending_event(self, mock_time):
+        provider = mock.MagicMock()
+        provider.terminate_instance.side_effect = [
+            api_error(422, {'id': 'unprocessable_entity'}), None]
+        MachineDestroy(
+            provider, mock.MagicMock(), {'instance_id': 1},
+            iaas_only=True).run()
+        self.assertEqual(provider.terminate_instance.call_count, 2)
+        self.assertEqual(mock_time.sleep.call_count, 1)
+
+    @mock.patch('juju_docean.retry.time')
+    def test_leaves_transient_errors_to_client(self, mock_time):
+        provider = mock.MagicMock()
+        provider.terminate_instance.side_effect = api_error(503)
+        op = MachineDestroy(
+            provider, mock.MagicMock(), {'instance_id': 1}, iaas_only=True)
+        self.assertRaises(ProviderAPIError, op.run)
+        self.assertEqual(provider.terminate_instance.call_count, 1)
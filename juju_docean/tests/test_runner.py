@@ -1,5 +1,8 @@
 
-from juju_docean.runner import Runner
+import threading
+import time
+
+from juju_docean.runner import Runner, RESOURCE_LIMITS, resource
 from base import Base
 
 
@@ -34,3 +37,35 @@ class RunnerTest(Base):
         results = list(runner.iter_results())
         self.assertEqual(len(results), 2)
         runner.stop()
+
+    def test_runner_width(self):
+        runner = Runner(num_runners=3)
+        for i in range(10):
+            runner.queue_op(FakeOp())
+        runner.start(runner.num_runners)
+        self.assertEqual(len(runner.runners), 3)
+        self.assertEqual(list(runner.iter_results()), [1] * 10)
+        runner.stop()
+
+    def test_resource_limit(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        class LimitedOp(object):
+            def run(self):
+                with resource('juju'):
+                    with lock:
+                        active.append(1)
+                        peak.append(len(active))
+                    time.sleep(0.01)
+                    with lock:
+                        active.pop()
+                return 1
+
+        runner = Runner()
+        for i in range(RESOURCE_LIMITS['juju'] * 3):
+            runner.queue_op(LimitedOp())
+        self.assertEqual(
+            len(list(runner.iter_results())), RESOURCE_LIMITS['juju'] * 3)
+        self.assertLessEqual(max(peak), RESOURCE_LIMITS['juju'])
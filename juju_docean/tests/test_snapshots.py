@@ -0,0 +1,65 @@
+import os
+
+import mock
+
+from juju_docean.client import Image
+from juju_docean.exceptions import ProviderError
+from juju_docean.provider import DigitalOcean
+from juju_docean.snapshots import SnapshotCache
+from juju_docean.tests.base import Base
+
+
+class SnapshotCacheTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'snapshots.json')
+        self.image = Image.from_dict(dict(
+            id=99, name='juju-image-trusty', regions=['nyc3', 'sfo1']))
+        self.provider = mock.MagicMock()
+        self.provider.iter_images.side_effect = lambda: iter([self.image])
+
+    def test_preferred(self):
+        SnapshotCache(self.path).record('trusty', self.image)
+        cache = SnapshotCache(self.path)
+        self.assertEqual(cache.preferred('trusty', 'nyc3', self.provider), 99)
+        self.assertEqual(cache.preferred('trusty', 'ams3', self.provider),
+                         None)
+        self.assertEqual(cache.preferred('precise', 'nyc3', self.provider),
+                         None)
+
+    def test_preferred_deleted(self):
+        SnapshotCache(self.path).record('trusty', self.image)
+        self.provider.iter_images.side_effect = lambda: iter([])
+        self.assertEqual(
+            SnapshotCache(self.path).preferred(
+                'trusty', 'nyc3', self.provider), None)
+
+
+class SnapshotInstanceTest(Base):
+
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.provider = DigitalOcean({}, client=self.client)
+        self.provider.action_interval = 0
+
+    def test_snapshot_instance(self):
+        self.client.droplet_action.side_effect = [
+            {'id': 1, 'type': 'power_off', 'status': 'completed'},
+            {'id': 2, 'type': 'snapshot', 'status': 'in-progress'}]
+        self.client.get_action.return_value = {
+            'id': 2, 'type': 'snapshot', 'status': 'completed'}
+        self.client.get_snapshots.return_value = [
+            Image.from_dict(dict(id=7, name='older')),
+            Image.from_dict(dict(id=8, name='juju-image-trusty'))]
+        image = self.provider.snapshot_instance(3, 'juju-image-trusty')
+        self.assertEqual(image.id, 8)
+        self.assertEqual(
+            self.client.droplet_action.call_args_list,
+            [mock.call(3, 'power_off'),
+             mock.call(3, 'snapshot', name='juju-image-trusty')])
+        self.client.get_action.assert_called_once_with(2)
+
+    def test_action_errored(self):
+        self.assertRaises(
+            ProviderError, self.provider.wait_on_action,
+            {'id': 1, 'type': 'snapshot', 'status': 'errored'})
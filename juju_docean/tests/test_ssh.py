@@ -0,0 +1,127 @@
+import os
+import socket
+import threading
+
+import mock
+
+from juju_docean import ssh
+from juju_docean.exceptions import SSHError, SSHUnavailable, SSHAuthError
+from juju_docean.tests.base import Base
+
+
+class ProbeTest(Base):
+
+    def serve(self, banner):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+
+        def accept():
+            conn, _ = server.accept()
+            conn.sendall(banner)
+            conn.close()
+        t = threading.Thread(target=accept)
+        t.daemon = True
+        t.start()
+        return server.getsockname()[1]
+
+    def test_probe_banner(self):
+        port = self.serve("SSH-2.0-OpenSSH_6.6.1p1 Ubuntu-2ubuntu2\r\n")
+        self.assertEqual(
+            ssh.probe_ssh('127.0.0.1', port),
+            "SSH-2.0-OpenSSH_6.6.1p1 Ubuntu-2ubuntu2")
+
+    def test_probe_closed(self):
+        port = self.serve("")
+        self.assertRaises(
+            SSHUnavailable, ssh.probe_ssh, '127.0.0.1', port)
+
+    def test_probe_refused(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.assertRaises(
+            SSHUnavailable, ssh.probe_ssh, '127.0.0.1', port)
+
+    def test_probe_not_ssh(self):
+        port = self.serve("HTTP/1.1 400 Bad Request\r\n")
+        try:
+            ssh.probe_ssh('127.0.0.1', port)
+        except SSHUnavailable:
+            self.fail("non ssh banner is not a transient error")
+        except SSHError, e:
+            self.assertIn('Unexpected banner', e.message)
+
+
+class RunTest(Base):
+
+    def run_with(self, returncode, output):
+        process = mock.MagicMock(returncode=returncode)
+        process.communicate.return_value = (output, None)
+        with mock.patch('subprocess.Popen', return_value=process) as popen:
+            try:
+                return ssh.run('10.0.0.1', ['ls'])
+            finally:
+                self.assertEqual(
+                    popen.call_args[1]['args'][-2:], ['root@10.0.0.1', 'ls'])
+
+    def test_run(self):
+        self.assertEqual(self.run_with(0, 'bin\n'), 'bin\n')
+
+    def test_run_unavailable(self):
+        self.assertRaises(
+            SSHUnavailable, self.run_with, 255,
+            "ssh: connect to host 10.0.0.1 port 22: Connection refused")
+
+    def test_run_auth(self):
+        self.assertRaises(
+            SSHAuthError, self.run_with, 255,
+            "Permission denied (publickey).")
+
+    def test_run_command_failed(self):
+        try:
+            self.run_with(2, "ls: cannot access")
+        except SSHUnavailable:
+            self.fail("remote command failure is not a transient error")
+        except SSHError, e:
+            self.assertEqual(e.output, "ls: cannot access")
+
+
+class ControlMasterTest(Base):
+
+    @mock.patch('subprocess.call')
+    def test_lifecycle(self, mock_call):
+        mock_call.return_value = 0
+        master = ssh.ControlMaster('10.0.0.1')
+        self.assertEqual(master.options(), [])
+        master.start()
+        self.assertTrue(master.running)
+        cmd = mock_call.call_args[0][0]
+        self.assertIn('ControlMaster=yes', cmd)
+        self.assertEqual(cmd[-1], 'root@10.0.0.1')
+
+        path = master.path
+        control_path = "ControlPath=%s/%%r@%%h:%%p" % path
+        self.assertEqual(master.options(), ['-o', control_path])
+        env = master.env({'PATH': '/usr/bin'})
+        self.assertEqual(env['PATH'], '%s:/usr/bin' % path)
+        with open('%s/ssh' % path) as fh:
+            self.assertIn(control_path, fh.read())
+
+        master.stop()
+        self.assertEqual(mock_call.call_args[0][0][-3:-1], ['-O', 'exit'])
+        self.assertFalse(master.running)
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch('subprocess.call')
+    def test_start_unavailable(self, mock_call):
+        def fail(cmd, stdin, stdout, stderr):
+            stderr.write("ssh: connect to host 10.0.0.1 port 22: "
+                         "Connection refused")
+            return 255
+        mock_call.side_effect = fail
+        master = ssh.ControlMaster('10.0.0.1')
+        self.assertRaises(SSHUnavailable, master.start)
+        self.assertFalse(master.running)
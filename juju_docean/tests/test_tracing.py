@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+
+import mock
+
+from juju_docean.ops import MachineAdd
+from juju_docean.runner import Runner
+from juju_docean import tracing
+from juju_docean.tests.base import Base
+
+
+class TracingTest(Base):
+
+    def setUp(self):
+        self.tracer = tracing.enable()
+        self.addCleanup(tracing.disable)
+
+    def by_name(self):
+        return dict((s.name, s) for s in self.tracer.spans)
+
+    def test_disabled(self):
+        tracing.disable()
+        with tracing.span("op") as span:
+            self.assertEqual(span, None)
+        self.assertEqual(self.tracer.spans, [])
+
+    def test_nesting(self):
+        with tracing.span("op", droplet="abc"):
+            with tracing.span("create") as create:
+                create.attrs['size'] = "2gb"
+            with tracing.span("active-wait"):
+                pass
+        spans = self.by_name()
+        self.assertEqual(spans['op'].parent_id, None)
+        self.assertEqual(spans['op'].attrs, {'droplet': 'abc'})
+        self.assertEqual(spans['create'].parent_id, spans['op'].id)
+        self.assertEqual(spans['create'].attrs, {'size': '2gb'})
+        self.assertEqual(spans['active-wait'].parent_id, spans['op'].id)
+        self.assertTrue(spans['op'].duration >= spans['create'].duration)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("create"):
+                raise ValueError("rejected")
+        self.assertEqual(
+            self.tracer.spans[0].error, "ValueError: rejected")
+        self.assertEqual(tracing.current(), None)
+
+    def test_attached(self):
+        with tracing.span("list") as parent:
+            t = threading.Thread(target=self.open_span, args=(parent,))
+            t.start()
+            t.join()
+        spans = self.by_name()
+        self.assertEqual(spans['api'].parent_id, spans['list'].id)
+        self.assertNotEqual(spans['api'].thread, spans['list'].thread)
+
+    def open_span(self, parent):
+        with tracing.attached(parent):
+            with tracing.span("api"):
+                pass
+
+    def test_runner_ops(self):
+        provider = mock.MagicMock()
+        provider.launch_instance.return_value = mock.MagicMock(id=1)
+        runner = Runner()
+        with tracing.span("AddMachine"):
+            op = MachineAdd(
+                provider, None, {'name': 'x', 'region_id': 'nyc3',
+                                 'size_id': '1gb'}, series='trusty')
+            op.verify_ssh = mock.MagicMock()
+            runner.queue_op(op)
+            list(runner.iter_results())
+        spans = self.by_name()
+        self.assertEqual(spans['op.MachineAdd'].parent_id,
+                         spans['AddMachine'].id)
+        self.assertEqual(spans['op.MachineAdd'].attrs['droplet'], 'x')
+        for phase in ('create', 'active-wait', 'ssh-ready'):
+            self.assertEqual(
+                spans[phase].parent_id, spans['op.MachineAdd'].id)
+
+    def test_export(self):
+        with tracing.span("op"):
+            with tracing.span("api", method="GET"):
+                pass
+        output = self.mkdir()
+        jsonl = os.path.join(output, "trace.jsonl")
+        self.tracer.export(jsonl, "jsonl")
+        with open(jsonl) as fh:
+            spans = [json.loads(l) for l in fh]
+        self.assertEqual([s['name'] for s in spans], ['op', 'api'])
+        self.assertEqual(spans[1]['parent_id'], spans[0]['id'])
+        self.assertEqual(spans[1]['attrs'], {'method': 'GET'})
+
+        chrome = os.path.join(output, "trace.json")
+        self.tracer.export(chrome)
+        with open(chrome) as fh:
+            events = json.load(fh)['traceEvents']
+        complete = [e for e in events if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in complete], ['op', 'api'])
+        self.assertTrue(complete[0]['dur'] >= complete[1]['dur'])
+        self.assertEqual(
+            [e['args'] for e in events if e['ph'] == 'M'],
+            [{'name': threading.current_thread().name}])
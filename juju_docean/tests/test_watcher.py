@@ -0,0 +1,104 @@
+import threading
+
+import mock
+
+from juju_docean.client import Droplet
+from juju_docean.env import MachineTable
+from juju_docean.exceptions import ProviderError
+from juju_docean.watcher import ActionWatcher, AgentWatcher
+from juju_docean.tests.base import Base
+
+
+class ActionWatcherTest(Base):
+
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.watcher = ActionWatcher(self.client)
+        self.watcher.min_interval = 0
+        self.watcher.max_interval = 0
+
+    def droplet(self, id, status):
+        return Droplet.from_dict(
+            dict(id=id, name="docean-%d" % id, status=status))
+
+    def test_batch_wait(self):
+        sweeps = [
+            [self.droplet(1, 'new'), self.droplet(2, 'new')],
+            [self.droplet(1, 'active'), self.droplet(2, 'new')],
+            [self.droplet(1, 'active'), self.droplet(2, 'active')]]
+        barrier = threading.Event()
+
+        def iter_droplets(tag_name=None):
+            barrier.wait()
+            return iter(sweeps.pop(0))
+
+        self.client.iter_droplets.side_effect = iter_droplets
+        threads = []
+        for i in (1, 2):
+            t = threading.Thread(
+                target=self.watcher.wait, args=(self.droplet(i, 'new'),))
+            t.start()
+            threads.append(t)
+        barrier.set()
+        for t in threads:
+            t.join(5)
+            self.assertFalse(t.is_alive())
+        self.assertEqual(self.client.iter_droplets.call_count, 3)
+        self.assertEqual(self.watcher.pending, {})
+        self.assertLess(self.watcher.estimate, ActionWatcher.initial_estimate)
+
+    def test_sweep_by_tag(self):
+        self.client.iter_droplets.side_effect = lambda tag_name: iter([
+            self.droplet(1, 'active')])
+        self.watcher.wait(self.droplet(1, 'new'), 'juju-env-x')
+        self.client.iter_droplets.assert_called_once_with(
+            tag_name='juju-env-x')
+
+    def test_timeout(self):
+        self.watcher.timeout = -1
+        self.client.iter_droplets.return_value = iter(
+            [self.droplet(1, 'new')])
+        self.assertRaises(
+            ProviderError, self.watcher.wait, self.droplet(1, 'new'))
+
+    def test_next_interval(self):
+        self.watcher.min_interval = 3
+        self.watcher.max_interval = 30
+        self.assertEqual(self.watcher.next_interval(), 3)
+        with mock.patch('juju_docean.watcher.time') as mock_time:
+            mock_time.time.return_value = 100
+            self.watcher.pending[1] = mock.MagicMock(started=100)
+            self.assertEqual(self.watcher.next_interval(), 30)
+            self.watcher.pending[2] = mock.MagicMock(started=60)
+            self.assertEqual(self.watcher.next_interval(), 10)
+            self.watcher.pending[3] = mock.MagicMock(started=30)
+            self.assertEqual(self.watcher.next_interval(), 3)
+
+
+class AgentWatcherTest(Base):
+
+    def status(self, **states):
+        return MachineTable.from_cli({'machines': dict(
+            (mid.strip('m'), {'agent-state': state[0],
+                              'agent-state-info': state[1]})
+            for mid, state in states.items())})
+
+    def test_wait(self):
+        env = mock.MagicMock()
+        env.machines.side_effect = [
+            self.status(m1=('pending', None), m2=('pending', None)),
+            self.status(m1=('started', None), m2=('error', 'no tools')),
+        ]
+        watcher = AgentWatcher(env)
+        watcher.interval = 0
+        self.assertEqual(
+            watcher.wait(['1', '2']), (['1'], {'2': 'no tools'}, []))
+        self.assertEqual(env.machines.call_count, 2)
+
+    def test_timeout(self):
+        env = mock.MagicMock()
+        env.machines.return_value = self.status(m1=('pending', None))
+        watcher = AgentWatcher(env)
+        watcher.interval = 0
+        watcher.timeout = 0
+        self.assertEqual(watcher.wait(['1', '3']), ([], {}, ['1', '3']))
@@ -0,0 +1,154 @@
+"""
+Timing spans for op phases and api calls.
+
+Spans nest per thread, so api calls made while an op is in a phase are
+recorded as children of that phase. Tracing is off unless enabled, in
+which case finished spans are kept in memory and can be exported as
+json lines, or in the chrome trace event format for viewing in
+chrome://tracing or perfetto.
+"""
+from contextlib import contextmanager
+import itertools
+import json
+import os
+import threading
+import time
+
+TRACER = None
+
+_local = threading.local()
+
+
+class Span(object):
+
+    __slots__ = ('id', 'parent_id', 'name', 'attrs', 'start', 'end',
+                 'thread', 'error')
+
+    def __init__(self, id, parent_id, name, attrs):
+        self.id = id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.thread = threading.current_thread().name
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def to_json(self):
+        return {'id': self.id, 'parent_id': self.parent_id,
+                'name': self.name, 'start': self.start,
+                'duration': self.duration, 'thread': self.thread,
+                'error': self.error, 'attrs': self.attrs}
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.spans = []
+        self.started = time.time()
+
+    def start(self, name, parent, attrs):
+        with self.lock:
+            span_id = next(self.ids)
+        return Span(span_id, parent and parent.id or None, name, attrs)
+
+    def finish(self, span):
+        span.end = time.time()
+        with self.lock:
+            self.spans.append(span)
+
+    def export_jsonl(self, fh):
+        for span in sorted(self.spans, key=lambda s: s.start):
+            fh.write(json.dumps(span.to_json()) + "\n")
+
+    def export_chrome(self, fh):
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.attrs)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name, 'cat': span.name.split('.')[0],
+                'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': int((span.start - self.started) * 1e6),
+                'dur': int(span.duration * 1e6), 'args': args})
+        for name, tid in threads.items():
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': name}})
+        fh.write(json.dumps({'traceEvents': events}))
+
+    def export(self, path, format='chrome'):
+        with open(path, 'w') as fh:
+            if format == 'jsonl':
+                self.export_jsonl(fh)
+            else:
+                self.export_chrome(fh)
+
+
+def enable():
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+
+def disable():
+    global TRACER
+    TRACER = None
+
+
+def current():
+    """Return the innermost open span of this thread.
+    """
+    stack = getattr(_local, 'stack', None)
+    return stack and stack[-1] or None
+
+
+@contextmanager
+def attached(parent):
+    """Make spans opened in this thread children of another thread's span,
+    for threads doing work on its behalf.
+    """
+    if parent is None:
+        yield
+        return
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(parent)
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Record a span around a block, as a child of the thread's current
+    span, yielding it so attributes can be added. Yields None when tracing
+    is off.
+    """
+    tracer = TRACER
+    if tracer is None:
+        yield None
+        return
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    s = tracer.start(name, current(), attrs)
+    _local.stack.append(s)
+    try:
+        yield s
+    except Exception, e:
+        s.error = "%s: %s" % (e.__class__.__name__, e)
+        raise
+    finally:
+        _local.stack.pop()
+        tracer.finish(s)
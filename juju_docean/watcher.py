@@ -0,0 +1,171 @@
+"""
+Batched waiting on droplet creation and juju machine agents.
+
+Rather than each op polling its own create event, pending droplets are
+registered with a shared watcher that lists droplets once per sweep and
+wakes the waiting ops as their droplets become active. Machines
+provisioned by user data are likewise waited on with one environment
+status call per sweep, until their agents report in.
+"""
+import logging
+import threading
+import time
+
+from juju_docean.exceptions import ProviderError
+
+log = logging.getLogger("juju.docean")
+
+
+class Waiter(object):
+
+    def __init__(self, instance, tag=None):
+        self.instance = instance
+        self.tag = tag
+        self.started = time.time()
+        self.event = threading.Event()
+        self.status = None
+        self.error = None
+
+    def finish(self, error=None):
+        self.error = error
+        self.event.set()
+
+
+class ActionWatcher(object):
+
+    # Takes on average 1m for a do instance, refined by observation.
+    initial_estimate = 60.0
+    min_interval = 3.0
+    max_interval = 30.0
+    # After 3.5m for instance, just bail as provider error.
+    timeout = 210
+
+    def __init__(self, client):
+        self.client = client
+        self.estimate = self.initial_estimate
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def wait(self, instance, tag=None):
+        """Block until the instance is active.
+
+        Instances launched with a tag are looked for among droplets with
+        that tag, rather than every droplet on the account.
+        """
+        waiter = Waiter(instance, tag)
+        with self.lock:
+            self.pending[instance.id] = waiter
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise waiter.error
+        log.debug("Instance %s ready", instance.name)
+
+    def run(self):
+        while True:
+            time.sleep(self.next_interval())
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("Error while checking pending instances")
+                self.expire()
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+
+    def next_interval(self):
+        """Poll sparingly until the oldest pending droplet nears the
+        expected provisioning time, then poll at the minimum interval.
+        """
+        with self.lock:
+            if not self.pending:
+                return self.min_interval
+            oldest = min(w.started for w in self.pending.values())
+        remaining = self.estimate - (time.time() - oldest)
+        return min(self.max_interval, max(self.min_interval, remaining / 2))
+
+    def sweep(self):
+        with self.lock:
+            waiters = self.pending.items()
+        # One full listing covers any waiters without a tag.
+        tags = set(w.tag for _, w in waiters)
+        if None in tags:
+            tags = [None]
+        statuses = {}
+        for tag in tags:
+            statuses.update(
+                (d.id, d.status)
+                for d in self.client.iter_droplets(tag_name=tag))
+        for droplet_id, waiter in waiters:
+            waiter.status = statuses.get(droplet_id)
+            if waiter.status == 'active':
+                self.observe(time.time() - waiter.started)
+                self.complete(droplet_id)
+            else:
+                log.debug("Waiting on instance %s status: %s",
+                          waiter.instance.name, waiter.status)
+        self.expire()
+
+    def observe(self, elapsed):
+        # Exponentially weighted so the estimate tracks current conditions.
+        self.estimate = 0.7 * self.estimate + 0.3 * elapsed
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            waiters = self.pending.items()
+        for droplet_id, waiter in waiters:
+            if now - waiter.started > self.timeout:
+                self.complete(droplet_id, ProviderError(
+                    "Failed to get running instance %s status: %s" % (
+                        waiter.instance.name, waiter.status)))
+
+    def complete(self, droplet_id, error=None):
+        with self.lock:
+            waiter = self.pending.pop(droplet_id, None)
+        if waiter is not None:
+            waiter.finish(error)
+
+
+class AgentWatcher(object):
+    """Wait for juju machine agents to start.
+
+    Machines provisioned from user data report completion by their agent
+    connecting to the state server, so no ssh to the machines is needed.
+    """
+
+    interval = 10
+    # Boot, package installs and tools download.
+    timeout = 900
+
+    def __init__(self, env):
+        self.env = env
+
+    def wait(self, machine_ids):
+        """Return (started ids, {failed id: info}, timed out ids).
+        """
+        pending = set(machine_ids)
+        started, failed = [], {}
+        max_time = time.time() + self.timeout
+        while pending:
+            machines = self.env.machines()
+            for machine_id in sorted(pending):
+                m = machines.get(machine_id)
+                state = m is not None and m.agent_state or None
+                if state == 'started':
+                    started.append(machine_id)
+                elif state == 'error':
+                    failed[machine_id] = m.agent_state_info or state
+                else:
+                    continue
+                pending.remove(machine_id)
+            if not pending or time.time() > max_time:
+                break
+            log.debug("Waiting on %d machine agents", len(pending))
+            time.sleep(self.interval)
+        return started, failed, sorted(pending)